@@ -1,6 +1,8 @@
 import streamlit as st
 from functions import *
 import os
+import time
+import zlib
 from pathlib import Path
 
 # Configuration de la page Streamlit
@@ -93,7 +95,8 @@ st.markdown('<div class="main-header">Capgemini AI Multi-Agent System</div>', un
 
 # Initialisation des variables de session
 if "messages" not in st.session_state:
-    st.session_state.messages = []
+    # Backend partagé : reprend la conversation commencée sur une autre réplique (identifiant porté par l'URL)
+    st.session_state.messages = load_conversation()
 if "processing" not in st.session_state:
     st.session_state.processing = False
 if "orchestration_mode" not in st.session_state:
@@ -116,35 +119,107 @@ if "progress_text" not in st.session_state:
     st.session_state.progress_text = ""
 if "progress_value" not in st.session_state:
     st.session_state.progress_value = 0.0
-
-# Barre latérale pour la configuration
-with st.sidebar:
-    # Affichage du logo (avec fallback)
-    try:
-        current_dir = Path(__file__).parent
-        image_path = os.path.join(current_dir, "assets", "capgemini.png")
-        if os.path.exists(image_path):
-            st.image(image_path, width=190)
-        else:
-            # Fallback if image can't be loaded
-            st.markdown("### Capgemini AI")
-    except Exception:
-        # Fallback if image can't be loaded
-        st.markdown("### Capgemini AI")
-    
-    # Validation de la configuration Bedrock
-    missing_agents = []
-    for agent_key in AGENTS.keys():
-        if agent_key not in AGENT_IDS or not AGENT_IDS[agent_key] or agent_key not in AGENT_ALIAS_IDS or not AGENT_ALIAS_IDS[agent_key]:
-            missing_agents.append(agent_key)
-    
-    if missing_agents:
-        st.error(f"⚠️ Configuration manquante pour: {', '.join(missing_agents)}")
-        st.info("Vérifiez votre configuration")
-    else:
-        st.success("✅ Tous les agents Bedrock sont configurés")
-    
-    # NOUVEAU : Bouton de test de connexion
+if "uploader_generation" not in st.session_state:
+    st.session_state.uploader_generation = 0
+if "history_archive" not in st.session_state:
+    st.session_state.history_archive = {"count": 0, "data": b""}
+if "result_store" not in st.session_state:
+    st.session_state.result_store = ResultStore(backend=get_state_backend())
+
+# Endpoint /metrics (thread démon démarré une seule fois par processus)
+start_metrics_server()
+
+# Tour interrompu (bouton Arrêter ou autre interaction) : le script a été relancé en plein traitement
+cancelled_turn = st.session_state.get("turn_cancellation")
+if cancelled_turn is not None and cancelled_turn.cancelled and st.session_state.processing:
+    st.session_state.processing = False
+    st.session_state.progress_text = ""
+    interrupted = PipelineResult.interrupted(cancelled_turn.partial_results, st.session_state.orchestration_mode)
+    st.session_state.messages.append({"role": "assistant", "content": interrupted.combined, "result": interrupted})
+    st.session_state.turn_cancellation = None
+    st.session_state.turn_live_output = None
+    save_conversation(st.session_state.messages)
+
+# Conversation enregistrée entre-temps par un autre onglet : celui-ci a continué sous un nouvel identifiant
+if st.session_state.pop("conversation_forked", False):
+    st.info("ℹ️ Cette conversation a été modifiée dans un autre onglet : elle continue ici sous un nouveau lien.")
+
+# Nombre de messages récents rendus individuellement, les plus anciens sont archivés
+HISTORY_LIVE_WINDOW = 20
+
+@st.cache_data(show_spinner=False)
+def render_agent_cards_html(orchestration_mode, selected_agents):
+    """Construit en un seul bloc HTML les cartes des agents de la barre latérale"""
+    cards = []
+    for agent_key in COLLABORATOR_REGISTRY:
+        # En mode single, ne pas afficher le router
+        if orchestration_mode == "single" and agent_key == "router":
+            continue
+
+        css_class = "agent-card"
+        # Logique d'affichage selon le mode
+        if orchestration_mode == "intelligent" and agent_key == "router":
+            css_class += " selected-agent"
+        elif orchestration_mode != "intelligent" and agent_key != "router" and agent_key in selected_agents:
+            css_class += " selected-agent"
+
+        # Afficher le statut de configuration
+        config_status = "✅" if (AGENT_IDS.get(agent_key) and AGENT_ALIAS_IDS.get(agent_key)) else "❌"
+
+        cards.append(f"""
+        <div class="{css_class}">
+            <div class="agent-header">{config_status} {COLLABORATOR_REGISTRY.label(agent_key)}</div>
+            <div>{COLLABORATOR_REGISTRY.description(agent_key)}</div>
+        </div>
+        """)
+    return "".join(cards)
+
+@st.cache_data(show_spinner=False)
+def render_debug_info_html(selection_method, router_response):
+    """Bloc HTML des informations de debug d'un message"""
+    return f"""
+    <div class="debug-info">
+        <b>Méthode de sélection:</b> {selection_method}<br>
+        <b>Informations routeur:</b>
+        <div class="router-response">{router_response}</div>
+    </div>
+    """
+
+def message_markdown(message):
+    """Markdown d'un message terminé, reconstruit à chaque affichage (aucune copie conservée dans la session)"""
+    agent_prefix = message["result"].display_prefix if "result" in message else ""
+    return agent_prefix + str(message["content"])
+
+def render_message(message):
+    """Affiche un message de l'historique"""
+    with st.chat_message(message["role"]):
+        st.markdown(message_markdown(message))
+
+        # Afficher les informations de debug si nécessaire
+        result = message.get("result")
+        if st.session_state.debug_mode and result is not None and result.selection_method:
+            st.markdown(render_debug_info_html(result.selection_method, result.router_response or "Non disponible"),
+                        unsafe_allow_html=True)
+
+def archived_history_markdown(messages):
+    """Transcript des anciens messages, complété de façon incrémentale et conservé compressé (zlib)"""
+    archive = st.session_state.history_archive
+    if archive["count"] > len(messages):
+        archive = {"count": 0, "data": b""}
+    markdown = zlib.decompress(archive["data"]).decode("utf-8") if archive["data"] else ""
+    if archive["count"] < len(messages):
+        new_parts = [
+            f"**{'Vous' if m['role'] == 'user' else 'Assistant'}** — {message_markdown(m)}"
+            for m in messages[archive["count"]:]
+        ]
+        markdown = "\n\n---\n\n".join(([markdown] if markdown else []) + new_parts)
+        archive = {"count": len(messages), "data": zlib.compress(markdown.encode("utf-8"), 6)}
+        st.session_state.history_archive = archive
+    return markdown
+
+@st.fragment
+def render_diagnostic_panel():
+    """Panneau de diagnostic, réexécuté seul lors d'un clic"""
     st.markdown("### 🔧 Diagnostic")
     if st.button("🧪 Tester l'Agent Routeur", help="Teste la connexion à l'agent routeur"):
         with st.spinner("Test de connexion en cours..."):
@@ -161,7 +236,41 @@ with st.sidebar:
                     """, unsafe_allow_html=True)
             else:
                 st.error(f"❌ Erreur de connexion: {test_result['error']}")
-    
+
+    if st.button("🩺 Vérifier tous les agents", help="Sonde légère de tous les agents en parallèle (résultat mis en cache)"):
+        st.session_state.show_agents_health = True
+
+    if st.session_state.get("show_agents_health"):
+        with st.spinner("Sondage des agents en cours..."):
+            health = get_agents_health()
+
+        if "error" in health:
+            st.error(f"❌ {health['error']}")
+        else:
+            rows = [
+                {
+                    "Agent": COLLABORATOR_REGISTRY.label(key) if key in COLLABORATOR_REGISTRY else key,
+                    "Statut": "✅" if probe["ok"] else "❌",
+                    "Connexion (ms)": round(probe["connect_ms"]) if probe["connect_ms"] is not None else None,
+                    "1er chunk (ms)": round(probe["first_chunk_ms"]) if probe["first_chunk_ms"] is not None else None,
+                    "Total (ms)": round(probe["total_ms"]) if probe["total_ms"] is not None else None,
+                    "Erreur": probe["error"]
+                }
+                for key, probe in health["agents"].items()
+            ]
+            st.dataframe(rows, hide_index=True, use_container_width=True)
+            st.caption(f"Vérifié à {time.strftime('%H:%M:%S', time.localtime(health['checked_at']))} "
+                       f"- cache de {HEALTH_CACHE_TTL}s")
+            if st.button("🔁 Forcer une nouvelle vérification", key="refresh_health"):
+                cached_agents_health.clear()
+                st.rerun(scope="fragment")
+
+@st.fragment
+def render_agent_settings():
+    """Mode, sélection d'agents et configuration - réexécutés sans reconstruire l'historique"""
+    previous_mode = st.session_state.orchestration_mode
+    previous_debug = st.session_state.debug_mode
+
     # Sélection du mode d'orchestration - SIMPLIFIÉ
     st.markdown("### 🎯 Mode de Fonctionnement")
     mode = st.radio(
@@ -191,9 +300,9 @@ with st.sidebar:
     if st.session_state.orchestration_mode == "sequence":
         st.markdown("### 📋 Définir la séquence d'agents")
         sequence = []
-        for agent_key, agent_info in AGENTS.items():
+        for agent_key in COLLABORATOR_REGISTRY:
             if agent_key != "router":  
-                if st.checkbox(f"{agent_info['icon']} {agent_info['name']}", key=f"seq_{agent_key}"):
+                if st.checkbox(COLLABORATOR_REGISTRY.label(agent_key), key=f"seq_{agent_key}"):
                     sequence.append(agent_key)
 
         # Permettre à l'utilisateur de définir l'ordre
@@ -209,11 +318,25 @@ with st.sidebar:
     # Si mode agent unique, sélecteur d'agent
     if st.session_state.orchestration_mode == "single":
         st.markdown("### 🎯 Sélection d'agent unique")
-        for agent_key, agent_info in AGENTS.items():
+        for agent_key in COLLABORATOR_REGISTRY:
             if agent_key != "router":
-                if st.button(f"{agent_info['icon']} {agent_info['name']}", help=agent_info['description'], key=f"btn_{agent_key}"):
+                if st.button(COLLABORATOR_REGISTRY.label(agent_key), help=COLLABORATOR_REGISTRY.description(agent_key),
+                             key=f"btn_{agent_key}"):
                     st.session_state.selected_agents = [agent_key]
 
+        st.session_state.map_reduce_mode = st.checkbox(
+            "🧩 Analyse par sections (map-reduce)", value=st.session_state.get("map_reduce_mode", False),
+            help="Les longs documents sont découpés en sections analysées en parallèle, puis les constats sont fusionnés ; "
+                 "les sections déjà analysées ne sont pas renvoyées à l'agent"
+        )
+
+        st.session_state.hedging_mode = st.checkbox(
+            "⚡ Requêtes couvertes (hedging)", value=st.session_state.get("hedging_mode", False),
+            help="Si aucun texte n'arrive dans le délai habituel (p95) de l'agent, une requête dupliquée est envoyée "
+                 "sur une session neuve et la plus rapide est conservée. La requête dupliquée ne connaît pas le contexte "
+                 "de la conversation : avec « Maintenir le contexte », seule la première question à l'agent est couverte"
+        )
+
     # Options de configuration
     st.markdown("### ⚙️ Configuration")
     st.session_state.context_mode = st.checkbox("Maintenir le contexte", value=True, 
@@ -221,6 +344,22 @@ with st.sidebar:
     
     st.session_state.debug_mode = st.checkbox("Mode debug", value=st.session_state.debug_mode,
                                             help="Affiche des informations détaillées sur le traitement")
+    st.session_state.selection_opt_out = st.checkbox(
+        "🔒 Ne pas conserver mes questions", value=st.session_state.get("selection_opt_out", False),
+        help="Vos questions ne sont pas enregistrées dans le journal qui entraîne la sélection adaptative des agents"
+    )
+    st.session_state.profiling_mode = st.checkbox("Mode profilage", value=st.session_state.get("profiling_mode", False),
+                                                help="Échantillonne le prochain tour (extraction + agents) : temps CPU vs attente "
+                                                     "et profil téléchargeable pour speedscope.app")
+
+    last_profile = st.session_state.get("last_profile")
+    if st.session_state.profiling_mode and last_profile:
+        summary = last_profile["summary"]
+        with st.expander(f"⏱️ Dernier tour : {summary['wall_ms']} ms mur, {summary['cpu_ms']} ms CPU"):
+            st.dataframe(summary["threads"], hide_index=True, use_container_width=True)
+            st.dataframe(summary["top_functions"], hide_index=True, use_container_width=True)
+            st.download_button("⬇️ Profil speedscope", last_profile["speedscope"], file_name="tour.speedscope.json",
+                               mime="application/json")
     
     # Option pour forcer le mode direct du routeur
     if st.session_state.orchestration_mode == "intelligent":
@@ -244,80 +383,145 @@ with st.sidebar:
         </div>
         """, unsafe_allow_html=True)
     
-    # Affichage du Session ID actuel si en mode debug
-    if st.session_state.debug_mode and "bedrock_session_id" in st.session_state:
-        st.markdown(f"""
-        <div class="debug-info">
-            <b>Session ID actuel:</b><br>
-            {st.session_state.bedrock_session_id}
-        </div>
-        """, unsafe_allow_html=True)
+    # Affichage des sessions Bedrock actives si en mode debug
+    if st.session_state.debug_mode:
+        user_sessions = get_session_manager().user_sessions(get_user_id())
+        if user_sessions:
+            sessions_html = "<br>".join(
+                f"{COLLABORATOR_REGISTRY.icon(s.agent_key)} {s.session_id} — {s.turns} tours, ~{s.context_chars // 4} tokens de contexte"
+                for s in user_sessions
+            )
+            st.markdown(f"""
+            <div class="debug-info">
+                <b>Sessions Bedrock actives:</b><br>
+                {sessions_html}
+            </div>
+            """, unsafe_allow_html=True)
+
+        hedge_report = get_hedge_policy().report()
+        if hedge_report:
+            with st.expander("⚡ Requêtes couvertes"):
+                st.dataframe(hedge_report, hide_index=True, use_container_width=True)
+
+        with st.expander("🧩 Gabarits de prompts (tokens fixes estimés)"):
+            st.dataframe(PROMPT_REGISTRY.report(), hide_index=True, use_container_width=True)
+
+        if st.session_state.orchestration_mode == "intelligent":
+            with st.expander("🧠 Sélection adaptative"):
+                st.dataframe(get_agent_selector().report(), hide_index=True, use_container_width=True)
+
+        breakers = get_circuit_breakers().report()
+        if breakers:
+            with st.expander("🔌 Disjoncteurs des agents"):
+                st.dataframe(breakers, hide_index=True, use_container_width=True)
+
+        with st.expander("🚦 Ordonnanceur des appels"):
+            st.dataframe(get_agent_scheduler().report(), hide_index=True, use_container_width=True)
+
+        with st.expander("💾 Mémoire de la session"):
+            st.dataframe(session_memory_report(st.session_state.messages, st.session_state.history_archive,
+                                               st.session_state.result_store),
+                         hide_index=True, use_container_width=True)
+
+    # Agents dont le disjoncteur n'est pas fermé : l'utilisateur sait qu'un appel échouera ou sera redirigé
+    for breaker in get_circuit_breakers().report(only_tripped=True):
+        icon = "⛔" if breaker["état"] == "ouvert" else "🟡"
+        retry = f", nouvel essai dans {breaker['réessai_s']} s" if breaker["réessai_s"] else ""
+        st.warning(f"{icon} {breaker['agent']} : disjoncteur {breaker['état']}{retry}")
 
     st.markdown("### 🤖 Agents disponibles")
-    for agent_key, agent_info in AGENTS.items():
-       css_class = "agent-card"
+    st.markdown(render_agent_cards_html(st.session_state.orchestration_mode, tuple(st.session_state.selected_agents)),
+                unsafe_allow_html=True)
+
+    # Le mode et le debug changent le rendu de la page principale : rerun complet
+    if st.session_state.orchestration_mode != previous_mode or st.session_state.debug_mode != previous_debug:
+        st.rerun()
+
+# Réchauffage optionnel des agents au démarrage : connexions (une fois par processus) et sessions de l'utilisateur
+if WARM_UP_AGENTS:
+    warm_up_agents()
+    warm_up_user_sessions()
+
+UPLOADER_REFRESH_INTERVAL = 1.0  # Secondes entre deux rafraîchissements du statut des extractions en cours
+
+def extraction_pending() -> bool:
+    """Au moins un fichier déposé est encore en cours d'extraction"""
+    uploaded_files = st.session_state.get(f"file_uploader_{st.session_state.uploader_generation}") or []
+    ocr = st.session_state.get("ocr1", False)
+    return any(not start_pre_extraction(uploaded_file, ocr).done() for uploaded_file in uploaded_files)
+
+def render_file_uploader():
+    """Dépôt de fichiers indépendant de l'envoi : l'extraction démarre dès l'arrivée d'un fichier"""
+    # Checkbox pour activer l'OCR
+    ocr = st.checkbox("Check the box to enable OCR to read scanned pdf that are images", key="ocr1")
+    uploaded_files = st.file_uploader("Télécharger des fichiers", accept_multiple_files=True, type=["pdf", "txt"],
+                                      key=f"file_uploader_{st.session_state.uploader_generation}")
+
+    pending = False
+    for uploaded_file in uploaded_files or []:
+        future = start_pre_extraction(uploaded_file, ocr)
+        if not future.done():
+            pending = True
+            st.caption(f"⏳ {uploaded_file.name} : extraction en cours...")
+        elif future.exception() is None and future.result():
+            document = future.result()
+            st.caption(f"✅ {uploaded_file.name} : prêt ({len(document.content)} caractères, {document.elapsed_ms:.0f} ms)")
+        else:
+            st.caption(f"❌ {uploaded_file.name} : extraction impossible")
+
+    # run_every est fixé à l'enregistrement du fragment : rerun complet pour démarrer ou arrêter le rafraîchissement
+    if pending != st.session_state.uploader_polling and not st.session_state.processing:
+        st.rerun()
+
+# Barre latérale pour la configuration
+with st.sidebar:
+    # Affichage du logo (avec fallback)
+    try:
+        current_dir = Path(__file__).parent
+        image_path = os.path.join(current_dir, "assets", "capgemini.png")
+        if os.path.exists(image_path):
+            st.image(image_path, width=190)
+        else:
+            # Fallback if image can't be loaded
+            st.markdown("### Capgemini AI")
+    except Exception:
+        # Fallback if image can't be loaded
+        st.markdown("### Capgemini AI")
     
-    # Logique d'affichage selon le mode
-       if st.session_state.orchestration_mode == "intelligent" and agent_key == "router":
-           css_class += " selected-agent"
-       elif st.session_state.orchestration_mode != "intelligent" and agent_key != "router" and agent_key in st.session_state.selected_agents:
-           css_class += " selected-agent"
+    # Validation de la configuration Bedrock (mise en cache)
+    config_status = validate_multi_agent_setup()
+    if not config_status["valid"]:
+        st.error(f"⚠️ Configuration manquante: {', '.join(config_status['issues'])}")
+        st.info("Vérifiez votre configuration")
+    else:
+        st.success("✅ Tous les agents Bedrock sont configurés")
     
-    # Afficher le statut de configuration
-       config_status = "✅" if (agent_key in AGENT_IDS and AGENT_IDS[agent_key] and agent_key in AGENT_ALIAS_IDS and AGENT_ALIAS_IDS[agent_key]) else "❌"
-
-    # CORRECTION: En mode single, ne pas afficher le router
-       if st.session_state.orchestration_mode == "single" and agent_key == "router":
-          continue
-        
-       st.markdown(f"""
-       <div class="{css_class}">
-           <div class="agent-header">{config_status} {agent_info['icon']} {agent_info['name']}</div>
-           <div>{agent_info['description']}</div>
-       </div>
-       """, unsafe_allow_html=True)
+    render_diagnostic_panel()
+    render_agent_settings()
 
     if st.button("🔄 Réinitialiser la conversation", help="Effacer l'historique de conversation"):
         st.session_state.messages = []
+        st.session_state.history_archive = {"count": 0, "data": b""}
         st.session_state.current_results = None
         st.session_state.agent_sequence = []
         st.session_state.selected_agents = []
         st.session_state.uploaded_file = []
-        # Réinitialiser le session ID Bedrock
-        if "bedrock_session_id" in st.session_state:
-            del st.session_state.bedrock_session_id
+        save_conversation([])
+        # Fermer les sessions Bedrock de l'utilisateur
+        reset_user_sessions()
         st.rerun()
 
-# Checkbox pour activer l'OCR
-ocr1 = st.checkbox("Check the box to enable OCR to read scanned pdf that are images", key="ocr1")
+# Fragment rafraîchi périodiquement tant qu'une extraction est en cours (jamais pendant un tour : un rerun l'interromprait)
+st.session_state.uploader_polling = extraction_pending() and not st.session_state.processing
+st.fragment(render_file_uploader, run_every=UPLOADER_REFRESH_INTERVAL if st.session_state.uploader_polling else None)()
 
-# Affichage de l'historique des messages en utilisant st.chat_message
-for message in st.session_state.messages:
-    if message["role"] == "user":
-        with st.chat_message("user"):
-            st.write(message["content"])
-    else:
-        # Déterminer l'icône et le nom de l'agent pour l'affichage
-        agent_prefix = ""
-        if "agent_icon" in message and "agent_name" in message:
-            agent_prefix = f"{message['agent_icon']} **{message['agent_name']}**:\n\n"
-        elif "agent_icons" in message and "agent_names" in message:
-            agent_prefix = f"{', '.join(message['agent_icons'])} **{', '.join(message['agent_names'])}**:\n\n"
-        
-        with st.chat_message("assistant"):
-            if agent_prefix:
-                st.markdown(agent_prefix)
-            st.write(message["content"])
-            
-            # Afficher les informations de debug si nécessaire
-            if st.session_state.debug_mode and "selection_method" in message:
-                st.markdown(f"""
-                <div class="debug-info">
-                    <b>Méthode de sélection:</b> {message["selection_method"]}<br>
-                    <b>Informations routeur:</b>
-                    <div class="router-response">{message.get("router_response", "Non disponible")}</div>
-                </div>
-                """, unsafe_allow_html=True)
+# Affichage de l'historique : les anciens messages en un seul bloc, les récents individuellement
+archived_messages = st.session_state.messages[:-HISTORY_LIVE_WINDOW]
+if archived_messages:
+    with st.expander(f"📜 Messages précédents ({len(archived_messages)})"):
+        st.markdown(archived_history_markdown(archived_messages))
+for message in st.session_state.messages[-HISTORY_LIVE_WINDOW:]:
+    render_message(message)
 
 # Afficher la barre de progression si nécessaire
 if st.session_state.processing:
@@ -325,39 +529,62 @@ if st.session_state.processing:
     st.progress(st.session_state.progress_value)
 
 # Section pour afficher les réponses détaillées - SEULEMENT pour les séquences
-if st.session_state.current_results and "error" not in st.session_state.current_results:
-    if st.session_state.orchestration_mode == "sequence" and "selected_agents" in st.session_state.current_results:
-        selected_agents = st.session_state.current_results["selected_agents"]
-        if len(selected_agents) > 1:
-            with st.expander("📊 Voir les réponses détaillées de chaque agent"):
-                cols = st.columns(len(selected_agents))
-                
-                for i, agent_key in enumerate(selected_agents):
-                    if agent_key in st.session_state.current_results:
-                        with cols[i]:
-                            st.markdown(f"""
-                            <div class="agent-card">
-                                <div class="agent-header">{AGENTS[agent_key]['icon']} {AGENTS[agent_key]['name']}</div>
-                                <div style="max-height: 300px; overflow-y: auto;">
-                                    {st.session_state.current_results[agent_key]}
-                                </div>
-                            </div>
-                            """, unsafe_allow_html=True)
+@st.fragment
+def render_detailed_results(result):
+    """Réponses détaillées de chaque agent, décompressées seulement quand l'utilisateur les affiche"""
+    if not st.toggle("📊 Voir les réponses détaillées de chaque agent", key="show_detailed_results"):
+        return
+    store = st.session_state.result_store
+    cols = st.columns(len(result.selected_agents))
+    for i, agent_key in enumerate(result.selected_agents):
+        # Résultats enregistrés avant l'indexation par étape : clé d'agent seule
+        digest = result.agent_digests.get(PipelineResult.step_key(i, agent_key), result.agent_digests.get(agent_key))
+        if digest is not None:
+            response = store.get(digest)
+            with cols[i]:
+                st.markdown(f'<div class="agent-header">{COLLABORATOR_REGISTRY.label(agent_key)}</div>',
+                            unsafe_allow_html=True)
+                # Texte du modèle rendu en markdown, jamais injecté dans du HTML
+                with st.container(height=300):
+                    if response is not None:
+                        st.markdown(response)
+                    else:
+                        st.caption("Réponse expirée du stockage de session")
+
+current_results = st.session_state.current_results
+if current_results is not None and not current_results.error:
+    if st.session_state.orchestration_mode == "sequence" and len(current_results.agent_digests) > 1:
+        render_detailed_results(current_results)
 
 # Chat input utilisant le composant natif de Streamlit
 user_prompt = st.chat_input("Tapez votre message ici...", disabled=st.session_state.processing)
 
 if user_prompt:
-    # Gérer les fichiers uploadés via st.file_uploader si nécessaire
-    uploaded_files = st.file_uploader("Télécharger des fichiers", accept_multiple_files=True, key="file_uploader")
+    # Fichiers déposés avant l'envoi : leur extraction a déjà démarré en arrière-plan
+    uploaded_files = st.session_state.get(f"file_uploader_{st.session_state.uploader_generation}") or []
     
     # Créer un dictionnaire pour simuler la structure attendue
     user_input_dict = {
         "text": user_prompt,
-        "files": uploaded_files if uploaded_files else []
+        "files": uploaded_files
     }
     
-    user_input = prompt_constructor(user_input_dict, ocr1)
+    # Agents destinataires du tour (permet la comparaison locale pour contracts_compare)
+    if st.session_state.orchestration_mode == "intelligent":
+        target_agents = ["router"]
+    elif st.session_state.orchestration_mode == "sequence":
+        target_agents = st.session_state.agent_sequence
+    else:
+        target_agents = st.session_state.selected_agents[:1]
+
+    # Mode profilage : échantillonnage de l'extraction et du workflow (aucun coût sinon)
+    profiler = TurnProfiler().start() if st.session_state.get("profiling_mode") else None
+
+    user_input = prompt_constructor(user_input_dict, st.session_state.get("ocr1", False), target_agents)
+
+    # Les fichiers sont joints à ce message uniquement : vider le dépôt pour le suivant
+    if uploaded_files:
+        st.session_state.uploader_generation += 1
 
     if user_input and not st.session_state.processing:
         # Afficher le message utilisateur en utilisant st.chat_message
@@ -369,80 +596,87 @@ if user_prompt:
         st.session_state.progress_text = "Initialisation du traitement..."
         st.session_state.progress_value = 0.1
 
+        # Arrêt coopératif : le clic relance le script, détecté au prochain point d'interruption du tour
+        st.button("⏹️ Arrêter le traitement", key="stop_turn")
+        st.session_state.turn_cancellation = TurnCancellation(st.empty())
+
+        # Mode séquence : une colonne par agent, remplie pendant le streaming de sa réponse
+        st.session_state.turn_live_output = None
+        if st.session_state.orchestration_mode == "sequence" and st.session_state.agent_sequence:
+            live_placeholders = {}
+            columns = st.columns(len(st.session_state.agent_sequence))
+            for step, (column, agent_key) in enumerate(zip(columns, st.session_state.agent_sequence)):
+                with column:
+                    st.markdown(f"**{COLLABORATOR_REGISTRY.label(agent_key)}**")
+                    live_placeholders[step] = st.empty()
+            st.session_state.turn_live_output = LiveAgentOutput(live_placeholders)
+
         try:
             # Utiliser la nouvelle fonction de workflow SIMPLIFIÉE
             if st.session_state.orchestration_mode == "intelligent":
                 with st.spinner("🎯 Agent Routeur en cours d'orchestration..."):
-                    result = run_async_function(run_workflow_based_on_mode, user_input, "intelligent")
+                    result = run_async_function(run_workflow_based_on_mode, user_input, "intelligent", user_prompt)
             elif st.session_state.orchestration_mode == "sequence":
                 with st.spinner("🔄 Les agents collaborent en séquence pour répondre à votre question..."):
-                    result = run_async_function(run_workflow_based_on_mode, user_input, "sequence")
+                    result = run_async_function(run_workflow_based_on_mode, user_input, "sequence", user_prompt)
             else:
-                if st.session_state.selected_agents and all(agent in AGENTS for agent in st.session_state.selected_agents):
-                    agent_name = AGENTS[st.session_state.selected_agents[0]]['name']
+                if st.session_state.selected_agents and all(agent in COLLABORATOR_REGISTRY for agent in st.session_state.selected_agents):
+                    agent_name = COLLABORATOR_REGISTRY.name(st.session_state.selected_agents[0])
                     with st.spinner(f"🤖 {agent_name} prépare votre réponse..."):
-                        result = run_async_function(run_workflow_based_on_mode, user_input, "single")
+                        result = run_async_function(run_workflow_based_on_mode, user_input, "single", user_prompt,
+                                                    st.session_state.get("turn_documents"))
                 else:
-                    result = {"error": "Veuillez sélectionner un agent dans la barre latérale pour continuer."}
+                    result = PipelineResult.failure("Veuillez sélectionner un agent dans la barre latérale pour continuer.")
 
             st.session_state.processing = False
 
-            if "error" in result:
-                st.error(result["error"])
-                st.session_state.messages.append({"role": "assistant", "content": result["error"]})
-                st.rerun()
+            # run_async_function renvoie un dict d'erreur si la boucle elle-même a échoué
+            if isinstance(result, dict):
+                result = PipelineResult.failure(result.get("error", "Erreur inconnue"))
+
+            if result.error:
+                st.error(result.error)
+                st.session_state.messages.append({"role": "assistant", "content": result.error})
             else:
+                # Réponses détaillées compressées ; celles du tour précédent ne sont plus affichables
+                st.session_state.result_store.release_result(st.session_state.current_results)
+                st.session_state.result_store.offload(result)
                 st.session_state.current_results = result
 
-                # Préparer les informations d'agent pour l'affichage dans le message
-                agent_prefix = ""
-                
-                if "agent_names" in result and "agent_icons" in result:
-                    agent_prefix = f"{', '.join(result['agent_icons'])} **{', '.join(result['agent_names'])}**:\n\n"
-                elif "agent_name" in result and "agent_icon" in result:
-                    agent_prefix = f"{result['agent_icon']} **{result['agent_name']}**:\n\n"
-                
-                # Afficher la réponse de l'assistant
-                with st.chat_message("assistant"):
-                    if agent_prefix:
-                        st.markdown(agent_prefix)
-                    st.write(result["combined"])
-                    
-                    # Afficher les informations de debug si nécessaire
-                    if st.session_state.debug_mode and "selection_method" in result:
-                        st.markdown(f"""
-                        <div class="debug-info">
-                            <b>Méthode de sélection:</b> {result["selection_method"]}<br>
-                            <b>Informations:</b>
-                            <div class="router-response">{result.get("router_response", "Non disponible")}</div>
-                        </div>
-                        """, unsafe_allow_html=True)
-
+                # Le message de l'historique référence le même objet résultat (aucune métadonnée recopiée)
                 message_data = {
                     "role": "assistant",
-                    "content": result["combined"]
+                    "content": result.combined,
+                    "result": result
                 }
 
-                if "agent_names" in result:
-                    message_data["agent_names"] = result["agent_names"]
-                    message_data["agent_icons"] = result["agent_icons"]
-                elif "agent_name" in result: 
-                    message_data["agent_name"] = result["agent_name"]
-                    message_data["agent_icon"] = result["agent_icon"]
-
-                if "selection_method" in result:
-                    message_data["selection_method"] = result["selection_method"]
-                if "router_response" in result:
-                    message_data["router_response"] = result["router_response"]
+                # Afficher la réponse de l'assistant
+                render_message(message_data)
 
                 st.session_state.messages.append(message_data)
-                st.rerun()  # Rafraîchir l'interface pour afficher le nouveau message
 
+        except ScriptControlException:
+            # Tour interrompu : flux fermés, résultats partiels récupérés au début du prochain passage
+            st.session_state.turn_cancellation.cancel()
+            if profiler is not None:
+                profiler.stop()
+            raise
         except Exception as e:
             st.session_state.processing = False
             st.error(f"Erreur lors du traitement: {str(e)}")
             st.session_state.messages.append({"role": "assistant", "content": f"Erreur lors du traitement: {str(e)}"})
-            st.rerun()
+
+        st.session_state.turn_cancellation = None
+        st.session_state.turn_live_output = None
+        save_conversation(st.session_state.messages)
+        if profiler is not None:
+            st.session_state.last_profile = profiler.stop()
+
+        # Hors du try : l'exception de rerun ne doit pas être interceptée comme une erreur
+        st.rerun()  # Rafraîchir l'interface pour afficher le nouveau message
+
+    if profiler is not None and profiler.running:
+        profiler.stop()
 
 # Pied de page
 st.markdown("""
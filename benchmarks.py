@@ -0,0 +1,345 @@
+"""
+Benchmarks locaux du système multi-agent (sans appel à Bedrock)
+
+Usage:
+    python benchmarks.py rerun --sizes 0 50 200 1000
+    python benchmarks.py chunks --count 200000
+    python benchmarks.py fuzz-split --iterations 2000
+    python benchmarks.py index --documents 2000 --queries 500
+    python benchmarks.py memory --turns 1000
+    python benchmarks.py normalize contrat1.pdf contrat2.pdf
+    python benchmarks.py scheduler --batch-users 4 --interactive 40
+"""
+import argparse
+import json
+import random
+import statistics
+import threading
+import time
+import tracemalloc
+
+# Secrets factices : les benchmarks n'invoquent jamais Bedrock
+FAKE_SECRETS = {
+    "aws": {"region": "us-east-1", "access_key_id": "bench", "secret_access_key": "bench"},
+    "bedrock": {
+        key: f"bench-{key.lower()}"
+        for key in [
+            "MANAGER_AGENT_ID", "ROUTER_AGENT_ID", "QUALITY_AGENT_ID", "DRAFT_AGENT_ID",
+            "COMPARE_AGENT_ID", "MarketComparisonAgent_ID", "NegotiationAgent_ID", "INDEX_SEARCH_AGENT_ID",
+            "MANAGER_AGENT_ALIAS_ID", "ROUTER_AGENT_ALIAS_ID", "QUALITY_AGENT_ALIAS_ID", "DRAFT_AGENT_ALIAS_ID",
+            "COMPARE_AGENT_ALIAS_ID", "MarketComparisonAgent_ALIAS_ID", "NegotiationAgent_ALIAS_ID",
+            "INDEX_SEARCH_AGENT_ALIAS_ID"
+        ]
+    }
+}
+
+def install_fake_secrets():
+    """Secrets factices installés avant le premier import de functions (lus à l'import), comme le fait AppTest"""
+    import streamlit as st
+    from streamlit.runtime.secrets import Secrets
+
+    secrets = Secrets([])
+    secrets._secrets = FAKE_SECRETS
+    st.secrets = secrets
+
+def make_history(length):
+    """Historique de conversation synthétique alternant utilisateur et assistant"""
+    from functions import PipelineResult
+
+    messages = []
+    for i in range(length):
+        if i % 2 == 0:
+            messages.append({"role": "user", "content": f"Question {i}: quelles clauses de résiliation ?"})
+        else:
+            result = PipelineResult(
+                selected_agents=("quality",),
+                combined=f"Réponse {i}: " + "La clause de résiliation prévoit un préavis de 30 jours. " * 20,
+                selection_method="Agent unique sélectionné manuellement"
+            )
+            messages.append({"role": "assistant", "content": result.combined, "result": result})
+    return messages
+
+def bench_rerun(sizes, repeats):
+    """Temps de rerun de app.py en fonction de la longueur de l'historique"""
+    from streamlit.testing.v1 import AppTest
+
+    install_fake_secrets()
+    print(f"{'historique':>10} | {'médiane (ms)':>12} | {'max (ms)':>9}")
+    for size in sizes:
+        at = AppTest.from_file("app.py", default_timeout=60)
+        at.secrets.update(FAKE_SECRETS)
+        at.session_state["messages"] = make_history(size)
+        at.run()  # premier run : imports et caches à froid
+        assert not at.exception, at.exception
+
+        timings = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            at.run()
+            timings.append((time.perf_counter() - start) * 1000)
+            assert not at.exception, at.exception
+        print(f"{size:>10} | {statistics.median(timings):>12.1f} | {max(timings):>9.1f}")
+
+def make_chunks(count, seed=0):
+    """Flux de chunks synthétique : texte brut majoritaire, quelques JSON et erreurs système"""
+    rng = random.Random(seed)
+    samples = [
+        "La clause de résiliation prévoit un préavis de trente jours. ".encode("utf-8"),
+        json.dumps({"text": "Article 4 - Pénalités de retard. "}).encode("utf-8"),
+        b"Le fournisseur garantit la conformite des livrables. ",
+        b'{"type": "RerunData", "detail": "ignored"}',
+        b"InternalServerError: retry later",
+    ]
+    weights = [70, 15, 10, 3, 2]
+    return [rng.choices(samples, weights)[0] for _ in range(count)]
+
+def legacy_chunk_text(raw):
+    """Traitement par chunk d'origine : décodage systématique puis json.loads par exception"""
+    decoded = raw.decode("utf-8")
+    if "RerunData" in decoded:
+        return None
+    if any(error in decoded for error in ["InternalServerError", "ValidationException"]):
+        return None
+    try:
+        chunk_json = json.loads(decoded)
+        if "text" in chunk_json:
+            return chunk_json["text"]
+        elif "content" in chunk_json:
+            return chunk_json["content"]
+    except json.JSONDecodeError:
+        if decoded.strip() and not decoded.startswith("{"):
+            return decoded
+    return None
+
+def bench_chunks(count, repeats):
+    """Débit de classification des chunks (chunks/seconde), ancien chemin vs matcher compilé"""
+    from functions import classify_chunk
+
+    chunks = make_chunks(count)
+    for label, func in [("ancien (decode + json.loads)", legacy_chunk_text), ("classify_chunk", classify_chunk)]:
+        timings = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            for raw in chunks:
+                func(raw)
+            timings.append(time.perf_counter() - start)
+        print(f"{label:>30} | {count / statistics.median(timings):>12,.0f} chunks/s")
+
+RECORDED_STREAM_SAMPLES = [
+    "Synthèse : la clause de résiliation anticipée prévoit un préavis de 30 jours. ✅\n",
+    "Points d'attention 🔍 : pénalités plafonnées à 10 %, révision annuelle des prix (indice Syntec).\n",
+    "Recommandation 🤝 : négocier l'échéancier — délai de paiement à 45 jours fin de mois.\n",
+]
+
+def split_at_random(data, rng, max_parts=12):
+    """Découpe des octets en chunks à des positions aléatoires (y compris au milieu d'un caractère)"""
+    cut_count = rng.randint(1, min(max_parts, max(1, len(data) - 1)))
+    cuts = sorted(rng.sample(range(1, len(data)), cut_count)) if len(data) > 1 else []
+    bounds = [0] + cuts + [len(data)]
+    return [data[start:end] for start, end in zip(bounds, bounds[1:])]
+
+def fuzz_split_streams(iterations, seed, stream_file=None):
+    """Vérifie que le parser reconstruit exactement le texte quel que soit le découpage en chunks"""
+    from functions import parse_multi_agent_response_complete
+
+    streams = [sample.encode("utf-8") for sample in RECORDED_STREAM_SAMPLES]
+    streams.append("".join(RECORDED_STREAM_SAMPLES).encode("utf-8"))
+    if stream_file:
+        with open(stream_file, "rb") as f:
+            streams.append(f.read())
+
+    rng = random.Random(seed)
+    failures = 0
+    for i in range(iterations):
+        data = streams[i % len(streams)]
+        expected = parse_multi_agent_response_complete({"completion": [{"chunk": {"bytes": data}}]})
+        chunks = split_at_random(data, rng)
+        parsed = parse_multi_agent_response_complete(
+            {"completion": [{"chunk": {"bytes": chunk}} for chunk in chunks]}, keep_raw_chunks=True
+        )
+        rebuilt = b"".join(bytes(view) for view in parsed.raw_chunks)
+        if parsed.final_response != expected.final_response or parsed.errors or rebuilt != data:
+            failures += 1
+            print(f"❌ itération {i}: découpage {[len(c) for c in chunks]} -> {parsed.errors}")
+
+    print(f"{iterations - failures}/{iterations} découpages aléatoires reconstruits à l'identique")
+    return failures == 0
+
+def bench_index(documents, queries, seed):
+    """Construction et interrogation de l'index local des contrats (SQLite FTS5, en mémoire)"""
+    from functions import ContractIndex, chunk_text
+
+    rng = random.Random(seed)
+    vocabulary = ["prestation", "maintenance", "licence", "bail", "sous-traitance", "confidentialité", "assurance",
+                  "résiliation", "pénalités", "garantie", "livraison", "paiement", "réversibilité", "audit"]
+    corpus = []
+    for i in range(documents):
+        topics = rng.sample(vocabulary, 4)
+        body = "\n\n".join(
+            f"Article {n} - {topic.capitalize()}\nLe présent article encadre la {topic} du contrat n°{i}. " * 5
+            for n, topic in enumerate(topics, start=1)
+        )
+        corpus.append((f"contrat-{i}.pdf", f"sha-{i}", chunk_text(body)))
+
+    index = ContractIndex(":memory:")
+    start = time.perf_counter()
+    for name, sha256, chunks in corpus:
+        index.add_document(name, sha256, chunks, "bench")
+    build_s = time.perf_counter() - start
+    print(f"construction : {documents} documents en {build_s * 1000:.0f} ms ({documents / build_s:,.0f} docs/s)")
+
+    timings = []
+    for _ in range(queries):
+        query = "modèle de contrat " + " ".join(rng.sample(vocabulary, 2))
+        start = time.perf_counter()
+        index.search(query, "bench")
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    print(f"requêtes : médiane {statistics.median(timings):.2f} ms, p95 {timings[int(len(timings) * 0.95) - 1]:.2f} ms")
+
+def legacy_turn(sequence, responses, agents):
+    """Tour au format historique : dict de résultat puis copie des métadonnées dans le message"""
+    result = {
+        "selected_agents": sequence,
+        "agent_names": [agents[agent]["name"] for agent in sequence],
+        "agent_icons": [agents[agent]["icon"] for agent in sequence],
+        "combined": "\n\n".join(f"{agents[k]['icon']} {agents[k]['name']}:\n{r}" for k, r in responses.items()),
+        **responses
+    }
+    message = {"role": "assistant", "content": result["combined"], "agent_names": list(result["agent_names"]),
+               "agent_icons": list(result["agent_icons"]), "selection_method": "Séquence"}
+    return result, message
+
+def typed_turn(sequence, responses, agents):
+    """Tour au format typé : un seul objet partagé par le message et current_results"""
+    from functions import PipelineResult
+
+    result = PipelineResult(
+        selected_agents=tuple(sequence),
+        combined="\n\n".join(f"{agents[k]['icon']} {agents[k]['name']}:\n{r}" for k, r in responses.items()),
+        agent_results=responses,
+        selection_method="Séquence"
+    )
+    return result, {"role": "assistant", "content": result.combined, "result": result}
+
+def bench_memory(turns):
+    """Mémoire retenue par l'historique selon le format des résultats (hors texte des réponses)"""
+    from functions import AGENTS
+
+    sequence = ["quality", "drafter", "contracts_compare"]
+    # Les textes des réponses sont créés avant la mesure : seule la structure est comptée
+    texts = [{agent: f"Réponse {i} de {agent}" for agent in sequence} for i in range(turns)]
+
+    for label, build in (("dicts", legacy_turn), ("objets typés", typed_turn)):
+        tracemalloc.start()
+        history = [build(sequence, dict(responses), AGENTS) for responses in texts]
+        retained, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"{label:>12} : {retained / turns:,.0f} octets/tour ({len(history)} tours)")
+
+def report_normalization(paths, ocr):
+    """Caractères et tokens estimés retirés par la normalisation, par document"""
+    from functions import extract_pages_from_bytes, normalize_pages
+
+    for path in paths:
+        mime_type = "application/pdf" if path.lower().endswith(".pdf") else "text/plain"
+        with open(path, "rb") as f:
+            pages, name, warnings = extract_pages_from_bytes(f.read(), path, mime_type, ocr)
+        started_at = time.perf_counter()
+        _, stats = normalize_pages(pages)
+        elapsed_ms = (time.perf_counter() - started_at) * 1000
+        print(f"{name}: {stats.pages} pages, {stats.raw_chars} -> {stats.normalized_chars} caractères "
+              f"(-{stats.saved_ratio:.1%}, ~{stats.saved_tokens} tokens), {stats.boilerplate_lines} lignes de gabarit, "
+              f"{stats.page_numbers} numéros de page, {stats.hyphenations} césures, {elapsed_ms:.1f} ms")
+
+def bench_scheduler(batch_users, shards, interactive, call_ms, slots):
+    """Latence des requêtes interactives pendant que des pipelines saturent le quota : FIFO vs file équitable"""
+    from concurrent.futures import ThreadPoolExecutor
+    from functions import FairAgentScheduler
+
+    class FifoScheduler:
+        """Référence : une seule file, premier arrivé premier servi"""
+        def __init__(self):
+            self.semaphore = threading.Semaphore(slots)
+        def submit(self, tenant, agent_key, priority):
+            self.semaphore.acquire()
+        def release(self, ticket):
+            self.semaphore.release()
+
+    def call(scheduler, tenant, priority):
+        started_at = time.perf_counter()
+        ticket = scheduler.submit(tenant, "quality", priority)
+        if ticket is not None:
+            ticket.future.result()
+        time.sleep(call_ms / 1000)
+        scheduler.release(ticket)
+        return (time.perf_counter() - started_at) * 1000
+
+    for label, scheduler in (("FIFO", FifoScheduler()),
+                             ("équitable", FairAgentScheduler(max_concurrent=slots, interactive_reserved=max(1, slots // 4)))):
+        with ThreadPoolExecutor(max_workers=batch_users * shards + interactive) as pool:
+            batch = [pool.submit(call, scheduler, f"lot-{u}", "batch") for u in range(batch_users) for _ in range(shards)]
+            time.sleep(call_ms / 1000)  # Les pipelines occupent déjà toutes les places
+            latencies = []
+            for i in range(interactive):
+                latencies.append(pool.submit(call, scheduler, f"interactif-{i}", "interactive"))
+                time.sleep(call_ms / 1000 / 4)
+            latencies = sorted(f.result() for f in latencies)
+            batch_total = max(f.result() for f in batch)
+        print(f"{label:>10} : interactif p50 {latencies[len(latencies) // 2]:.0f} ms, "
+              f"p95 {latencies[int(len(latencies) * 0.95)]:.0f} ms ; fin des lots {batch_total:.0f} ms")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks locaux")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    rerun_parser = subparsers.add_parser("rerun", help="Temps de rerun vs longueur de l'historique")
+    rerun_parser.add_argument("--sizes", type=int, nargs="+", default=[0, 50, 200, 1000])
+    rerun_parser.add_argument("--repeats", type=int, default=5)
+
+    chunks_parser = subparsers.add_parser("chunks", help="Débit de classification des chunks")
+    chunks_parser.add_argument("--count", type=int, default=200000)
+    chunks_parser.add_argument("--repeats", type=int, default=5)
+
+    fuzz_parser = subparsers.add_parser("fuzz-split", help="Découpage aléatoire des flux enregistrés")
+    fuzz_parser.add_argument("--iterations", type=int, default=2000)
+    fuzz_parser.add_argument("--seed", type=int, default=0)
+    fuzz_parser.add_argument("--stream-file", help="Flux brut enregistré (octets UTF-8) à découper")
+
+    index_parser = subparsers.add_parser("index", help="Construction et requêtes de l'index local")
+    index_parser.add_argument("--documents", type=int, default=2000)
+    index_parser.add_argument("--queries", type=int, default=500)
+    index_parser.add_argument("--seed", type=int, default=0)
+
+    memory_parser = subparsers.add_parser("memory", help="Mémoire par tour : dicts vs objets typés")
+    memory_parser.add_argument("--turns", type=int, default=1000)
+
+    normalize_parser = subparsers.add_parser("normalize", help="Gain de la normalisation sur des documents réels")
+    normalize_parser.add_argument("paths", nargs="+")
+    normalize_parser.add_argument("--ocr", action="store_true")
+
+    scheduler_parser = subparsers.add_parser("scheduler", help="Latence interactive sous charge : FIFO vs file équitable")
+    scheduler_parser.add_argument("--batch-users", type=int, default=4)
+    scheduler_parser.add_argument("--shards", type=int, default=20)
+    scheduler_parser.add_argument("--interactive", type=int, default=40)
+    scheduler_parser.add_argument("--call-ms", type=float, default=50)
+    scheduler_parser.add_argument("--slots", type=int, default=8)
+
+    args = parser.parse_args()
+    if args.command == "rerun":
+        bench_rerun(args.sizes, args.repeats)
+    elif args.command == "chunks":
+        bench_chunks(args.count, args.repeats)
+    elif args.command == "fuzz-split":
+        raise SystemExit(0 if fuzz_split_streams(args.iterations, args.seed, args.stream_file) else 1)
+    elif args.command == "index":
+        bench_index(args.documents, args.queries, args.seed)
+    elif args.command == "memory":
+        bench_memory(args.turns)
+    elif args.command == "normalize":
+        report_normalization(args.paths, args.ocr)
+    elif args.command == "scheduler":
+        bench_scheduler(args.batch_users, args.shards, args.interactive, args.call_ms, args.slots)
+
+if __name__ == "__main__":
+    main()
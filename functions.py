@@ -1,15 +1,35 @@
 import streamlit as st
+from streamlit.runtime.scriptrunner.exceptions import ScriptControlException
 import asyncio
 import boto3
 from botocore.config import Config
 import os
+import sys
 import uuid
 import json
 import time
 import PyPDF2
 from pypdf import PdfReader
-from typing import Dict, List, Optional, Tuple
+from typing import Callable, Dict, List, Optional, Tuple
+from dataclasses import asdict, dataclass, field, fields
+from abc import ABC, abstractmethod
 import re
+import string
+import codecs
+import hashlib
+import itertools
+import bisect
+import math
+import io
+import difflib
+import sqlite3
+import zlib
+import unicodedata
+import threading
+import queue
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 
 # Tentative d'import de fitz, mais pas critique si ça échoue
 try:
@@ -67,6 +87,117 @@ AGENTS = {
     "index_search": {"name": "Agent Recherche Index", "icon": "🔎", "description": "Recherche dans la base de données Azure Index pour trouver des modèles et contrats"}
 }
 
+# Alias des noms de collaborateurs Bedrock (surchargeables via st.secrets["agent_aliases"])
+DEFAULT_AGENT_ALIASES = {
+    "manager": ["management", "contract manager"],
+    "router": ["routeur", "orchestrator", "orchestrateur", "supervisor"],
+    "quality": ["qualite"],
+    "drafter": ["draft", "redacteur", "writer"],
+    "contracts_compare": ["contract compare", "compare", "comparaison de contrats"],
+    "market_comparison": ["market", "marche", "comparaison de marche"],
+    "negotiation": ["negotiator", "negociation"],
+    "index_search": ["index", "search", "recherche index"]
+}
+
+def load_agent_aliases() -> Dict[str, List[str]]:
+    """Fusionne les alias par défaut avec ceux configurés dans st.secrets"""
+    aliases = {key: list(values) for key, values in DEFAULT_AGENT_ALIASES.items()}
+    try:
+        configured = st.secrets.get("agent_aliases", {})
+    except Exception:
+        configured = {}
+    for agent_key, values in dict(configured).items():
+        if isinstance(values, str):
+            values = [values]
+        aliases.setdefault(agent_key, []).extend(values)
+    return aliases
+
+# REGISTRE DES COLLABORATEURS
+class CollaboratorRegistry:
+    """
+    Registre des agents partagé par le parser, le formatage et l'interface :
+    icônes et noms d'affichage par clé d'agent, et résolution d'un nom de collaborateur Bedrock vers sa clé
+    La résolution ne retient que le nom entier ou un alias exact (sans le mot générique "Agent"), résultats mémorisés
+    """
+
+    DEFAULT_ICON = "🤖"
+    GENERIC_WORDS = {"agent", "agents"}
+
+    def __init__(self, agents: Dict, aliases: Optional[Dict[str, List[str]]] = None):
+        self.agents = agents
+        self._keyword_to_agent = {}
+        for agent_key, agent_info in agents.items():
+            keywords = [agent_key, agent_info["name"], agent_info["name"].split("(")[0]] + list((aliases or {}).get(agent_key, []))
+            for keyword in keywords:
+                match_key = self.match_key(keyword)
+                if match_key and match_key not in self._keyword_to_agent:
+                    self._keyword_to_agent[match_key] = agent_key
+        self._cache: Dict[str, Optional[str]] = {}
+
+    @staticmethod
+    def normalize(name: str) -> str:
+        """Minuscules, sans accents ni séparateurs ("Market_Comparison-Agent" -> "marketcomparisonagent")"""
+        decomposed = unicodedata.normalize("NFKD", name or "")
+        return "".join(c for c in decomposed if c.isalnum()).lower()
+
+    @classmethod
+    def match_key(cls, name: str) -> str:
+        """Nom normalisé sans les mots génériques ("MarketComparisonAgent", "Agent Comparaison" -> "marketcomparison", "comparaison")"""
+        decomposed = "".join(c for c in unicodedata.normalize("NFKD", name or "") if not unicodedata.combining(c))
+        words = re.findall(r"[A-Z]+(?![a-z])|[A-Z]?[a-z]+|\d+", decomposed)
+        return "".join(word.lower() for word in words if word.lower() not in cls.GENERIC_WORDS)
+
+    def resolve(self, collaborator_name: str) -> Optional[str]:
+        """Retourne la clé d'agent correspondant au collaborateur, ou None"""
+        if collaborator_name not in self._cache:
+            self._cache[collaborator_name] = self._keyword_to_agent.get(self.match_key(collaborator_name))
+        return self._cache[collaborator_name]
+
+    def __iter__(self):
+        """Clés des agents, dans l'ordre de AGENTS"""
+        return iter(self.agents)
+
+    def __contains__(self, agent_key: str) -> bool:
+        return agent_key in self.agents
+
+    def icon(self, agent_key: str) -> str:
+        """Icône d'un agent par sa clé"""
+        return self.agents[agent_key]["icon"] if agent_key in self.agents else self.DEFAULT_ICON
+
+    def name(self, agent_key: str) -> str:
+        """Nom d'affichage d'un agent par sa clé (la clé elle-même si l'agent est inconnu)"""
+        return self.agents[agent_key]["name"] if agent_key in self.agents else agent_key
+
+    def description(self, agent_key: str) -> str:
+        """Description d'un agent par sa clé"""
+        return self.agents[agent_key]["description"] if agent_key in self.agents else ""
+
+    def label(self, agent_key: str) -> str:
+        """Icône et nom d'affichage d'un agent ("🔍 Agent Qualité")"""
+        return f"{self.icon(agent_key)} {self.name(agent_key)}"
+
+    def icon_for(self, collaborator_name: str) -> str:
+        """Icône de l'agent correspondant au collaborateur"""
+        return self.icon(self.resolve(collaborator_name))
+
+    def display_name_for(self, collaborator_name: str) -> str:
+        """Nom d'affichage de l'agent correspondant, ou le nom Bedrock brut"""
+        agent_key = self.resolve(collaborator_name)
+        return self.name(agent_key) if agent_key else collaborator_name
+
+COLLABORATOR_REGISTRY = CollaboratorRegistry(AGENTS, load_agent_aliases())
+
+def format_collaborator_sections(collaborator_responses: Dict, template: str = "{icon} **{name}**\n{response}") -> List[str]:
+    """Formate les réponses des collaborateurs avec l'icône résolue par le registre"""
+    return [
+        template.format(
+            icon=COLLABORATOR_REGISTRY.icon_for(agent_name),
+            name=agent_name,
+            response=agent_data.response
+        )
+        for agent_name, agent_data in collaborator_responses.items()
+    ]
+
 @st.cache_resource
 def get_bedrock_client():
     """Initialise et retourne le client Bedrock avec credentials explicites"""
@@ -94,13 +225,735 @@ def get_bedrock_client():
         st.error(f"Erreur lors de l'initialisation du client Bedrock: {str(e)}")
         return None
 
-def get_or_create_session_id():
-    """Génère un session ID unique pour maintenir la cohérence"""
-    if "bedrock_session_id" not in st.session_state:
+# ÉTAT PARTAGÉ ENTRE RÉPLIQUES - documents extraits, réponses d'agents, sessions Bedrock, conversations
+try:
+    import redis
+    REDIS_AVAILABLE = True
+except ImportError:
+    REDIS_AVAILABLE = False
+
+try:
+    STATE_BACKEND = str(st.secrets.get("state", {}).get("BACKEND", "")).lower()
+    STATE_SQLITE_PATH = st.secrets.get("state", {}).get("SQLITE_PATH", "")
+    STATE_REDIS_URL = st.secrets.get("state", {}).get("REDIS_URL", "redis://localhost:6379/0")
+    STATE_TTL_SECONDS = int(st.secrets.get("state", {}).get("TTL_SECONDS", 7 * 24 * 3600))
+except Exception:
+    STATE_BACKEND = ""  # "" : état propre au processus ; "sqlite" : fichier partagé ; "redis" : serveur Redis
+    STATE_SQLITE_PATH = ""
+    STATE_REDIS_URL = "redis://localhost:6379/0"  # "memory://" : substitut en mémoire, pour les essais
+    STATE_TTL_SECONDS = 7 * 24 * 3600  # Durée de vie par défaut des entrées partagées
+STATE_SQLITE_PATH = STATE_SQLITE_PATH or os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "shared_state.sqlite3")
+STATE_KEY_PREFIX = "capgemini-agents"
+
+class StateBackend(ABC):
+    """
+    Stockage clé/valeur partagé par les répliques, par espace de noms, avec expiration
+    Les erreurs du stockage sont traitées comme des absences : un cache indisponible ne doit pas faire échouer un tour
+    """
+
+    @abstractmethod
+    def get(self, namespace: str, key: str) -> Optional[bytes]:
+        """Valeur brute (None si absente ou expirée)"""
+
+    @abstractmethod
+    def set(self, namespace: str, key: str, value: bytes, ttl: Optional[float] = STATE_TTL_SECONDS):
+        """Écrit une valeur, expirée après ttl secondes (None : sans expiration)"""
+
+    @abstractmethod
+    def delete(self, namespace: str, key: str):
+        """Efface une valeur"""
+
+    def get_json(self, namespace: str, key: str):
+        """Valeur JSON compressée (None si absente, expirée ou illisible)"""
+        data = self.get(namespace, key)
+        if data is None:
+            return None
+        try:
+            return json.loads(zlib.decompress(data).decode("utf-8"))
+        except (zlib.error, ValueError):
+            return None
+
+    def set_json(self, namespace: str, key: str, value, ttl: Optional[float] = STATE_TTL_SECONDS):
+        self.set(namespace, key, zlib.compress(json.dumps(value, ensure_ascii=False).encode("utf-8"), 6), ttl)
+
+class SQLiteStateBackend(StateBackend):
+    """Backend SQLite (WAL) : répliques d'un même hôte ou d'un même volume local"""
+
+    PURGE_EVERY = 500  # Écritures entre deux purges des entrées expirées
+
+    def __init__(self, path: str):
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        self._lock = threading.Lock()
+        self._writes = 0
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS state ("
+                "namespace TEXT NOT NULL, key TEXT NOT NULL, value BLOB NOT NULL, expires_at REAL, "
+                "PRIMARY KEY (namespace, key))"
+            )
+
+    def get(self, namespace: str, key: str) -> Optional[bytes]:
+        try:
+            with self._lock:
+                row = self._conn.execute(
+                    "SELECT value FROM state WHERE namespace = ? AND key = ? AND (expires_at IS NULL OR expires_at > ?)",
+                    (namespace, key, time.time())
+                ).fetchone()
+        except sqlite3.Error:
+            return None
+        return row[0] if row else None
+
+    def set(self, namespace: str, key: str, value: bytes, ttl: Optional[float] = STATE_TTL_SECONDS):
+        try:
+            with self._lock, self._conn:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO state (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)",
+                    (namespace, key, value, time.time() + ttl if ttl else None)
+                )
+                self._writes += 1
+                if self._writes % self.PURGE_EVERY == 0:
+                    self._conn.execute("DELETE FROM state WHERE expires_at IS NOT NULL AND expires_at <= ?", (time.time(),))
+        except sqlite3.Error:
+            pass
+
+    def delete(self, namespace: str, key: str):
+        try:
+            with self._lock, self._conn:
+                self._conn.execute("DELETE FROM state WHERE namespace = ? AND key = ?", (namespace, key))
+        except sqlite3.Error:
+            pass
+
+class LocalRedisStandIn:
+    """Sous-ensemble en mémoire de l'API redis-py (get, set avec ex/px, delete), pour les essais sans serveur Redis"""
+
+    def __init__(self):
+        self._data: Dict[str, Tuple[bytes, Optional[float]]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, name: str) -> Optional[bytes]:
+        with self._lock:
+            entry = self._data.get(name)
+            if entry is None:
+                return None
+            if entry[1] is not None and entry[1] <= time.time():
+                del self._data[name]
+                return None
+            return entry[0]
+
+    def set(self, name: str, value: bytes, ex: Optional[int] = None, px: Optional[int] = None) -> bool:
+        ttl = ex if ex else (px / 1000 if px else None)
+        with self._lock:
+            self._data[name] = (bytes(value), time.time() + ttl if ttl else None)
+        return True
+
+    def delete(self, *names: str) -> int:
+        with self._lock:
+            return sum(self._data.pop(name, None) is not None for name in names)
+
+class RedisStateBackend(StateBackend):
+    """Backend Redis (ou compatible : Valkey, ElastiCache...) : répliques sur plusieurs hôtes"""
+
+    def __init__(self, client, prefix: str = STATE_KEY_PREFIX):
+        self.client = client
+        self.prefix = prefix
+
+    def _key(self, namespace: str, key: str) -> str:
+        return f"{self.prefix}:{namespace}:{key}"
+
+    def get(self, namespace: str, key: str) -> Optional[bytes]:
+        try:
+            return self.client.get(self._key(namespace, key))
+        except Exception:
+            return None
+
+    def set(self, namespace: str, key: str, value: bytes, ttl: Optional[float] = STATE_TTL_SECONDS):
+        try:
+            self.client.set(self._key(namespace, key), value, px=max(1, int(ttl * 1000)) if ttl else None)
+        except Exception:
+            pass
+
+    def delete(self, namespace: str, key: str):
+        try:
+            self.client.delete(self._key(namespace, key))
+        except Exception:
+            pass
+
+def create_state_backend(kind: str = STATE_BACKEND, sqlite_path: str = STATE_SQLITE_PATH,
+                         redis_url: str = STATE_REDIS_URL) -> Optional[StateBackend]:
+    """Backend configuré (None : état propre au processus, comportement d'une instance unique)"""
+    if kind == "sqlite":
+        return SQLiteStateBackend(sqlite_path)
+    if kind == "redis":
+        if redis_url.startswith("memory://"):
+            return RedisStateBackend(LocalRedisStandIn())
+        if REDIS_AVAILABLE:
+            return RedisStateBackend(redis.Redis.from_url(redis_url, socket_timeout=2, socket_connect_timeout=2))
+        # Paquet redis absent : repli sur le fichier SQLite plutôt que de perdre l'état
+        return SQLiteStateBackend(sqlite_path)
+    return None
+
+@st.cache_resource
+def get_state_backend() -> Optional[StateBackend]:
+    """Backend d'état partagé par tout le processus"""
+    return create_state_backend()
+
+# GESTION DES SESSIONS BEDROCK PAR (UTILISATEUR, AGENT)
+try:
+    SESSION_IDLE_TIMEOUT = int(st.secrets["bedrock"].get("SESSION_IDLE_TIMEOUT", 1800))
+    SESSION_MAX_CONTEXT_CHARS = int(st.secrets["bedrock"].get("SESSION_MAX_CONTEXT_CHARS", 200000))
+except Exception:
+    SESSION_IDLE_TIMEOUT = 1800
+    SESSION_MAX_CONTEXT_CHARS = 200000
+
+class BedrockSession:
+    """Session Bedrock d'un utilisateur avec un agent"""
+
+    __slots__ = ("session_id", "user_id", "agent_key", "ephemeral", "created_at", "last_used", "context_chars", "turns")
+
+    def __init__(self, user_id: str, agent_key: str, ephemeral: bool = False, session_id: Optional[str] = None):
         # Session ID plus spécifique pour éviter les conflits
-        timestamp = int(time.time())
-        st.session_state.bedrock_session_id = f"streamlit-{timestamp}-{uuid.uuid4().hex[:12]}"
-    return st.session_state.bedrock_session_id
+        self.session_id = session_id or f"streamlit-{agent_key}-{int(time.time())}-{uuid.uuid4().hex[:12]}"
+        self.user_id = user_id
+        self.agent_key = agent_key
+        self.ephemeral = ephemeral
+        self.created_at = time.time()
+        self.last_used = self.created_at
+        self.context_chars = 0
+        self.turns = 0
+
+class BedrockSessionManager:
+    """
+    Registre des sessions Bedrock du processus
+    Une session par (utilisateur, agent), renouvelée quand le contexte devient trop gros,
+    fermée après SESSION_IDLE_TIMEOUT secondes d'inactivité
+    Avec un backend partagé, l'enregistrement (utilisateur, agent) fait foi : toute réplique reprend la même session
+    """
+
+    def __init__(self, idle_timeout: int = SESSION_IDLE_TIMEOUT, max_context_chars: int = SESSION_MAX_CONTEXT_CHARS,
+                 backend: Optional[StateBackend] = None):
+        self.idle_timeout = idle_timeout
+        self.max_context_chars = max_context_chars
+        self.backend = backend
+        self._sessions: Dict[Tuple[str, str], BedrockSession] = {}
+        self._lock = threading.Lock()
+
+    def _load(self, user_id: str, agent_key: str) -> Optional[BedrockSession]:
+        """Session enregistrée dans le backend partagé (éventuellement par une autre réplique)"""
+        if self.backend is None:
+            return None
+        record = self.backend.get_json("bedrock_sessions", f"{user_id}:{agent_key}")
+        if not record:
+            return None
+        session = BedrockSession(user_id, agent_key, session_id=record["session_id"])
+        session.created_at = record["created_at"]
+        session.last_used = record["last_used"]
+        session.context_chars = record["context_chars"]
+        session.turns = record["turns"]
+        return session
+
+    def _save(self, session: BedrockSession):
+        if self.backend is None or session.ephemeral:
+            return
+        self.backend.set_json("bedrock_sessions", f"{session.user_id}:{session.agent_key}", {
+            "session_id": session.session_id, "created_at": session.created_at, "last_used": session.last_used,
+            "context_chars": session.context_chars, "turns": session.turns
+        }, ttl=self.idle_timeout)
+
+    def _forget(self, session: BedrockSession):
+        """Efface l'enregistrement partagé, sauf s'il désigne déjà une autre session"""
+        if self.backend is None:
+            return
+        key = f"{session.user_id}:{session.agent_key}"
+        record = self.backend.get_json("bedrock_sessions", key)
+        if record and record["session_id"] == session.session_id:
+            self.backend.delete("bedrock_sessions", key)
+
+    def acquire(self, user_id: str, agent_key: str, keep_context: bool = True) -> Tuple[BedrockSession, List[BedrockSession]]:
+        """Retourne la session à utiliser et les sessions à fermer côté serveur"""
+        if not keep_context:
+            # Sans contexte : session jetable, fermée par un appel séparé une fois la réponse reçue (end_ephemeral_session)
+            return BedrockSession(user_id, agent_key, ephemeral=True), []
+
+        stored = self._load(user_id, agent_key)
+        to_end = []
+        with self._lock:
+            session = self._sessions.get((user_id, agent_key))
+            if stored is not None and (session is None or session.session_id != stored.session_id):
+                # Session créée ou renouvelée par une autre réplique : la copie locale est périmée
+                session = stored
+                self._sessions[(user_id, agent_key)] = session
+            elif stored is not None:
+                session.context_chars = max(session.context_chars, stored.context_chars)
+                session.turns = max(session.turns, stored.turns)
+            if session is not None and session.context_chars >= self.max_context_chars:
+                # Contexte caché trop volumineux : repartir d'une session neuve
+                to_end.append(session)
+                session = None
+            if session is None:
+                session = BedrockSession(user_id, agent_key)
+                self._sessions[(user_id, agent_key)] = session
+            session.last_used = time.time()
+        if stored is None or stored.session_id != session.session_id:
+            self._save(session)
+        return session, to_end
+
+    def record_turn(self, session: BedrockSession, input_chars: int, output_chars: int):
+        """Comptabilise la croissance du contexte de la session"""
+        with self._lock:
+            session.context_chars += input_chars + output_chars
+            session.turns += 1
+            session.last_used = time.time()
+        self._save(session)
+
+    def discard(self, session: BedrockSession):
+        """Retire une session (appel annulé) : le prochain appel repartira d'une session neuve"""
+        with self._lock:
+            key = (session.user_id, session.agent_key)
+            if self._sessions.get(key) is session:
+                del self._sessions[key]
+        self._forget(session)
+
+    def collect_idle(self, now: Optional[float] = None) -> List[BedrockSession]:
+        """Retire et retourne les sessions inactives depuis plus de idle_timeout secondes"""
+        now = now or time.time()
+        with self._lock:
+            idle_keys = [key for key, s in self._sessions.items() if now - s.last_used > self.idle_timeout]
+            idle = [self._sessions.pop(key) for key in idle_keys]
+        if self.backend is None:
+            return idle
+
+        to_end = []
+        for session in idle:
+            record = self.backend.get_json("bedrock_sessions", f"{session.user_id}:{session.agent_key}")
+            if record is None or (record["session_id"] == session.session_id and now - record["last_used"] > self.idle_timeout):
+                to_end.append(session)
+                self._forget(session)
+            # Sinon la session est toujours utilisée (ou déjà remplacée) par une autre réplique : simplement oubliée ici
+        return to_end
+
+    def release_user(self, user_id: str) -> List[BedrockSession]:
+        """Retire et retourne toutes les sessions d'un utilisateur (y compris celles ouvertes par d'autres répliques)"""
+        with self._lock:
+            user_keys = [key for key in self._sessions if key[0] == user_id]
+            released = [self._sessions.pop(key) for key in user_keys]
+        if self.backend is None:
+            return released
+
+        local_ids = {session.session_id for session in released}
+        for agent_key in AGENTS:
+            stored = self._load(user_id, agent_key)
+            if stored is not None and stored.session_id not in local_ids:
+                released.append(stored)
+        for session in released:
+            self._forget(session)
+        return released
+
+    def user_sessions(self, user_id: str) -> List[BedrockSession]:
+        """Sessions actives d'un utilisateur"""
+        with self._lock:
+            return [s for key, s in self._sessions.items() if key[0] == user_id]
+
+    def active_count(self) -> int:
+        """Nombre de sessions actives dans le processus"""
+        with self._lock:
+            return len(self._sessions)
+
+@st.cache_resource
+def get_session_manager() -> BedrockSessionManager:
+    """Gestionnaire de sessions partagé par tout le processus"""
+    return BedrockSessionManager(backend=get_state_backend())
+
+@st.cache_resource
+def get_background_executor() -> ThreadPoolExecutor:
+    """Pool de threads pour les tâches de fond (fermeture de sessions, etc.)"""
+    return ThreadPoolExecutor(max_workers=4, thread_name_prefix="background")
+
+def browser_fingerprint() -> Optional[str]:
+    """
+    Empreinte du navigateur : jeton du cookie XSRF émis par le serveur Streamlit (propre au navigateur, identique
+    pour toutes les répliques), sans le masque aléatoire renouvelé à chaque émission. None sans protection XSRF
+    """
+    try:
+        cookie = st.context.cookies.get("_streamlit_xsrf")
+    except Exception:
+        return None
+    if not cookie:
+        return None
+    parts = cookie.split("|")
+    try:
+        if len(parts) == 4 and parts[0] == "2":
+            mask, masked = bytes.fromhex(parts[1]), bytes.fromhex(parts[2])
+            token = bytes(byte ^ mask[i % 4] for i, byte in enumerate(masked))
+        else:
+            token = cookie.encode("utf-8")
+    except ValueError:
+        return None
+    return hashlib.sha256(token).hexdigest()
+
+def get_user_id() -> str:
+    """
+    Identifiant stable de l'utilisateur pour la durée de sa session Streamlit
+    Avec un backend partagé, il est porté par l'URL (?conversation=...) : après un basculement vers une autre réplique,
+    le navigateur se reconnecte avec la même URL et retrouve sa conversation et ses sessions Bedrock.
+    La conversation est liée au navigateur qui l'a créée (browser_fingerprint) : le lien ouvert depuis un autre
+    navigateur démarre une conversation neuve. Sans protection XSRF (server.enableXsrfProtection = false),
+    ce lien n'est pas vérifiable et le lien seul donne accès à l'historique : il doit alors rester confidentiel.
+    """
+    if "user_id" not in st.session_state:
+        user_id = None
+        backend = get_state_backend()
+        if backend is not None:
+            user_id = st.query_params.get("conversation")
+            if user_id and re.fullmatch(r"[0-9a-f]{32}", user_id):
+                record = backend.get_json("conversations", user_id)
+                owner = record.get("owner") if record else None
+                if owner is not None and owner != browser_fingerprint():
+                    user_id = None  # Lien ouvert depuis un autre navigateur
+            else:
+                user_id = None
+            if user_id is None:
+                user_id = uuid.uuid4().hex
+                st.query_params["conversation"] = user_id
+        st.session_state.user_id = user_id or uuid.uuid4().hex
+    return st.session_state.user_id
+
+def end_bedrock_sessions(client, sessions: List[BedrockSession]):
+    """Ferme des sessions côté serveur pour libérer la mémoire de contexte (appel vide séparé, endSession=True)"""
+    for session in sessions:
+        if session.turns == 0:
+            continue
+        try:
+            response = client.invoke_agent(
+                agentId=AGENT_IDS[session.agent_key],
+                agentAliasId=AGENT_ALIAS_IDS[session.agent_key],
+                sessionId=session.session_id,
+                inputText="End of session.",
+                endSession=True
+            )
+            for _ in response.get("completion", []):
+                pass
+        except Exception:
+            # La session expirera d'elle-même côté Bedrock
+            pass
+
+def end_sessions_in_background(sessions: List[BedrockSession]):
+    """Ferme des sessions sans bloquer le tour de conversation"""
+    sessions = [s for s in sessions if s.turns > 0]
+    client = get_bedrock_client() if sessions else None
+    if client:
+        get_background_executor().submit(end_bedrock_sessions, client, sessions)
+
+def end_ephemeral_session(session: BedrockSession):
+    """Ferme une session jetable après sa réponse : l'appel qui répond garde endSession=False"""
+    session.turns = max(session.turns, 1)
+    end_sessions_in_background([session])
+
+def acquire_agent_session(agent_key: str) -> BedrockSession:
+    """Session à utiliser pour un agent, selon le mode contexte ; ferme au passage les sessions inactives"""
+    manager = get_session_manager()
+    keep_context = st.session_state.get("context_mode", True)
+    session, to_end = manager.acquire(get_user_id(), agent_key, keep_context)
+    end_sessions_in_background(to_end + manager.collect_idle())
+    return session
+
+def reset_user_sessions():
+    """Ferme toutes les sessions Bedrock de l'utilisateur courant"""
+    end_sessions_in_background(get_session_manager().release_user(get_user_id()))
+
+def get_or_create_session_id(agent_key: str = "router"):
+    """Session ID de l'utilisateur courant pour un agent (utilisé par les diagnostics)"""
+    return acquire_agent_session(agent_key).session_id
+
+# OBJETS DE RÉSULTAT TYPÉS - partagés par référence entre le moteur et l'interface
+@dataclass(slots=True)
+class OrchestrationStep:
+    """Étape d'orchestration extraite des traces (raisonnement, réponse d'agent, action...)"""
+    type: str
+    content: str = ""
+    agent: str = ""
+    references_count: int = 0
+
+@dataclass(slots=True)
+class CollaboratorResponse:
+    """Réponse d'un agent collaborateur du routeur"""
+    name: str
+    response: str
+    type: str = "collaborator"
+
+@dataclass(slots=True)
+class ParsedResponse:
+    """Réponse parsée d'un flux Bedrock"""
+    final_response: str = ""
+    collaborator_responses: Dict[str, CollaboratorResponse] = field(default_factory=dict)
+    orchestration_steps: List[OrchestrationStep] = field(default_factory=list)
+    trace_info: List[str] = field(default_factory=list)
+    errors: List[str] = field(default_factory=list)
+    raw_chunks: List[memoryview] = field(default_factory=list)
+
+    @property
+    def has_collaboration(self) -> bool:
+        """Vrai si le routeur a réellement fait appel à des collaborateurs"""
+        return bool(self.collaborator_responses) or any(
+            step.type in ("agent_response", "collaborator_response") for step in self.orchestration_steps
+        )
+
+@dataclass(slots=True)
+class PipelineResult:
+    """Résultat d'un tour : réponse combinée et réponses par agent, sans métadonnées recopiées"""
+    selected_agents: Tuple[str, ...] = ()
+    combined: str = ""
+    agent_results: Dict[str, str] = field(default_factory=dict)  # Réponses par étape (clés step_key)
+    agent_digests: Dict[str, str] = field(default_factory=dict)  # Réponses déplacées dans le ResultStore
+    selection_method: str = ""
+    router_response: str = ""
+    mode: str = ""
+    original_query: str = ""
+    optimized_query: str = ""
+    input_tokens: int = 0
+    error: str = ""
+
+    @classmethod
+    def failure(cls, message: str) -> "PipelineResult":
+        """Résultat en erreur"""
+        return cls(error=message)
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "PipelineResult":
+        """Résultat relu depuis le backend partagé (champs inconnus ignorés)"""
+        known = {f.name for f in fields(cls)}
+        values = {name: value for name, value in data.items() if name in known}
+        values["selected_agents"] = tuple(values.get("selected_agents", ()))
+        return cls(**values)
+
+    @staticmethod
+    def step_key(step: int, agent_key: str) -> str:
+        """Clé d'une étape : un agent répété dans une séquence garde une réponse par passage ("0:quality")"""
+        return f"{step}:{agent_key}"
+
+    @staticmethod
+    def step_agent(key: str) -> str:
+        """Agent d'une clé d'étape"""
+        return key.partition(":")[2] or key
+
+    @classmethod
+    def interrupted(cls, partial_results: Dict[str, str], mode: str = "") -> "PipelineResult":
+        """Résultat d'un tour arrêté par l'utilisateur, avec les réponses des étapes déjà terminées (clés step_key)"""
+        sections = [f"{COLLABORATOR_REGISTRY.label(cls.step_agent(key))}:\n{response}" for key, response in partial_results.items()]
+        return cls(
+            selected_agents=tuple(cls.step_agent(key) for key in partial_results),
+            combined="\n\n".join(["⏹️ Traitement interrompu par l'utilisateur."] + sections),
+            agent_results=dict(partial_results),
+            selection_method="Interrompu par l'utilisateur",
+            mode=mode
+        )
+
+    @property
+    def agent_names(self) -> List[str]:
+        return [COLLABORATOR_REGISTRY.name(key) for key in self.selected_agents]
+
+    @property
+    def agent_icons(self) -> List[str]:
+        return [COLLABORATOR_REGISTRY.icon(key) for key in self.selected_agents]
+
+    @property
+    def display_prefix(self) -> str:
+        """Préfixe markdown « icône(s) **nom(s)** » du message de l'assistant"""
+        if not self.selected_agents:
+            return ""
+        return f"{', '.join(self.agent_icons)} **{', '.join(self.agent_names)}**:\n\n"
+
+# STOCKAGE COMPRESSÉ DES RÉSULTATS DE SESSION
+try:
+    import zstandard
+    ZSTD_AVAILABLE = True
+except ImportError:
+    ZSTD_AVAILABLE = False
+
+try:
+    RESULT_COMPRESSION_THRESHOLD = int(st.secrets.get("results", {}).get("COMPRESSION_THRESHOLD", 1024))
+    RESULT_STORE_MAX_BYTES = int(st.secrets.get("results", {}).get("STORE_MAX_BYTES", 4 * 1024 * 1024))
+except Exception:
+    RESULT_COMPRESSION_THRESHOLD = 1024  # En dessous, le texte est conservé tel quel
+    RESULT_STORE_MAX_BYTES = 4 * 1024 * 1024  # Plafond par session, les blocs les plus anciens sont évincés
+
+@dataclass(slots=True)
+class StoredBlob:
+    """Texte stocké (compressé ou non) avec son nombre de références"""
+    data: bytes
+    raw_size: int
+    codec: str
+    refs: int = 1
+
+class ResultStore:
+    """
+    Stocke les réponses détaillées des agents compressées (zstd si disponible, sinon zlib)
+    et dédupliquées par empreinte SHA-256 ; décompression à la demande uniquement
+    Avec un backend partagé, chaque bloc y est aussi écrit : une autre réplique peut réafficher les réponses
+    """
+
+    def __init__(self, max_bytes: int = RESULT_STORE_MAX_BYTES, threshold: int = RESULT_COMPRESSION_THRESHOLD,
+                 backend: Optional[StateBackend] = None):
+        self.max_bytes = max_bytes
+        self.threshold = threshold
+        self.backend = backend
+        self._blobs: "OrderedDict[str, StoredBlob]" = OrderedDict()
+        self._stored_bytes = 0
+        self.dedup_hits = 0
+        self.evictions = 0
+        if ZSTD_AVAILABLE:
+            self._compressor = zstandard.ZstdCompressor(level=3)
+            self._decompressor = zstandard.ZstdDecompressor()
+
+    def _compress(self, raw: bytes) -> Tuple[bytes, str]:
+        if len(raw) < self.threshold:
+            return raw, "raw"
+        if ZSTD_AVAILABLE:
+            return self._compressor.compress(raw), "zstd"
+        return zlib.compress(raw, 6), "zlib"
+
+    def _decompress(self, data: bytes, codec: str) -> bytes:
+        if codec == "zstd":
+            return self._decompressor.decompress(data)
+        if codec == "zlib":
+            return zlib.decompress(data)
+        return data
+
+    def put(self, text: str) -> str:
+        """Stocke un texte et retourne son empreinte"""
+        raw = text.encode("utf-8")
+        digest = hashlib.sha256(raw).hexdigest()
+        blob = self._blobs.get(digest)
+        if blob is not None:
+            blob.refs += 1
+            self._blobs.move_to_end(digest)
+            self.dedup_hits += 1
+            return digest
+
+        data, codec = self._compress(raw)
+        self._blobs[digest] = StoredBlob(data, len(raw), codec)
+        if self.backend is not None:
+            self.backend.set("responses", digest, codec.encode("ascii") + b":" + data)
+        self._stored_bytes += len(data)
+        while self._stored_bytes > self.max_bytes and len(self._blobs) > 1:
+            _, evicted = self._blobs.popitem(last=False)
+            self._stored_bytes -= len(evicted.data)
+            self.evictions += 1
+        return digest
+
+    def get(self, digest: str) -> Optional[str]:
+        """Décompresse un texte stocké (None s'il a été évincé)"""
+        blob = self._blobs.get(digest)
+        if blob is not None:
+            return self._decompress(blob.data, blob.codec).decode("utf-8")
+        if self.backend is None:
+            return None
+        # Réponse d'un tour servi par une autre réplique (ou évincée localement)
+        stored = self.backend.get("responses", digest)
+        if stored is None:
+            return None
+        codec, _, data = stored.partition(b":")
+        try:
+            return self._decompress(data, codec.decode("ascii")).decode("utf-8")
+        except Exception:
+            return None
+
+    def release(self, digest: str):
+        """Libère une référence ; le bloc est supprimé quand plus rien ne le référence"""
+        blob = self._blobs.get(digest)
+        if blob is None:
+            return
+        blob.refs -= 1
+        if blob.refs <= 0:
+            del self._blobs[digest]
+            self._stored_bytes -= len(blob.data)
+
+    def offload(self, result: "PipelineResult"):
+        """Déplace les réponses détaillées d'un résultat dans le stock (remplacées par leurs empreintes)"""
+        for agent_key, text in result.agent_results.items():
+            result.agent_digests[agent_key] = self.put(text)
+        result.agent_results = {}
+
+    def release_result(self, result: Optional["PipelineResult"]):
+        """Libère les réponses détaillées d'un résultat qui ne sera plus affiché"""
+        if result is None:
+            return
+        for digest in result.agent_digests.values():
+            self.release(digest)
+
+    def report(self) -> Dict:
+        """Taille brute et stockée des réponses détaillées"""
+        return {
+            "entries": len(self._blobs),
+            "raw_bytes": sum(blob.raw_size for blob in self._blobs.values()),
+            "stored_bytes": self._stored_bytes,
+            "dedup_hits": self.dedup_hits,
+            "evictions": self.evictions,
+            "codec": "zstd" if ZSTD_AVAILABLE else "zlib"
+        }
+
+def session_memory_report(messages: List[Dict], archive: Dict, store: ResultStore) -> List[Dict]:
+    """Estimation de la mémoire retenue par la session (texte UTF-8, hors surcoût des objets Python)"""
+    message_bytes = sum(len(str(m.get("content", "")).encode("utf-8")) for m in messages)
+    store_report = store.report()
+    return [
+        {"élément": "Messages (texte)", "octets": message_bytes, "détail": f"{len(messages)} messages"},
+        {"élément": "Historique archivé", "octets": len(archive.get("data", b"")),
+         "détail": f"{archive.get('count', 0)} messages, transcript zlib"},
+        {"élément": "Réponses détaillées", "octets": store_report["stored_bytes"],
+         "détail": f"{store_report['entries']} blocs {store_report['codec']}, {store_report['raw_bytes']} octets bruts, "
+                   f"{store_report['dedup_hits']} doublons, {store_report['evictions']} évictions"},
+    ]
+
+def save_conversation(messages: List[Dict]):
+    """
+    Enregistre l'historique de l'utilisateur dans le backend partagé (sans effet si aucun n'est configuré).
+    Si un autre onglet a enregistré la même conversation depuis son chargement, elle n'est pas écrasée :
+    cet onglet continue sous un nouvel identifiant (conversation_forked signale la bifurcation à l'interface)
+    """
+    backend = get_state_backend()
+    if backend is None:
+        return
+    user_id = get_user_id()
+    record = backend.get_json("conversations", user_id)
+    known_version = st.session_state.get("conversation_version", 0)
+    if record is not None and record.get("version", 0) != known_version:
+        user_id = st.session_state.user_id = uuid.uuid4().hex
+        st.query_params["conversation"] = user_id
+        st.session_state.conversation_forked = True
+        record = None
+    if not messages:
+        backend.delete("conversations", user_id)
+        st.session_state.conversation_version = 0
+        return
+    version = (record.get("version", 0) if record else 0) + 1
+    backend.set_json("conversations", user_id, {
+        "owner": (record or {}).get("owner") or browser_fingerprint(),
+        "version": version,
+        "messages": [
+            {"role": m["role"], "content": str(m.get("content", "")),
+             "result": asdict(m["result"]) if m.get("result") is not None else None}
+            for m in messages
+        ]
+    })
+    st.session_state.conversation_version = version
+
+def load_conversation() -> List[Dict]:
+    """Historique enregistré par une réplique précédente (liste vide sans backend partagé)"""
+    backend = get_state_backend()
+    if backend is None:
+        return []
+    record = backend.get_json("conversations", get_user_id()) or {}
+    st.session_state.conversation_version = record.get("version", 0)
+    messages = []
+    for item in record.get("messages", []):
+        message = {"role": item["role"], "content": item["content"]}
+        if item.get("result"):
+            message["result"] = PipelineResult.from_dict(item["result"])
+        messages.append(message)
+    return messages
 
 # FONCTION DE DIAGNOSTIC MULTI-AGENT
 async def diagnose_router_agent():
@@ -128,12 +981,12 @@ async def diagnose_router_agent():
         
         # Analyser les résultats
         diagnosis = {
-            "router_responsive": bool(parsed["final_response"]),
-            "collaboration_detected": bool(parsed["collaborator_responses"]),
-            "orchestration_steps": len(parsed["orchestration_steps"]),
-            "collaborators_count": len(parsed["collaborator_responses"]),
-            "errors": parsed["errors"],
-            "raw_response_length": len(parsed["final_response"]),
+            "router_responsive": bool(parsed.final_response),
+            "collaboration_detected": bool(parsed.collaborator_responses),
+            "orchestration_steps": len(parsed.orchestration_steps),
+            "collaborators_count": len(parsed.collaborator_responses),
+            "errors": parsed.errors,
+            "raw_response_length": len(parsed.final_response),
             "recommendation": ""
         }
         
@@ -202,16 +1055,14 @@ async def test_router_connection():
         parsed = parse_multi_agent_response_complete(response)
         
         # Évaluation des résultats
-        collaboration_detected = bool(parsed["collaborator_responses"]) or any(
-            "agent" in step.get("type", "") for step in parsed["orchestration_steps"]
-        )
+        collaboration_detected = parsed.has_collaboration
         
         return {
             "success": True,
-            "response": parsed["final_response"][:300] + "..." if len(parsed["final_response"]) > 300 else parsed["final_response"],
+            "response": parsed.final_response[:300] + "..." if len(parsed.final_response) > 300 else parsed.final_response,
             "collaboration_detected": collaboration_detected,
-            "collaborators_count": len(parsed["collaborator_responses"]),
-            "orchestration_steps": len(parsed["orchestration_steps"]),
+            "collaborators_count": len(parsed.collaborator_responses),
+            "orchestration_steps": len(parsed.orchestration_steps),
             "note": "Test d'orchestration multi-agent réussi" if collaboration_detected else "Aucune collaboration détectée - vérifiez la configuration Bedrock"
         }
         
@@ -222,20 +1073,462 @@ async def test_router_connection():
             "solution": "Vérifiez la configuration de l'agent routeur dans AWS Bedrock"
         }
 
+# STATISTIQUES DE LATENCE PAR AGENT
+class AgentLatencyStats:
+    """Fenêtre glissante des latences (connexion, premier chunk, total) par agent, partagée entre threads"""
+
+    METRICS = ("connect_ms", "first_chunk_ms", "total_ms")
+
+    def __init__(self, window: int = 200):
+        self.window = window
+        self._samples: Dict[str, Dict[str, deque]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, agent_key: str, **timings):
+        """Enregistre les mesures d'un appel (les valeurs None sont ignorées)"""
+        with self._lock:
+            agent_samples = self._samples.setdefault(
+                agent_key, {metric: deque(maxlen=self.window) for metric in self.METRICS}
+            )
+            for metric, value in timings.items():
+                if value is not None and metric in agent_samples:
+                    agent_samples[metric].append(value)
+
+    def percentile(self, agent_key: str, metric: str, pct: float) -> Optional[float]:
+        """Percentile d'une métrique, None s'il n'y a pas encore de mesure"""
+        with self._lock:
+            values = sorted(self._samples.get(agent_key, {}).get(metric, ()))
+        if not values:
+            return None
+        index = min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))
+        return values[index]
+
+    def count(self, agent_key: str, metric: str = "total_ms") -> int:
+        """Nombre de mesures disponibles"""
+        with self._lock:
+            return len(self._samples.get(agent_key, {}).get(metric, ()))
+
+@st.cache_resource
+def get_latency_stats() -> AgentLatencyStats:
+    """Statistiques de latence partagées par tout le processus"""
+    return AgentLatencyStats()
+
+# MÉTRIQUES DU RUNTIME (FORMAT TEXTE PROMETHEUS)
+try:
+    METRICS_ENABLED = bool(st.secrets.get("metrics", {}).get("ENABLED", True))
+    METRICS_HOST = str(st.secrets.get("metrics", {}).get("HOST", "127.0.0.1"))
+    METRICS_PORT = int(st.secrets.get("metrics", {}).get("PORT", 9464))
+except Exception:
+    METRICS_ENABLED = True
+    METRICS_HOST = "127.0.0.1"  # Local uniquement : l'exposition externe passe par le proxy de déploiement
+    METRICS_PORT = 9464
+
+LATENCY_BUCKETS_SECONDS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+
+def format_metric_labels(label_names: Tuple[str, ...], label_values: Tuple[str, ...], extra: str = "") -> str:
+    """Étiquettes au format Prometheus : {agent="quality",le="0.5"}"""
+    pairs = [
+        f'{name}="' + str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+        for name, value in zip(label_names, label_values)
+    ]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class MetricCounter:
+    """Compteur monotone, une valeur par combinaison d'étiquettes"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, label_names: Tuple[str, ...] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, value: float = 1, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.label_names)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = list(self._values.items())
+        return [f"{self.name}{format_metric_labels(self.label_names, key)} {value:g}" for key, value in values]
+
+class MetricHistogram:
+    """Histogramme cumulatif à seaux fixes (compte, somme et seaux par combinaison d'étiquettes)"""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, label_names: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = LATENCY_BUCKETS_SECONDS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = tuple(sorted(buckets))
+        self._values: Dict[Tuple[str, ...], List[float]] = {}  # [seaux..., +Inf, somme]
+        self._lock = threading.Lock()
+
+    def observe(self, value: Optional[float], **labels):
+        if value is None:
+            return
+        key = tuple(str(labels.get(name, "")) for name in self.label_names)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                counts = self._values[key] = [0] * (len(self.buckets) + 2)
+            counts[index] += 1
+            counts[-1] += value
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = [(key, list(counts)) for key, counts in self._values.items()]
+        lines = []
+        for key, counts in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                bucket_label = f'le="{le}"'
+                lines.append(f"{self.name}_bucket{format_metric_labels(self.label_names, key, bucket_label)} {cumulative}")
+            lines.append(f"{self.name}_sum{format_metric_labels(self.label_names, key)} {counts[-1]:g}")
+            lines.append(f"{self.name}_count{format_metric_labels(self.label_names, key)} {cumulative}")
+        return lines
+
+class MetricGauge:
+    """Jauge évaluée au moment de la collecte (callback renvoyant une valeur ou {étiquettes: valeur})"""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help_text: str, callback, label_names: Tuple[str, ...] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.callback = callback
+        self.label_names = label_names
+
+    def samples(self) -> List[str]:
+        try:
+            value = self.callback()
+        except Exception:
+            return []
+        if value is None:
+            return []
+        if not isinstance(value, dict):
+            value = {(): value}
+        return [f"{self.name}{format_metric_labels(self.label_names, key)} {v:g}" for key, v in value.items()]
+
+class AgentMetrics:
+    """Métriques du processus : appels d'agents, parsing, extraction, caches et sessions"""
+
+    def __init__(self):
+        self.agent_invocations = MetricCounter(
+            "agent_invocations_total", "Appels d'agents Bedrock par résultat", ("agent", "outcome"))
+        self.agent_latency = MetricHistogram(
+            "agent_latency_seconds", "Durée totale d'un appel d'agent", ("agent",))
+        self.agent_first_chunk = MetricHistogram(
+            "agent_time_to_first_chunk_seconds", "Délai jusqu'au premier chunk de texte", ("agent",))
+        self.agent_throttles = MetricCounter(
+            "agent_throttles_total", "Réponses de limitation de débit (throttling)", ("agent",))
+        self.agent_retries = MetricCounter(
+            "agent_retries_total", "Nouvelles tentatives d'appel", ("agent", "reason"))
+        self.scheduler_wait = MetricHistogram(
+            "scheduler_wait_seconds", "Attente d'une place dans l'ordonnanceur", ("class",))
+        self.parse_errors = MetricCounter(
+            "parse_errors_total", "Erreurs filtrées ou levées par le parser de flux", ("kind",))
+        self.pdf_pages = MetricCounter(
+            "document_pages_extracted_total", "Pages extraites des documents déposés", ("ocr",))
+        self.extraction_seconds = MetricHistogram(
+            "document_extraction_seconds", "Durée d'extraction d'un document", ("ocr",))
+        self.cache_requests = MetricCounter(
+            "cache_requests_total", "Consultations des caches par résultat", ("cache", "result"))
+        self._gauges: List[MetricGauge] = []
+        self._lock = threading.Lock()
+
+    def register_gauge(self, name: str, help_text: str, callback, label_names: Tuple[str, ...] = ()):
+        with self._lock:
+            self._gauges = [g for g in self._gauges if g.name != name] + [MetricGauge(name, help_text, callback, label_names)]
+
+    def record_cache(self, cache: str, hit: bool):
+        self.cache_requests.inc(cache=cache, result="hit" if hit else "miss")
+
+    def record_parse_errors(self, errors: List[str]):
+        """Classe les erreurs collectées par le parser (messages préfixés)"""
+        for error in errors:
+            if error.startswith("RerunData"):
+                kind = "rerun"
+            elif error.startswith("System error"):
+                kind = "system_error"
+            elif error.startswith("Erreur décodage"):
+                kind = "decode"
+            else:
+                kind = "exception"
+            self.parse_errors.inc(kind=kind)
+
+    def render(self) -> str:
+        """Exposition texte (version 0.0.4) de toutes les métriques"""
+        with self._lock:
+            metrics = [value for value in vars(self).values() if hasattr(value, "samples")] + list(self._gauges)
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help_text}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+@st.cache_resource
+def get_metrics() -> AgentMetrics:
+    """Métriques partagées par toutes les sessions"""
+    return AgentMetrics()
+
+def count_streamlit_sessions() -> Optional[int]:
+    """Sessions Streamlit connectées (None hors du serveur Streamlit)"""
+    try:
+        from streamlit.runtime import Runtime
+        return Runtime.instance()._session_mgr.num_active_sessions()
+    except Exception:
+        return None
+
+@st.cache_resource
+def start_metrics_server() -> Optional[ThreadingHTTPServer]:
+    """Serveur HTTP /metrics dans un thread démon, démarré une seule fois par processus"""
+    if not METRICS_ENABLED:
+        return None
+    metrics = get_metrics()
+    # Objets capturés ici : le thread HTTP n'appelle aucune fonction Streamlit
+    sessions, scheduler = get_session_manager(), get_agent_scheduler()
+    metrics.register_gauge("bedrock_sessions_active", "Sessions Bedrock ouvertes (mode contexte)", sessions.active_count)
+    metrics.register_gauge("streamlit_sessions_active", "Sessions Streamlit connectées", count_streamlit_sessions)
+    metrics.register_gauge("scheduler_queue_depth", "Appels en attente dans l'ordonnanceur",
+                           lambda: {(row["classe"],): row["en_file"] for row in scheduler.report()}, ("class",))
+    metrics.register_gauge("scheduler_in_flight", "Appels en cours accordés par l'ordonnanceur",
+                           lambda: {(row["classe"],): row["en_cours"] for row in scheduler.report()}, ("class",))
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = metrics.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass  # Une ligne par collecte polluerait les journaux de Streamlit
+
+    try:
+        server = ThreadingHTTPServer((METRICS_HOST, METRICS_PORT), MetricsHandler)
+    except OSError:
+        # Port déjà pris (autre instance de l'application) : l'application fonctionne sans endpoint
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
+
+class StreamTimer:
+    """Itère un flux d'événements Bedrock en mesurant le temps jusqu'au premier chunk"""
+
+    def __init__(self, event_stream, started_at: float):
+        self.event_stream = event_stream
+        self.started_at = started_at
+        self.first_chunk_ms = None
+
+    def __iter__(self):
+        for event in self.event_stream:
+            if self.first_chunk_ms is None and "chunk" in event:
+                self.first_chunk_ms = (time.perf_counter() - self.started_at) * 1000
+            yield event
+
+# SANTÉ DES AGENTS
+HEALTH_CHECK_PROMPT = "Health check: reply with the single word OK."
+try:
+    HEALTH_CACHE_TTL = int(st.secrets["bedrock"].get("HEALTH_CACHE_TTL", 300))
+    WARM_UP_AGENTS = bool(st.secrets["bedrock"].get("WARM_UP_AGENTS", False))
+except Exception:
+    HEALTH_CACHE_TTL = 300
+    WARM_UP_AGENTS = False
+
+def probe_agent(client, agent_key: str, stats: AgentLatencyStats, session_id: Optional[str] = None) -> Dict:
+    """
+    Sonde légère d'un agent : temps de connexion, premier chunk et total
+    Avec session_id, la sonde passe par cette session et la laisse ouverte (réchauffage d'une session utilisateur) ;
+    sinon la session jetable de la sonde est fermée ensuite par un appel séparé, hors des mesures
+    """
+    throwaway = None
+    if session_id is None:
+        throwaway = BedrockSession("health", agent_key, ephemeral=True, session_id=f"health-{agent_key}-{uuid.uuid4().hex[:12]}")
+        session_id = throwaway.session_id
+    started_at = time.perf_counter()
+    probe = {"agent": agent_key, "ok": False, "connect_ms": None, "first_chunk_ms": None, "total_ms": None, "error": ""}
+    try:
+        response = client.invoke_agent(
+            agentId=AGENT_IDS[agent_key],
+            agentAliasId=AGENT_ALIAS_IDS[agent_key],
+            sessionId=session_id,
+            inputText=HEALTH_CHECK_PROMPT,
+            enableTrace=False,
+            endSession=False
+        )
+        probe["connect_ms"] = (time.perf_counter() - started_at) * 1000
+
+        timer = StreamTimer(response.get("completion", []), started_at)
+        for _ in timer:
+            pass
+        probe["first_chunk_ms"] = timer.first_chunk_ms
+        probe["total_ms"] = (time.perf_counter() - started_at) * 1000
+        probe["ok"] = timer.first_chunk_ms is not None
+        if not probe["ok"]:
+            probe["error"] = "Aucun chunk reçu"
+    except Exception as e:
+        probe["total_ms"] = (time.perf_counter() - started_at) * 1000
+        probe["error"] = str(e)[:200]
+
+    if probe["ok"]:
+        stats.record(agent_key, connect_ms=probe["connect_ms"], first_chunk_ms=probe["first_chunk_ms"],
+                     total_ms=probe["total_ms"])
+    if throwaway is not None and probe["connect_ms"] is not None:
+        throwaway.turns = 1
+        get_background_executor().submit(end_bedrock_sessions, client, [throwaway])
+    return probe
+
+def configured_agent_keys() -> List[str]:
+    """Agents dont l'ID et l'alias sont configurés"""
+    return [key for key in AGENT_IDS if AGENT_IDS.get(key) and AGENT_ALIAS_IDS.get(key)]
+
+def probe_all_agents(client, stats: AgentLatencyStats) -> Dict[str, Dict]:
+    """Sonde tous les agents configurés en parallèle"""
+    agent_keys = configured_agent_keys()
+    if not agent_keys:
+        return {}
+    with ThreadPoolExecutor(max_workers=len(agent_keys), thread_name_prefix="agent-health") as executor:
+        probes = executor.map(lambda key: probe_agent(client, key, stats), agent_keys)
+        return {probe["agent"]: probe for probe in probes}
+
+@st.cache_data(ttl=HEALTH_CACHE_TTL, show_spinner=False)
+def cached_agents_health() -> Dict:
+    """Sondage de tous les agents, mis en cache pendant HEALTH_CACHE_TTL secondes (client disponible uniquement)"""
+    return {"checked_at": time.time(), "agents": probe_all_agents(get_bedrock_client(), get_latency_stats())}
+
+def get_agents_health() -> Dict:
+    """Santé de tous les agents ; l'absence de client n'est pas mise en cache et sera revérifiée au prochain appel"""
+    if not get_bedrock_client():
+        return {"error": "Client Bedrock non disponible", "agents": {}}
+    return cached_agents_health()
+
+@st.cache_resource
+def warm_up_agents() -> threading.Thread:
+    """Réchauffe une fois par processus les connexions vers tous les agents, en arrière-plan"""
+    client = get_bedrock_client()
+    thread = threading.Thread(target=probe_all_agents, args=(client, get_latency_stats()), name="agent-warm-up", daemon=True)
+    if client:
+        thread.start()
+    return thread
+
+def warm_up_user_sessions() -> Optional[threading.Thread]:
+    """
+    Ouvre en arrière-plan les sessions Bedrock de l'utilisateur courant, une fois par session Streamlit :
+    chaque agent reçoit la sonde sur la session que la première vraie question réutilisera
+    Sans mode contexte, les appels utilisent des sessions jetables : rien à réchauffer
+    """
+    if st.session_state.get("user_sessions_warmed") or not st.session_state.get("context_mode", True):
+        return None
+    client = get_bedrock_client()
+    if not client:
+        return None
+    st.session_state.user_sessions_warmed = True
+
+    # Sessions acquises ici (accès au session_state), sondées dans le thread
+    sessions = [acquire_agent_session(key) for key in configured_agent_keys()]
+    sessions = [session for session in sessions if session.turns == 0]
+    if not sessions:
+        return None
+    manager = get_session_manager()
+    stats = get_latency_stats()
+
+    def warm(session: BedrockSession):
+        probe = probe_agent(client, session.agent_key, stats, session_id=session.session_id)
+        if probe["ok"]:
+            manager.record_turn(session, len(HEALTH_CHECK_PROMPT), 0)
+
+    def warm_all():
+        with ThreadPoolExecutor(max_workers=len(sessions), thread_name_prefix="session-warm-up") as executor:
+            list(executor.map(warm, sessions))
+
+    thread = threading.Thread(target=warm_all, name="session-warm-up", daemon=True)
+    thread.start()
+    return thread
+
+# CLASSIFICATION DES CHUNKS - directement sur les octets, sans décodage préalable
+CHUNK_SYSTEM_MARKERS = re.compile(rb"RerunData|InternalServerError|ValidationException")
+CHUNK_FIRST_BYTE = re.compile(rb"\S")
+
+def classify_chunk(raw: bytes, decoder=None) -> Tuple[str, Optional[str]]:
+    """
+    Classe un chunk brut : ("rerun" | "system_error" | "json" | "text", texte utile)
+    Le JSON n'est tenté que si le premier octet significatif est "{"
+    Avec un décodeur incrémental, un caractère coupé entre deux chunks est reconstitué
+    """
+    marker = CHUNK_SYSTEM_MARKERS.search(raw)
+    if marker:
+        return ("rerun" if marker.group(0) == b"RerunData" else "system_error"), None
+
+    first = CHUNK_FIRST_BYTE.search(raw)
+    if first is not None and first.group(0) == b"{":
+        try:
+            chunk_json = json.loads(raw)
+        except ValueError:
+            # JSON incomplet ou invalide : ignoré comme auparavant
+            return "json", None
+        if isinstance(chunk_json, dict):
+            return "json", chunk_json.get("text", chunk_json.get("content"))
+        return "json", None
+
+    return "text", decoder.decode(raw) if decoder is not None else raw.decode("utf-8")
+
+class ChunkAccumulator:
+    """
+    Décodage UTF-8 incrémental d'un flux, avec conservation optionnelle des octets bruts
+    Les octets sont accumulés dans un seul bytearray et relus via memoryview, sans copie par chunk
+    """
+
+    __slots__ = ("decoder", "keep_raw", "_buffer", "_offsets")
+
+    def __init__(self, keep_raw: bool = False):
+        self.decoder = codecs.getincrementaldecoder("utf-8")()
+        self.keep_raw = keep_raw
+        self._buffer = bytearray()
+        self._offsets = [0]
+
+    def classify(self, raw: bytes) -> Tuple[str, Optional[str]]:
+        """Classe un chunk du flux (voir classify_chunk)"""
+        if self.keep_raw:
+            self._buffer += raw
+            self._offsets.append(len(self._buffer))
+        return classify_chunk(raw, self.decoder)
+
+    def flush(self) -> str:
+        """Fin du flux : texte encore en attente, erreur si une séquence UTF-8 reste incomplète"""
+        return self.decoder.decode(b"", final=True)
+
+    def raw_chunks(self) -> List[memoryview]:
+        """Vues sans copie sur chaque chunk brut reçu"""
+        view = memoryview(self._buffer)
+        return [view[start:end] for start, end in zip(self._offsets, self._offsets[1:])]
+
 # PARSER MULTI-AGENT OPTIMISÉ
-def parse_multi_agent_response_complete(response: Dict) -> Dict:
+def parse_multi_agent_response_complete(response: Dict, keep_raw_chunks: bool = False,
+                                        on_text: Optional[Callable[[Optional[str]], None]] = None) -> ParsedResponse:
     """
     Parser optimisé pour les réponses multi-agent AWS Bedrock
-    Gère correctement le streaming et l'orchestration
-    """
-    result = {
-        "final_response": "",
-        "collaborator_responses": {},
-        "orchestration_steps": [],
-        "trace_info": [],
-        "errors": [],
-        "raw_chunks": []  # Pour debug
-    }
+    Gère correctement le streaming et l'orchestration ; on_text reçoit le texte final au fil des chunks
+    """
+    result = ParsedResponse()
+    accumulator = ChunkAccumulator(keep_raw=keep_raw_chunks)
     
     try:
         # Traitement des événements de streaming
@@ -246,31 +1539,23 @@ def parse_multi_agent_response_complete(response: Dict) -> Dict:
             if "chunk" in event:
                 chunk = event["chunk"]
                 if "bytes" in chunk:
+                    raw = chunk["bytes"]
                     try:
-                        decoded = chunk["bytes"].decode('utf-8')
-                        result["raw_chunks"].append(decoded)
-                        
+                        kind, text = accumulator.classify(raw)
+
                         # Filtrer les erreurs système mais continuer le traitement
-                        if "RerunData" in decoded:
-                            result["errors"].append("RerunData filtered")
-                            continue
-                        if any(error in decoded for error in ["InternalServerError", "ValidationException"]):
-                            result["errors"].append(f"System error filtered: {decoded[:50]}")
-                            continue
-                        
-                        # Essayer JSON puis texte brut
-                        try:
-                            chunk_json = json.loads(decoded)
-                            if "text" in chunk_json:
-                                result["final_response"] += chunk_json["text"]
-                            elif "content" in chunk_json:
-                                result["final_response"] += chunk_json["content"]
-                        except json.JSONDecodeError:
-                            if decoded.strip() and not decoded.startswith("{"):
-                                result["final_response"] += decoded
-                                
+                        if kind == "rerun":
+                            result.errors.append("RerunData filtered")
+                        elif kind == "system_error":
+                            result.errors.append(f"System error filtered: {raw[:50].decode('utf-8', 'replace')}")
+                        elif text:
+                            result.final_response += text
+                            if on_text is not None:
+                                on_text(text)
+
                     except UnicodeDecodeError as e:
-                        result["errors"].append(f"Erreur décodage: {str(e)}")
+                        result.errors.append(f"Erreur décodage: {str(e)}")
+                        accumulator.decoder.reset()
             
             # 2. TRACES - Orchestration multi-agent
             elif "trace" in event:
@@ -279,7 +1564,7 @@ def parse_multi_agent_response_complete(response: Dict) -> Dict:
                 # Informations du collaborateur
                 collab_name = trace_event.get("collaboratorName")
                 if collab_name:
-                    result["trace_info"].append(f"Collaborateur: {collab_name}")
+                    result.trace_info.append(f"Collaborateur: {collab_name}")
                 
                 # Contenu de la trace
                 if "trace" in trace_event:
@@ -293,10 +1578,7 @@ def parse_multi_agent_response_complete(response: Dict) -> Dict:
                         if "modelInvocationInput" in orch:
                             reasoning = orch["modelInvocationInput"].get("text", "")
                             if reasoning:
-                                result["orchestration_steps"].append({
-                                    "type": "reasoning",
-                                    "content": reasoning
-                                })
+                                result.orchestration_steps.append(OrchestrationStep("reasoning", reasoning))
                         
                         # Observations - Réponses des collaborateurs
                         if "observation" in orch:
@@ -313,16 +1595,13 @@ def parse_multi_agent_response_complete(response: Dict) -> Dict:
                                         agent_response = collab_out["output"]["text"]
                                         
                                         # Stocker la réponse
-                                        result["collaborator_responses"][agent_name] = {
-                                            "response": agent_response,
-                                            "type": "collaborator"
-                                        }
+                                        result.collaborator_responses[agent_name] = CollaboratorResponse(agent_name, agent_response)
                                         
-                                        result["orchestration_steps"].append({
-                                            "type": "agent_response",
-                                            "agent": agent_name,
-                                            "preview": agent_response[:150] + "..." if len(agent_response) > 150 else agent_response
-                                        })
+                                        result.orchestration_steps.append(OrchestrationStep(
+                                            "agent_response",
+                                            agent_response[:150] + "..." if len(agent_response) > 150 else agent_response,
+                                            agent=agent_name
+                                        ))
                             
                             # FINISH - Réponse finale
                             elif obs_type == "FINISH":
@@ -330,28 +1609,24 @@ def parse_multi_agent_response_complete(response: Dict) -> Dict:
                                     final_text = obs["finalResponse"]["text"]
                                     if final_text and len(final_text.strip()) > 0:
                                         # Priorité à la réponse finale de l'orchestration
-                                        if not result["final_response"] or len(result["final_response"]) < len(final_text):
-                                            result["final_response"] = final_text
+                                        if not result.final_response or len(result.final_response) < len(final_text):
+                                            result.final_response = final_text
                             
                             # ACTION GROUP
                             elif obs_type == "ACTION_GROUP":
                                 if "actionGroupInvocationOutput" in obs:
                                     action_out = obs["actionGroupInvocationOutput"]
                                     action_text = action_out.get("text", "")
-                                    result["orchestration_steps"].append({
-                                        "type": "action",
-                                        "content": action_text[:100] + "..." if len(action_text) > 100 else action_text
-                                    })
+                                    result.orchestration_steps.append(OrchestrationStep(
+                                        "action", action_text[:100] + "..." if len(action_text) > 100 else action_text
+                                    ))
                             
                             # KNOWLEDGE BASE
                             elif obs_type == "KNOWLEDGE_BASE":
                                 if "knowledgeBaseLookupOutput" in obs:
                                     kb_out = obs["knowledgeBaseLookupOutput"]
                                     refs = kb_out.get("retrievedReferences", [])
-                                    result["orchestration_steps"].append({
-                                        "type": "knowledge_search",
-                                        "references_count": len(refs)
-                                    })
+                                    result.orchestration_steps.append(OrchestrationStep("knowledge_search", references_count=len(refs)))
                     
                     # PRE/POST PROCESSING
                     for trace_type in ["preProcessingTrace", "postProcessingTrace"]:
@@ -360,57 +1635,718 @@ def parse_multi_agent_response_complete(response: Dict) -> Dict:
                             if "modelInvocationInput" in trace_content:
                                 input_text = trace_content["modelInvocationInput"].get("text", "")
                                 if input_text:
-                                    result["orchestration_steps"].append({
-                                        "type": trace_type.replace("Trace", "").lower(),
-                                        "content": input_text[:100] + "..." if len(input_text) > 100 else input_text
-                                    })
+                                    result.orchestration_steps.append(OrchestrationStep(
+                                        trace_type.replace("Trace", "").lower(),
+                                        input_text[:100] + "..." if len(input_text) > 100 else input_text
+                                    ))
     
     except Exception as e:
-        result["errors"].append(f"Erreur parsing: {str(e)}")
+        result.errors.append(f"Erreur parsing: {str(e)}")
         # En mode debug seulement
         if hasattr(st.session_state, 'debug_mode') and st.session_state.debug_mode:
             st.error(f"Erreur de parsing: {e}")
+
+    # Fin de flux : vider le décodeur incrémental
+    try:
+        tail = accumulator.flush()
+        result.final_response += tail
+        if tail and on_text is not None:
+            on_text(tail)
+    except UnicodeDecodeError as e:
+        result.errors.append(f"Erreur décodage: {str(e)}")
+    result.raw_chunks = accumulator.raw_chunks()
     
     # POST-TRAITEMENT
     # 1. Si pas de réponse finale, consolider les collaborateurs
-    if not result["final_response"].strip() and result["collaborator_responses"]:
-        sections = []
-        for agent_name, agent_data in result["collaborator_responses"].items():
-            # Trouver l'icône de l'agent
-            agent_icon = "🤖"
-            for key, info in AGENTS.items():
-                if any(keyword in agent_name.lower() for keyword in [key, info["name"].lower().split()[0]]):
-                    agent_icon = info["icon"]
-                    break
-            
-            sections.append(f"{agent_icon} **{agent_name}**\n{agent_data['response']}")
+    if not result.final_response.strip() and result.collaborator_responses:
+        sections = format_collaborator_sections(result.collaborator_responses)
         
         if sections:
-            result["final_response"] = "\n\n".join(sections)
+            result.final_response = "\n\n".join(sections)
     
     # 2. Nettoyer la réponse finale
-    if result["final_response"]:
+    if result.final_response:
         # Supprimer les doublons et nettoyer
-        result["final_response"] = result["final_response"].strip()
+        result.final_response = result.final_response.strip()
         # Supprimer les répétitions de phrases
-        lines = result["final_response"].split('\n')
+        lines = result.final_response.split('\n')
         unique_lines = []
         for line in lines:
             if line.strip() and line not in unique_lines:
                 unique_lines.append(line)
-        result["final_response"] = '\n'.join(unique_lines)
+        result.final_response = '\n'.join(unique_lines)
     
     return result
 
+# DISJONCTEURS PAR AGENT - échec immédiat ou repli quand un agent est en panne
+def load_breaker_settings() -> Dict:
+    """Seuils des disjoncteurs et agents de repli (surchargeables via st.secrets["circuit_breaker"])"""
+    settings = {
+        "window": 20,  # Derniers appels pris en compte
+        "min_calls": 5,  # Appels nécessaires avant d'évaluer le taux d'échec
+        "failure_rate": 0.5,  # Taux d'échec qui ouvre le disjoncteur
+        "consecutive_failures": 3,  # Échecs d'affilée qui l'ouvrent sans attendre min_calls
+        "slow_call_ms": 180000,  # Un appel plus lent compte comme un échec
+        # Seuil propre à un agent (0 : aucun) ; les orchestrations complexes du routeur peuvent durer jusqu'au read_timeout
+        "slow_call_ms_by_agent": {"router": 0},
+        "open_seconds": 30,  # Durée d'ouverture initiale, doublée à chaque réouverture
+        "max_open_seconds": 300,
+        "fallbacks": {"router": "manager"}
+    }
+    try:
+        configured = dict(st.secrets.get("circuit_breaker", {}))
+    except Exception:
+        configured = {}
+    for key, value in configured.items():
+        key = key.lower()
+        if key in ("fallbacks", "slow_call_ms_by_agent"):
+            settings[key] = dict(value)
+        elif key in settings:
+            settings[key] = type(settings[key])(value)
+    return settings
+
+BREAKER_SETTINGS = load_breaker_settings()
+
+class CircuitBreaker:
+    """Disjoncteur d'un agent : fermé (appels normaux), ouvert (échec immédiat), semi-ouvert (un appel d'essai)"""
+
+    CLOSED, OPEN, HALF_OPEN = "fermé", "ouvert", "semi-ouvert"
+
+    def __init__(self, agent_key: str, settings: Dict = BREAKER_SETTINGS):
+        self.agent_key = agent_key
+        self.settings = settings
+        self.slow_call_ms = settings["slow_call_ms_by_agent"].get(agent_key, settings["slow_call_ms"])
+        self.state = self.CLOSED
+        self.last_error = ""
+        self._outcomes: deque = deque(maxlen=settings["window"])
+        self._consecutive_failures = 0
+        self._open_seconds = settings["open_seconds"]
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def retry_in(self) -> float:
+        """Secondes avant le prochain appel d'essai (0 si le disjoncteur n'est pas ouvert)"""
+        if self.state != self.OPEN:
+            return 0.0
+        return max(0.0, self._opened_at + self._open_seconds - time.monotonic())
+
+    def allow(self) -> bool:
+        """Vrai si un appel peut partir ; en semi-ouvert, un seul appel d'essai à la fois"""
+        with self._lock:
+            if self.state == self.OPEN and self.retry_in() == 0:
+                self.state = self.HALF_OPEN
+                self._probe_in_flight = False
+            if self.state == self.HALF_OPEN:
+                if self._probe_in_flight:
+                    return False
+                self._probe_in_flight = True
+                return True
+            return self.state == self.CLOSED
+
+    def _open(self, error: str):
+        if self.state == self.HALF_OPEN:
+            # L'essai a échoué : réouverture plus longue
+            self._open_seconds = min(self._open_seconds * 2, self.settings["max_open_seconds"])
+        self.state = self.OPEN
+        self.last_error = error
+        self._opened_at = time.monotonic()
+        self._probe_in_flight = False
+
+    def release_probe(self):
+        """Appel d'essai terminé sans résultat (annulé, interrompu) : le prochain appel servira d'essai"""
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self._probe_in_flight = False
+
+    def record_success(self, latency_ms: Optional[float] = None):
+        if self.slow_call_ms and latency_ms is not None and latency_ms > self.slow_call_ms:
+            self.record_failure(f"appel lent ({latency_ms / 1000:.0f} s)")
+            return
+        with self._lock:
+            self._outcomes.append(True)
+            self._consecutive_failures = 0
+            if self.state == self.HALF_OPEN:
+                self.state = self.CLOSED
+                self._outcomes.clear()
+                self._open_seconds = self.settings["open_seconds"]
+                self._probe_in_flight = False
+
+    def record_failure(self, error: str, fatal: bool = False):
+        """Échec d'un appel ; fatal=True (agent introuvable, accès refusé) ouvre immédiatement"""
+        with self._lock:
+            self._outcomes.append(False)
+            self._consecutive_failures += 1
+            failures = self._outcomes.count(False)
+            if (
+                fatal
+                or self.state == self.HALF_OPEN
+                or self._consecutive_failures >= self.settings["consecutive_failures"]
+                or (len(self._outcomes) >= self.settings["min_calls"] and failures / len(self._outcomes) >= self.settings["failure_rate"])
+            ):
+                self._open(error)
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            calls = len(self._outcomes)
+            return {
+                "agent": COLLABORATOR_REGISTRY.name(self.agent_key),
+                "état": self.state,
+                "échecs": f"{self._outcomes.count(False)}/{calls}",
+                "réessai_s": round(self.retry_in()),
+                "dernière_erreur": self.last_error[:120]
+            }
+
+class CircuitBreakerRegistry:
+    """Disjoncteurs du processus, un par agent"""
+
+    def __init__(self):
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._lock = threading.Lock()
+
+    def get(self, agent_key: str) -> CircuitBreaker:
+        with self._lock:
+            breaker = self._breakers.get(agent_key)
+            if breaker is None:
+                breaker = self._breakers[agent_key] = CircuitBreaker(agent_key)
+            return breaker
+
+    def report(self, only_tripped: bool = False) -> List[Dict]:
+        with self._lock:
+            breakers = list(self._breakers.values())
+        return [b.snapshot() for b in breakers if not only_tripped or b.state != CircuitBreaker.CLOSED]
+
+@st.cache_resource
+def get_circuit_breakers() -> CircuitBreakerRegistry:
+    """Disjoncteurs partagés par toutes les sessions"""
+    return CircuitBreakerRegistry()
+
+def resolve_available_agent(agent_key: str) -> Tuple[str, str]:
+    """
+    Agent à utiliser : l'agent demandé si son disjoncteur n'est pas ouvert, sinon son agent de repli disponible.
+    Retourne (clé d'agent, note de repli éventuelle)
+    """
+    registry = get_circuit_breakers()
+    breaker = registry.get(agent_key)
+    if breaker.state != CircuitBreaker.OPEN or breaker.retry_in() == 0:
+        return agent_key, ""
+    fallback = BREAKER_SETTINGS["fallbacks"].get(agent_key)
+    if fallback in AGENTS and registry.get(fallback).state != CircuitBreaker.OPEN:
+        return fallback, f"↪️ {COLLABORATOR_REGISTRY.name(agent_key)} indisponible (disjoncteur ouvert) : réponse de {COLLABORATOR_REGISTRY.name(fallback)}.\n\n"
+    return agent_key, ""
+
+# ANNULATION COOPÉRATIVE DES TOURS EN COURS
+CANCEL_POLL_INTERVAL = 0.25  # Secondes entre deux points d'interruption pendant l'attente d'un appel
+
+class TurnCancellation:
+    """
+    Jeton d'annulation d'un tour, partagé entre la boucle asyncio du script et les threads d'appel.
+    Un clic (bouton Arrêter ou tout autre widget) fait lever par Streamlit une exception de contrôle
+    au prochain appel st.* : checkpoint() la capte, ferme les flux enregistrés et annule le tour.
+    """
+
+    def __init__(self, placeholder=None):
+        self.placeholder = placeholder
+        self.control_exception: Optional[BaseException] = None
+        self.partial_results: Dict[str, str] = {}
+        self._event = threading.Event()
+        self._closers: Dict[int, object] = {}
+        self._next_id = itertools.count()
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def register(self, closer) -> int:
+        """Enregistre la fermeture d'une ressource (flux HTTP) ; appelée immédiatement si le tour est déjà annulé"""
+        with self._lock:
+            if not self._event.is_set():
+                closer_id = next(self._next_id)
+                self._closers[closer_id] = closer
+                return closer_id
+        closer()
+        return -1
+
+    def unregister(self, closer_id: int):
+        with self._lock:
+            self._closers.pop(closer_id, None)
+
+    def cancel(self, control_exception: Optional[BaseException] = None):
+        """Annule le tour et ferme tous les flux en cours (utilisable depuis n'importe quel thread)"""
+        with self._lock:
+            if control_exception is not None and self.control_exception is None:
+                self.control_exception = control_exception
+            self._event.set()
+            closers, self._closers = list(self._closers.values()), {}
+        for closer in closers:
+            closer()
+
+    def checkpoint(self):
+        """Point d'interruption du thread du script : lève CancelledError si le tour est annulé"""
+        if not self._event.is_set() and self.placeholder is not None:
+            try:
+                # Tout appel st.* laisse Streamlit interrompre le script si un rerun a été demandé
+                self.placeholder.caption(st.session_state.get("progress_text", ""))
+            except ScriptControlException as e:
+                self.cancel(e)
+        if self._event.is_set():
+            raise asyncio.CancelledError()
+
+def current_turn_cancellation() -> Optional[TurnCancellation]:
+    """Jeton du tour en cours de la session (None hors d'un tour)"""
+    try:
+        return st.session_state.get("turn_cancellation")
+    except Exception:
+        return None
+
+async def await_cancellable(future):
+    """Attend un appel exécuté dans un pool en restant interruptible et en affichant le texte déjà reçu"""
+    cancellation = current_turn_cancellation()
+    live_output = current_live_output()
+    if cancellation is None and live_output is None:
+        return await future
+    future = asyncio.ensure_future(future)
+    interval = LIVE_REFRESH_INTERVAL if live_output is not None else CANCEL_POLL_INTERVAL
+    while True:
+        done, _ = await asyncio.wait({future}, timeout=interval)
+        if live_output is not None:
+            try:
+                live_output.flush()
+            except ScriptControlException as e:
+                # Rerun demandé pendant l'affichage : même traitement qu'au point d'interruption
+                if cancellation is None:
+                    raise
+                cancellation.cancel(e)
+        if cancellation is not None:
+            # Aussi quand l'appel vient de se terminer : un rerun capté pendant l'affichage arrête le tour
+            cancellation.checkpoint()
+        if done:
+            return future.result()
+
+def end_cancelled_session(session: "BedrockSession"):
+    """Oublie la session d'un appel annulé et la ferme côté Bedrock"""
+    get_session_manager().discard(session)
+    # Le tour interrompu a ouvert la session côté serveur, même s'il n'a pas été comptabilisé
+    session.turns = max(session.turns, 1)
+    end_sessions_in_background([session])
+
+# AFFICHAGE EN DIRECT DES RÉPONSES (MODE SÉQUENCE)
+LIVE_REFRESH_INTERVAL = 0.15  # Secondes entre deux mises à jour des colonnes pendant le streaming
+
+class LiveAgentOutput:
+    """
+    Réponses des agents affichées pendant leur streaming : les threads d'appel déposent le texte dans une file,
+    le thread du script la vide à chaque point d'attente et met à jour l'emplacement (st.empty) de chaque étape.
+    Les emplacements sont indexés par numéro d'étape : un agent répété dans la séquence a une colonne par passage
+    """
+
+    def __init__(self, placeholders: Dict[int, object]):
+        self.placeholders = placeholders
+        self._queue: "queue.SimpleQueue[Tuple[int, Optional[str]]]" = queue.SimpleQueue()
+        self._texts: Dict[int, str] = {}
+        self._finalized = set()
+
+    def sink(self, step: int) -> Callable[[Optional[str]], None]:
+        """Callback des threads d'appel : texte reçu, ou None pour repartir de zéro (nouvelle tentative)"""
+        return lambda text: self._queue.put((step, text))
+
+    def flush(self):
+        """Affiche le texte arrivé depuis la dernière mise à jour (thread du script uniquement)"""
+        dirty = set()
+        while True:
+            try:
+                step, text = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            self._texts[step] = "" if text is None else self._texts.get(step, "") + text
+            dirty.add(step)
+        for step in dirty - self._finalized:
+            if self._texts[step]:
+                placeholder = self.placeholders.get(step)
+                if placeholder is not None:
+                    placeholder.markdown(self._texts[step] + " ▌")
+            else:
+                self.start(step)
+
+    def start(self, step: int):
+        """Étape en attente de son premier chunk (début d'étape ou nouvelle tentative)"""
+        placeholder = self.placeholders.get(step)
+        if placeholder is not None:
+            placeholder.caption("⏳ Traitement en cours...")
+
+    def finalize(self, step: int, response: str):
+        """Réponse complète de l'étape, affichée dès la fin de son flux"""
+        self.flush()
+        self._finalized.add(step)
+        placeholder = self.placeholders.get(step)
+        if placeholder is not None:
+            placeholder.markdown(response)
+
+def current_live_output() -> Optional[LiveAgentOutput]:
+    """Affichage en direct du tour en cours (None hors du mode séquence)"""
+    try:
+        return st.session_state.get("turn_live_output")
+    except Exception:
+        return None
+
+# ORDONNANCEMENT ÉQUITABLE DES APPELS ENTRE UTILISATEURS
+try:
+    SCHEDULER_MAX_CONCURRENT = int(st.secrets.get("scheduler", {}).get("MAX_CONCURRENT", 16))
+    SCHEDULER_INTERACTIVE_RESERVED = int(st.secrets.get("scheduler", {}).get("INTERACTIVE_RESERVED", 4))
+    SCHEDULER_WEIGHTS = {
+        "interactive": float(st.secrets.get("scheduler", {}).get("INTERACTIVE_WEIGHT", 4.0)),
+        "batch": float(st.secrets.get("scheduler", {}).get("BATCH_WEIGHT", 1.0))
+    }
+except Exception:
+    SCHEDULER_MAX_CONCURRENT = 16  # Appels Bedrock simultanés par processus (à diviser par le nombre de répliques)
+    SCHEDULER_INTERACTIVE_RESERVED = 4  # Places que les traitements par lots ne peuvent jamais occuper
+    SCHEDULER_WEIGHTS = {"interactive": 4.0, "batch": 1.0}  # Poids de la file équitable par classe
+
+@dataclass(slots=True)
+class SchedulerTicket:
+    """Demande de place pour un appel d'agent, accordée via son Future"""
+    tenant: str
+    agent_key: str
+    priority: str  # "interactive" ou "batch"
+    virtual_finish: float
+    enqueued_at: float
+    future: Future = field(default_factory=Future)
+    granted_at: Optional[float] = None
+    released: bool = False
+
+class FairAgentScheduler:
+    """
+    File équitable pondérée (WFQ) des appels Bedrock du processus : une file par utilisateur et par classe,
+    le prochain appel servi est celui de plus petite date de fin virtuelle. Les requêtes interactives
+    (agent unique, routeur) pèsent plus que les pipelines et ont des places réservées.
+    L'ordonnanceur est local au processus : avec plusieurs répliques (backend d'état partagé), chacune applique
+    sa propre limite et le quota Bedrock réellement partagé vaut MAX_CONCURRENT × nombre de répliques.
+    """
+
+    def __init__(self, max_concurrent: int = SCHEDULER_MAX_CONCURRENT,
+                 interactive_reserved: int = SCHEDULER_INTERACTIVE_RESERVED, weights: Optional[Dict[str, float]] = None):
+        self.max_concurrent = max(1, max_concurrent)
+        self.interactive_reserved = min(max(0, interactive_reserved), self.max_concurrent - 1)
+        self.weights = weights or SCHEDULER_WEIGHTS
+        self._queues: Dict[Tuple[str, str], deque] = {}
+        self._last_finish: Dict[Tuple[str, str], float] = {}
+        self._virtual_time = 0.0
+        self._running = {"interactive": 0, "batch": 0}
+        self._granted = {"interactive": 0, "batch": 0}
+        self._waits = {"interactive": deque(maxlen=500), "batch": deque(maxlen=500)}
+        self._lock = threading.Lock()
+
+    def submit(self, tenant: str, agent_key: str, priority: str = "interactive") -> SchedulerTicket:
+        """Met un appel en file ; son Future est résolu quand une place lui est accordée"""
+        with self._lock:
+            queue_key = (tenant, priority)
+            start = max(self._virtual_time, self._last_finish.get(queue_key, 0.0))
+            ticket = SchedulerTicket(tenant, agent_key, priority, start + 1.0 / self.weights.get(priority, 1.0),
+                                     time.monotonic())
+            self._last_finish[queue_key] = ticket.virtual_finish
+            self._queues.setdefault(queue_key, deque()).append(ticket)
+            granted = self._dispatch()
+        self._notify(granted)
+        return ticket
+
+    def release(self, ticket: SchedulerTicket):
+        """Libère la place d'un appel terminé, ou le retire de la file s'il attendait encore (annulation)"""
+        with self._lock:
+            if ticket.released:
+                return
+            ticket.released = True
+            if ticket.granted_at is not None:
+                self._running[ticket.priority] -= 1
+            else:
+                ticket.future.cancel()
+                queue = self._queues.get((ticket.tenant, ticket.priority))
+                if queue is not None and ticket in queue:
+                    queue.remove(ticket)
+            granted = self._dispatch()
+        self._notify(granted)
+
+    def _can_start(self, priority: str) -> bool:
+        running = self._running["interactive"] + self._running["batch"]
+        if priority == "batch":
+            return running < self.max_concurrent - self.interactive_reserved
+        return running < self.max_concurrent
+
+    def _dispatch(self) -> List[SchedulerTicket]:
+        """Accorde les places libres aux têtes de file de plus petite fin virtuelle (sous verrou)"""
+        granted = []
+        while True:
+            candidates = [queue[0] for queue in self._queues.values() if queue and self._can_start(queue[0].priority)]
+            if not candidates:
+                break
+            ticket = min(candidates, key=lambda t: t.virtual_finish)
+            queue_key = (ticket.tenant, ticket.priority)
+            self._queues[queue_key].popleft()
+            if not self._queues[queue_key]:
+                del self._queues[queue_key]
+            # Appel annulé avant d'avoir obtenu sa place : ne rien lui réserver
+            if not ticket.future.set_running_or_notify_cancel():
+                ticket.released = True
+                continue
+            ticket.granted_at = time.monotonic()
+            self._virtual_time = max(self._virtual_time, ticket.virtual_finish - 1.0 / self.weights.get(ticket.priority, 1.0))
+            self._running[ticket.priority] += 1
+            self._granted[ticket.priority] += 1
+            self._waits[ticket.priority].append((ticket.granted_at - ticket.enqueued_at) * 1000)
+            granted.append(ticket)
+        if not any(self._queues.values()) and not any(self._running.values()):
+            # Système au repos : les dates virtuelles repartent de zéro
+            self._virtual_time = 0.0
+            self._last_finish.clear()
+        return granted
+
+    @staticmethod
+    def _notify(granted: List[SchedulerTicket]):
+        # Résolution hors verrou : les callbacks réveillent les boucles asyncio des sessions
+        for ticket in granted:
+            ticket.future.set_result(ticket)
+
+    def report(self) -> List[Dict]:
+        """Profondeur de file, appels en cours et attente (p50/p95) par classe"""
+        with self._lock:
+            rows = []
+            for priority in ("interactive", "batch"):
+                waits = sorted(self._waits[priority])
+                queued = [t for (tenant, p), queue in self._queues.items() if p == priority for t in queue]
+                rows.append({
+                    "classe": priority,
+                    "en_cours": self._running[priority],
+                    "en_file": len(queued),
+                    "utilisateurs_en_file": len({t.tenant for t in queued}),
+                    "accordés": self._granted[priority],
+                    "attente_p50_ms": round(waits[len(waits) // 2]) if waits else None,
+                    "attente_p95_ms": round(waits[min(len(waits) - 1, int(len(waits) * 0.95))]) if waits else None
+                })
+            return rows
+
+@st.cache_resource
+def get_agent_scheduler() -> FairAgentScheduler:
+    """Ordonnanceur partagé par toutes les sessions du processus (pas entre répliques)"""
+    return FairAgentScheduler()
+
+# APPELS AUX AGENTS EN ARRIÈRE-PLAN ET REQUÊTES COUVERTES (HEDGING)
+try:
+    HEDGE_DEFAULT_DELAY = float(st.secrets["bedrock"].get("HEDGE_DEFAULT_DELAY", 8.0))
+    HEDGE_BUDGET_RATIO = float(st.secrets["bedrock"].get("HEDGE_BUDGET_RATIO", 0.1))
+except Exception:
+    HEDGE_DEFAULT_DELAY = 8.0
+    HEDGE_BUDGET_RATIO = 0.1
+HEDGE_MIN_SAMPLES = 20  # Mesures nécessaires avant d'utiliser le p95 observé
+HEDGE_BUDGET_BURST = 2  # Requêtes couvertes autorisées avant que le ratio ne s'applique
+
+@st.cache_resource
+def get_agent_executor() -> ThreadPoolExecutor:
+    """Pool de threads des appels Bedrock, dimensionné comme le pool de connexions du client"""
+    return ThreadPoolExecutor(max_workers=50, thread_name_prefix="agent-call")
+
+class AgentStream:
+    """Flux d'un appel en cours : événements lus jusqu'au premier chunk, puis la suite du flux"""
+
+    __slots__ = ("response", "buffered", "iterator", "started_at", "connect_ms", "first_chunk_ms")
+
+    def __init__(self, response: Dict, started_at: float, connect_ms: float):
+        self.response = response
+        self.buffered = []
+        self.iterator = iter(response.get("completion", []))
+        self.started_at = started_at
+        self.connect_ms = connect_ms
+        self.first_chunk_ms = None
+
+    def close(self):
+        """Ferme le flux HTTP sous-jacent (appel perdant ou annulé)"""
+        close = getattr(self.response.get("completion"), "close", None)
+        if close:
+            try:
+                close()
+            except Exception:
+                pass
+
+def start_agent_stream(client, invoke_params: Dict, cancellation: Optional[TurnCancellation] = None) -> AgentStream:
+    """Invoque l'agent et lit le flux jusqu'au premier chunk de texte (bloquant)"""
+    started_at = time.perf_counter()
+    response = client.invoke_agent(**invoke_params)
+    stream = AgentStream(response, started_at, (time.perf_counter() - started_at) * 1000)
+    if cancellation is not None:
+        # Annulation : le flux est fermé depuis le thread du script, la lecture bloquée s'interrompt
+        cancellation.register(stream.close)
+    for event in stream.iterator:
+        stream.buffered.append(event)
+        if "chunk" in event:
+            stream.first_chunk_ms = (time.perf_counter() - started_at) * 1000
+            break
+    return stream
+
+def finish_agent_stream(stream: AgentStream, keep_raw_chunks: bool = False,
+                        on_text: Optional[Callable[[Optional[str]], None]] = None) -> Tuple[ParsedResponse, Dict]:
+    """Lit la fin du flux et le parse : (réponse parsée, mesures de latence)"""
+    parsed = parse_multi_agent_response_complete(
+        {**stream.response, "completion": itertools.chain(stream.buffered, stream.iterator)}, keep_raw_chunks, on_text
+    )
+    timings = {
+        "connect_ms": stream.connect_ms,
+        "first_chunk_ms": stream.first_chunk_ms,
+        "total_ms": (time.perf_counter() - stream.started_at) * 1000
+    }
+    return parsed, timings
+
+def run_agent_call(client, invoke_params: Dict, keep_raw_chunks: bool = False,
+                   cancellation: Optional[TurnCancellation] = None,
+                   on_text: Optional[Callable[[Optional[str]], None]] = None) -> Tuple[ParsedResponse, Dict]:
+    """Appel complet d'un agent (bloquant, exécuté dans le pool d'appels)"""
+    if cancellation is not None and cancellation.cancelled:
+        raise asyncio.CancelledError()
+    return finish_agent_stream(start_agent_stream(client, invoke_params, cancellation), keep_raw_chunks, on_text)
+
+class HedgePolicy:
+    """Délai de couverture par agent (p95 du premier chunk) et budget de requêtes dupliquées"""
+
+    def __init__(self, budget_ratio: float = HEDGE_BUDGET_RATIO, burst: int = HEDGE_BUDGET_BURST):
+        self.budget_ratio = budget_ratio
+        self.burst = burst
+        self._counters: Dict[str, Dict[str, int]] = {}
+        self._lock = threading.Lock()
+
+    def _agent_counters(self, agent_key: str) -> Dict[str, int]:
+        return self._counters.setdefault(agent_key, {"requests": 0, "hedges": 0, "hedge_wins": 0, "primary_wins": 0})
+
+    def delay_for(self, agent_key: str, stats: AgentLatencyStats) -> float:
+        """Délai (s) sans premier chunk au-delà duquel une requête dupliquée est envoyée"""
+        if stats.count(agent_key, "first_chunk_ms") >= HEDGE_MIN_SAMPLES:
+            return stats.percentile(agent_key, "first_chunk_ms", 95) / 1000
+        return HEDGE_DEFAULT_DELAY
+
+    def register_request(self, agent_key: str):
+        with self._lock:
+            self._agent_counters(agent_key)["requests"] += 1
+
+    def try_acquire(self, agent_key: str) -> bool:
+        """Réserve une requête dupliquée si le budget de l'agent le permet"""
+        with self._lock:
+            counters = self._agent_counters(agent_key)
+            if counters["hedges"] + 1 > self.budget_ratio * counters["requests"] + self.burst:
+                return False
+            counters["hedges"] += 1
+            return True
+
+    def record_winner(self, agent_key: str, hedge_won: bool):
+        with self._lock:
+            self._agent_counters(agent_key)["hedge_wins" if hedge_won else "primary_wins"] += 1
+
+    def report(self) -> List[Dict]:
+        """Nombre de requêtes, de duplications et de victoires de la duplication par agent"""
+        with self._lock:
+            return [{"agent": key, **counters} for key, counters in self._counters.items()]
+
+@st.cache_resource
+def get_hedge_policy() -> HedgePolicy:
+    """Politique de couverture partagée par le processus"""
+    return HedgePolicy()
+
+async def hedged_agent_call(client, agent_key: str, invoke_params: Dict, keep_raw_chunks: bool = False,
+                            cancellation: Optional[TurnCancellation] = None,
+                            on_text: Optional[Callable[[Optional[str]], None]] = None,
+                            priority: str = "interactive") -> Tuple[ParsedResponse, Dict, bool]:
+    """
+    Appel couvert : si aucun chunk n'arrive avant le délai de l'agent, un doublon est envoyé
+    sur une session neuve (sans le contexte de la conversation : réservé aux appels qui n'en ont pas) ;
+    le doublon prend sa propre place dans l'ordonnanceur et n'est pas envoyé si aucune n'est libre tout de suite.
+    Le premier flux qui produit du texte gagne, l'autre est fermé aussitôt, même bloqué avant son premier chunk.
+    Retourne (réponse parsée, mesures, True si le doublon a gagné)
+    """
+    loop = asyncio.get_running_loop()
+    executor = get_agent_executor()
+    policy = get_hedge_policy()
+    policy.register_request(agent_key)
+
+    def start_call(params: Dict) -> Tuple[asyncio.Future, TurnCancellation]:
+        # Jeton propre à l'appel, annulé avec le tour : le perdant peut être fermé seul
+        call_cancellation = TurnCancellation()
+        if cancellation is not None:
+            cancellation.register(call_cancellation.cancel)
+        return asyncio.wrap_future(executor.submit(start_agent_stream, client, params, call_cancellation)), call_cancellation
+
+    calls = {}
+    primary, calls[primary] = start_call(invoke_params)
+    deadline = time.monotonic() + policy.delay_for(agent_key, get_latency_stats())
+    while not primary.done() and time.monotonic() < deadline:
+        await asyncio.wait({primary}, timeout=min(CANCEL_POLL_INTERVAL, max(0.0, deadline - time.monotonic())))
+        if cancellation is not None and not primary.done():
+            cancellation.checkpoint()
+
+    winner = primary
+    hedge_session = None
+    hedge_ticket = None
+    if not primary.done():
+        # Le doublon compte dans MAX_CONCURRENT, sans passer devant les appels déjà en file
+        scheduler = get_agent_scheduler()
+        hedge_ticket = scheduler.submit(get_user_id(), agent_key, priority)
+        if hedge_ticket.granted_at is None:
+            scheduler.release(hedge_ticket)
+            hedge_ticket = None
+    if hedge_ticket is not None and not policy.try_acquire(agent_key):
+        scheduler.release(hedge_ticket)
+        hedge_ticket = None
+    if hedge_ticket is not None:
+        hedge_session = BedrockSession(get_user_id(), agent_key, ephemeral=True)
+        hedge, calls[hedge] = start_call({**invoke_params, "sessionId": hedge_session.session_id})
+        pending, winner = {primary, hedge}, None
+        while pending and winner is None:
+            done, pending = await asyncio.wait(pending, timeout=CANCEL_POLL_INTERVAL, return_when=asyncio.FIRST_COMPLETED)
+            if not done and cancellation is not None:
+                cancellation.checkpoint()
+            successful = [f for f in done if f.exception() is None]
+            if successful:
+                winner = primary if primary in successful else successful[0]
+        if winner is None:
+            # Les deux appels ont échoué : remonter l'erreur de l'appel principal
+            winner = primary
+        for future, call_cancellation in calls.items():
+            if future is not winner:
+                # Flux du perdant fermé tout de suite, ou dès son ouverture s'il n'a pas encore répondu
+                call_cancellation.cancel()
+        policy.record_winner(agent_key, winner is hedge)
+
+    try:
+        stream = await winner
+        parsed, timings = await await_cancellable(loop.run_in_executor(executor, finish_agent_stream, stream, keep_raw_chunks, on_text))
+    finally:
+        if hedge_session is not None:
+            # Session du doublon fermée une fois le flux gagnant terminé (ou le perdant fermé)
+            end_ephemeral_session(hedge_session)
+            get_agent_scheduler().release(hedge_ticket)
+    return parsed, timings, winner is not primary
+
 # FONCTION PRINCIPALE AMÉLIORÉE pour gérer multi-agent collaboration
-async def execute_agent(agent_key, agent_info, message_content):
+async def execute_agent(agent_key, agent_info, message_content, hedge=False, ephemeral=False, batch=False, on_text=None,
+                        index_query=None):
     """
     Exécute un agent spécifique avec Bedrock - Version complète avec parsing avancé
+    L'appel bloquant s'exécute dans le pool d'appels ; hedge=True active les requêtes couvertes,
+    ephemeral=True utilise une session jetable (appels indépendants et simultanés du même agent),
+    batch=True place l'appel dans la classe basse priorité de l'ordonnanceur (pipelines, sections),
+    on_text reçoit le texte au fil du flux depuis le thread d'appel (None : nouvelle tentative),
+    index_query est la question de l'utilisateur à chercher dans l'index local (sans elle, pas de recherche locale)
     """
     max_retries = 3
     retry_delay = 2
+    metrics = get_metrics()
+
+    # Recherche : l'index local répond sans appel distant quand il connaît déjà les documents
+    if agent_key == "index_search" and index_query:
+        local_answer = lookup_local_index(index_query)
+        metrics.record_cache("local_index", bool(local_answer))
+        if local_answer:
+            return local_answer
     
+    breaker = get_circuit_breakers().get(agent_key)
+    scheduler = get_agent_scheduler()
     for attempt in range(max_retries):
+        probe = False
         try:
             agent_icon = agent_info['icon']
             agent_name = agent_info['name']
@@ -418,83 +2354,128 @@ async def execute_agent(agent_key, agent_info, message_content):
 
             client = get_bedrock_client()
             if not client:
+                breaker.record_failure("client Bedrock indisponible")
                 return f"Erreur: Impossible d'initialiser le client Bedrock pour {agent_name}"
                 
-            current_session_id = get_or_create_session_id()
+            if ephemeral:
+                session = BedrockSession(get_user_id(), agent_key, ephemeral=True)
+            else:
+                session = acquire_agent_session(agent_key)
+            # Le doublon d'un appel couvert part sans le contexte de la session : pas de couverture quand il y en a un
+            hedge_call = hedge and (session.ephemeral or session.turns == 0)
             
             # Attendre un peu entre les requêtes pour éviter le throttling
             if attempt > 0:
-                time.sleep(retry_delay * attempt)
+                await asyncio.sleep(retry_delay * attempt)
             
             # Invoquer l'agent avec configuration optimisée
             invoke_params = {
                 "agentId": AGENT_IDS[agent_key],
                 "agentAliasId": AGENT_ALIAS_IDS[agent_key],
-                "sessionId": current_session_id,
+                "sessionId": session.session_id,
                 "inputText": message_content,
                 "enableTrace": True,
-                "endSession": False
+                "endSession": False  # Session jetable fermée à part une fois la réponse reçue
             }
             
-            # Pour l'agent routeur, forcer l'exécution réelle
-            if agent_key == "router":
-                invoke_params["enableTrace"] = True
-                # Prompt spécifique pour forcer l'exécution
-                invoke_params["inputText"] = f"EXECUTE (do not just plan): Collaborate with your agents to handle: {message_content}. You must actually invoke your collaborator agents, not just describe what you would do."
+            # Gabarit de l'agent (pour le routeur : forcer l'exécution réelle, sans double enrobage)
+            invoke_params["inputText"] = PROMPT_REGISTRY.render(agent_key, "execute", query=message_content)
             
-            response = client.invoke_agent(**invoke_params)
-
-            # Utiliser le nouveau parser complet
-            parsed_response = parse_multi_agent_response_complete(response)
+            # Utiliser le nouveau parser complet, hors de la boucle d'événements
+            keep_raw_chunks = st.session_state.debug_mode
+            hedge_won = False
+            cancellation = current_turn_cancellation()
+            # Place accordée par l'ordonnanceur équitable avant tout appel au quota Bedrock partagé
+            ticket = scheduler.submit(get_user_id(), agent_key, "batch" if batch else "interactive")
+            called = False
+            try:
+                await await_cancellable(asyncio.wrap_future(ticket.future))
+                metrics.scheduler_wait.observe(ticket.granted_at - ticket.enqueued_at, **{"class": ticket.priority})
+                # Disjoncteur consulté une fois la place obtenue : une sonde semi-ouverte ne patiente jamais en file.
+                # Ouvert : échec immédiat plutôt que des tentatives vouées à l'échec
+                if not breaker.allow():
+                    metrics.agent_invocations.inc(agent=agent_key, outcome="breaker_open")
+                    return (f"⛔ {agent_name} temporairement indisponible (disjoncteur ouvert, nouvel essai dans "
+                            f"{breaker.retry_in():.0f} s). Dernière erreur : {breaker.last_error}")
+                probe = breaker.state == CircuitBreaker.HALF_OPEN
+                called = True
+                if on_text is not None:
+                    on_text(None)  # Le texte d'une tentative précédente est remplacé
+                if hedge_call:
+                    parsed_response, timings, hedge_won = await hedged_agent_call(client, agent_key, invoke_params,
+                                                                                  keep_raw_chunks, cancellation, on_text,
+                                                                                  ticket.priority)
+                else:
+                    parsed_response, timings = await await_cancellable(asyncio.get_running_loop().run_in_executor(
+                        get_agent_executor(), run_agent_call, client, invoke_params, keep_raw_chunks, cancellation, on_text
+                    ))
+            except asyncio.CancelledError:
+                # Tour annulé : flux déjà fermés par le jeton, la session interrompue est fermée côté Bedrock
+                if called and not session.ephemeral:
+                    end_cancelled_session(session)
+                raise
+            finally:
+                scheduler.release(ticket)
+                if called and session.ephemeral:
+                    end_ephemeral_session(session)
+            get_latency_stats().record(agent_key, **timings)
+            breaker.record_success(timings.get("total_ms"))
+            metrics.agent_invocations.inc(agent=agent_key, outcome="success")
+            metrics.agent_latency.observe(timings["total_ms"] / 1000 if timings.get("total_ms") is not None else None, agent=agent_key)
+            metrics.agent_first_chunk.observe(timings["first_chunk_ms"] / 1000 if timings.get("first_chunk_ms") is not None else None,
+                                              agent=agent_key)
+            metrics.record_parse_errors(parsed_response.errors)
+            if not hedge_won:
+                get_session_manager().record_turn(session, len(invoke_params["inputText"]), len(parsed_response.final_response))
+            elif not session.ephemeral:
+                # La session de contexte garde un tour dont la réponse n'a pas été lue : fermée comme après une annulation
+                end_cancelled_session(session)
             
             # Si mode debug, afficher les détails de l'orchestration
             if st.session_state.debug_mode:
                 # Afficher les étapes d'orchestration
-                if parsed_response["orchestration_steps"]:
+                if parsed_response.orchestration_steps:
                     st.info("🔍 Étapes d'orchestration:")
-                    for step in parsed_response["orchestration_steps"]:
-                        if step["type"] == "orchestration":
-                            st.write(f"  📋 Raisonnement: {step['reasoning']}")
-                        elif step["type"] == "collaborator_response":
-                            st.write(f"  ✅ Réponse de {step['agent']}: {step['response_preview']}")
-                        elif step["type"] == "action_group":
-                            st.write(f"  ⚡ Action: {step['output']}")
-                        elif step["type"] == "knowledge_base":
-                            st.write(f"  📚 Knowledge Base: {step['references_count']} références trouvées")
+                    for step in parsed_response.orchestration_steps:
+                        if step.type == "reasoning":
+                            st.write(f"  📋 Raisonnement: {step.content}")
+                        elif step.type in ("collaborator_response", "agent_response"):
+                            agent_icon = COLLABORATOR_REGISTRY.icon_for(step.agent)
+                            st.write(f"  ✅ {agent_icon} Réponse de {step.agent}: {step.content}")
+                        elif step.type == "action":
+                            st.write(f"  ⚡ Action: {step.content}")
+                        elif step.type == "knowledge_search":
+                            st.write(f"  📚 Knowledge Base: {step.references_count} références trouvées")
                 
                 # Afficher les erreurs filtrées
-                if parsed_response["errors"]:
-                    st.warning(f"⚠️ Erreurs filtrées: {', '.join(parsed_response['errors'])}")
+                if parsed_response.errors:
+                    st.warning(f"⚠️ Erreurs filtrées: {', '.join(parsed_response.errors)}")
             
             # Traitement spécial pour l'agent routeur
             if agent_key == "router":
+                # Agents réellement sollicités par le routeur (journalisés pour la sélection adaptative)
+                st.session_state.router_collaborators = sorted({
+                    agent for agent in map(COLLABORATOR_REGISTRY.resolve, parsed_response.collaborator_responses) if agent
+                })
                 # Vérifier si l'orchestration a bien eu lieu
-                has_collaboration = bool(parsed_response["collaborator_responses"]) or any(
-                    step["type"] in ["agent_response", "collaborator_response"] 
-                    for step in parsed_response["orchestration_steps"]
-                )
-                
-                if has_collaboration:
+                if parsed_response.has_collaboration:
                     # Orchestration réussie - formater la réponse
                     sections = []
                     
-                    if parsed_response["final_response"]:
-                        sections.append(f"🎯 **Orchestration Multi-Agent Complétée**\n\n{parsed_response['final_response']}")
+                    if parsed_response.final_response:
+                        sections.append(f"🎯 **Orchestration Multi-Agent Complétée**\n\n{parsed_response.final_response}")
                     
-                    if parsed_response["collaborator_responses"]:
+                    if parsed_response.collaborator_responses:
                         sections.append("\n---\n🤝 **Détails des Collaborateurs:**")
-                        for agent_name, agent_data in parsed_response["collaborator_responses"].items():
-                            agent_icon = "🤖"
-                            for key, info in AGENTS.items():
-                                if any(keyword in agent_name.lower() for keyword in [key, info["name"].lower().split()[0]]):
-                                    agent_icon = info["icon"]
-                                    break
-                            sections.append(f"\n{agent_icon} **{agent_name}:**\n{agent_data['response']}")
+                        sections.extend(format_collaborator_sections(
+                            parsed_response.collaborator_responses,
+                            "\n{icon} **{name}:**\n{response}"
+                        ))
                     
                     return "\n".join(sections)
                 else:
                     # Détecter si c'est une simulation au lieu d'une exécution
-                    response_text = parsed_response["final_response"]
+                    response_text = parsed_response.final_response
                     simulation_keywords = ["orchestration_sequence", "reasoning", "workflow_type", "let me prepare", "proceed with"]
                     
                     if any(keyword in response_text.lower() for keyword in simulation_keywords):
@@ -503,14 +2484,26 @@ async def execute_agent(agent_key, agent_info, message_content):
                         return f"🎯 **Agent Routeur (Réponse Directe):**\n\n{response_text}" if response_text else f"⚠️ Pas de réponse du routeur."
             else:
                 # Autres agents - réponse standard
-                return parsed_response["final_response"] if parsed_response["final_response"] else f"⚠️ Pas de réponse de {agent_name}"
+                return parsed_response.final_response if parsed_response.final_response else f"⚠️ Pas de réponse de {agent_name}"
 
+        except ScriptControlException:
+            raise
         except Exception as e:
             error_str = str(e).lower()
+            throttled = "throttling" in error_str or "rate" in error_str
+            if not throttled:
+                # Le throttling signale le quota partagé, pas une panne de l'agent : il n'ouvre pas le disjoncteur.
+                # Agent introuvable ou accès refusé : inutile de réessayer avant l'expiration du disjoncteur
+                breaker.record_failure(str(e)[:200], fatal=any(
+                    marker in error_str for marker in ("accessdenied", "forbidden", "resourcenotfound", "notfound")
+                ))
             
             # Gestion spécifique des erreurs
-            if "throttling" in error_str or "rate" in error_str:
+            metrics.agent_invocations.inc(agent=agent_key, outcome="throttled" if throttled else "error")
+            if throttled:
+                metrics.agent_throttles.inc(agent=agent_key)
                 if attempt < max_retries - 1:
+                    metrics.agent_retries.inc(agent=agent_key, reason="throttling")
                     wait_time = retry_delay * (2 ** attempt)  # Backoff exponentiel
                     st.warning(f"⏳ Limite de débit. Attente {wait_time}s...")
                     await asyncio.sleep(wait_time)
@@ -526,6 +2519,7 @@ async def execute_agent(agent_key, agent_info, message_content):
             
             elif "timeout" in error_str:
                 if attempt < max_retries - 1:
+                    metrics.agent_retries.inc(agent=agent_key, reason="timeout")
                     st.warning(f"⏱️ Timeout pour {agent_name}. Nouvelle tentative...")
                     await asyncio.sleep(retry_delay)
                     continue
@@ -537,6 +2531,10 @@ async def execute_agent(agent_key, agent_info, message_content):
                 if attempt == max_retries - 1:  # Dernière tentative
                     st.error(error_msg)
                 return error_msg
+        finally:
+            if probe:
+                # Essai annulé ou interrompu sans résultat enregistré : sinon le disjoncteur resterait bloqué en semi-ouvert
+                breaker.release_probe()
 
 # Fonction pour exécuter un pipeline séquentiel
 async def run_sequential_pipeline(query):
@@ -544,87 +2542,576 @@ async def run_sequential_pipeline(query):
     try:
         sequence = st.session_state.get("agent_sequence", [])
         if not sequence:
-            return {"error": "Aucune séquence d'agents définie. Veuillez définir une séquence dans la barre latérale."}
+            return PipelineResult.failure("Aucune séquence d'agents définie. Veuillez définir une séquence dans la barre latérale.")
 
         responses = {}
         current_input = query
+        # Colonnes alimentées pendant le streaming (créées par l'interface avant le tour)
+        live_output = current_live_output()
 
         for i, agent_key in enumerate(sequence):
             try:
-                agent_info = AGENTS[agent_key]
+                # Disjoncteur ouvert : l'agent de repli prend l'étape s'il en a un
+                effective_key, fallback_note = resolve_available_agent(agent_key)
+                agent_info = AGENTS[effective_key]
                 st.session_state.progress_text = f"{agent_info['icon']} {agent_info['name']}: Traitement en cours..."
                 st.session_state.progress_value = (i + 1) / len(sequence)
 
-                response = await execute_agent(agent_key, agent_info, current_input)
-                responses[agent_key] = response
-                current_input = f"Tenant compte de la réponse précédente: {response}\n\nQuestion initiale: {query}"
+                if live_output is not None:
+                    live_output.start(i)
+                response = await execute_agent(effective_key, agent_info, current_input, batch=True,
+                                               on_text=live_output.sink(i) if live_output is not None else None,
+                                               index_query=query)
+                step_key = PipelineResult.step_key(i, agent_key)
+                responses[step_key] = fallback_note + response
+                cancellation = current_turn_cancellation()
+                if cancellation is not None:
+                    # Résultats partiels conservés si le tour est interrompu à l'étape suivante
+                    cancellation.partial_results[step_key] = responses[step_key]
+                if live_output is not None:
+                    live_output.finalize(i, responses[step_key])
+                next_key = sequence[i + 1] if i + 1 < len(sequence) else agent_key
+                if is_failed_response(response):
+                    # Le texte d'erreur n'est pas transmis à l'agent suivant
+                    current_input = PROMPT_REGISTRY.render(next_key, "sequence_error", query=query)
+                else:
+                    current_input = PROMPT_REGISTRY.render(next_key, "sequence_followup", previous=response, query=query)
             
+            except ScriptControlException:
+                raise
             except Exception as agent_error:
                 error_message = f"Erreur: {str(agent_error)}"
-                responses[agent_key] = error_message
-                current_input = f"L'agent précédent a rencontré une erreur. Question initiale: {query}"
+                responses[PipelineResult.step_key(i, agent_key)] = error_message
+                if live_output is not None:
+                    live_output.finalize(i, error_message)
+                current_input = PROMPT_REGISTRY.render(sequence[i + 1] if i + 1 < len(sequence) else agent_key,
+                                                       "sequence_error", query=query)
 
         st.session_state.progress_text = "✅ Traitement terminé"
         st.session_state.progress_value = 1.0
 
-        combined_response = "\n\n".join(f"{AGENTS[agent_key]['icon']} {AGENTS[agent_key]['name']}:\n{response}" for agent_key, response in responses.items())
+        # Réponses dans l'ordre des étapes, un bloc par passage même si un agent est répété
+        combined_response = "\n\n".join(
+            f"{COLLABORATOR_REGISTRY.label(agent_key)}:\n{responses[PipelineResult.step_key(i, agent_key)]}"
+            for i, agent_key in enumerate(sequence) if PipelineResult.step_key(i, agent_key) in responses
+        )
 
-        return {
-            "selected_agents": sequence,
-            "agent_names": [AGENTS[agent]['name'] for agent in sequence],
-            "agent_icons": [AGENTS[agent]['icon'] for agent in sequence],
-            "combined": combined_response,
-            **responses
-        }
+        return PipelineResult(
+            selected_agents=tuple(sequence),
+            combined=combined_response,
+            agent_results=responses
+        )
 
+    except ScriptControlException:
+        raise
     except Exception as e:
-        return {"error": f"Erreur lors de l'exécution du workflow multi-agent: {str(e)}"}
+        return PipelineResult.failure(f"Erreur lors de l'exécution du workflow multi-agent: {str(e)}")
 
 # Fonction pour exécuter un agent spécifique (mode agent unique)
-async def run_specific_agent(query, agent_key):
+async def run_specific_agent(query, agent_key, hedge=False):
     """Exécute un agent spécifique (mode agent unique)"""
     try:
-        agent_name = AGENTS[agent_key]["name"]
-        agent_icon = AGENTS[agent_key]["icon"]
+        # Disjoncteur ouvert : réponse de l'agent de repli s'il en a un
+        agent_key, fallback_note = resolve_available_agent(agent_key)
+        agent_name = COLLABORATOR_REGISTRY.name(agent_key)
+        agent_icon = COLLABORATOR_REGISTRY.icon(agent_key)
 
         st.session_state.progress_text = f"{agent_icon} {agent_name}: Préparation de votre réponse..."
         st.session_state.progress_value = 0.5
 
-        response = await execute_agent(agent_key, AGENTS[agent_key], query)
+        response = await execute_agent(agent_key, AGENTS[agent_key], query, hedge=hedge, index_query=query)
 
         st.session_state.progress_text = "✅ Traitement terminé"
         st.session_state.progress_value = 1.0
 
-        return {
-            "selected_agent": agent_key,
-            "agent_name": agent_name,
-            "agent_icon": agent_icon,
-            "combined": response,
-            "selection_method": "Agent unique sélectionné manuellement"
-        }
+        return PipelineResult(
+            selected_agents=(agent_key,),
+            combined=fallback_note + response,
+            selection_method="Agent unique sélectionné manuellement"
+        )
+
+    except ScriptControlException:
+        raise
+    except Exception as e:
+        return PipelineResult.failure(f"Erreur lors de l'exécution de l'agent {agent_key}: {str(e)}")
+
+# ANALYSE MAP-REDUCE DES LONGS DOCUMENTS (mode agent unique)
+try:
+    MAP_REDUCE_SHARD_CHARS = int(st.secrets.get("map_reduce", {}).get("SHARD_CHARS", 12000))
+    MAP_REDUCE_MAX_CONCURRENCY = int(st.secrets.get("map_reduce", {}).get("MAX_CONCURRENCY", 6))
+    MAP_REDUCE_MIN_CHARS = int(st.secrets.get("map_reduce", {}).get("MIN_CHARS", 30000))
+except Exception:
+    MAP_REDUCE_SHARD_CHARS = 12000  # Taille cible d'une section envoyée à l'agent
+    MAP_REDUCE_MAX_CONCURRENCY = 6  # Appels simultanés par tour
+    MAP_REDUCE_MIN_CHARS = 30000  # En dessous, le document est envoyé en une fois
+MAP_REDUCE_AGENTS = ("manager", "quality", "drafter", "market_comparison", "negotiation")
+SHARD_CACHE_MAX_ENTRIES = 1024
+
+def is_shard_boundary(heading: str, clause_chars: int, target_chars: int) -> bool:
+    """
+    Vrai si une section se termine après cette clause. La décision ne dépend que de la clause (empreinte de son titre,
+    probabilité proportionnelle à sa taille) : modifier une clause ne déplace pas les frontières des sections suivantes
+    """
+    fraction = int(hashlib.sha256(heading.encode("utf-8")).hexdigest()[:8], 16) / 0xFFFFFFFF
+    return fraction < clause_chars / target_chars
+
+def shard_document(name: str, content: str, max_chars: int = MAP_REDUCE_SHARD_CHARS) -> List[Tuple[str, str]]:
+    """
+    Regroupe les clauses consécutives d'un document en sections d'au plus max_chars caractères (max_chars / 2 en moyenne),
+    coupées sur des frontières de clauses stables pour que le cache resserve les sections inchangées
+    """
+    shards, headings, parts = [], [], []
+    size = 0
+
+    def flush():
+        if parts:
+            label = headings[0] if len(headings) == 1 else f"{headings[0]} → {headings[-1]}"
+            shards.append((label, "\n\n".join(parts)))
+            headings.clear()
+            parts.clear()
+
+    for clause in split_into_clauses(content):
+        text = f"{clause.heading}\n{clause.body}" if clause.heading != "Préambule" else clause.body
+        # Clause plus longue qu'une section : découpée aux frontières de paragraphes
+        pieces = chunk_text(text, max_chars) if len(text) > max_chars else [text]
+        for i, piece in enumerate(pieces):
+            if parts and size + len(piece) > max_chars:
+                flush()
+                size = 0
+            headings.append(clause.heading if len(pieces) == 1 else f"{clause.heading} ({i + 1}/{len(pieces)})")
+            parts.append(piece)
+            size += len(piece)
+        if len(pieces) > 1 or is_shard_boundary(clause.heading, len(text), max_chars // 2):
+            flush()
+            size = 0
+    flush()
+    return [(f"{name} — {label}", text) for label, text in shards]
 
+class ShardResultCache:
+    """
+    Constats déjà obtenus, par empreinte (agent, question, texte de la section) ; LRU partagé par le processus,
+    adossé au backend partagé s'il est configuré (constats communs à toutes les répliques)
+    """
+
+    def __init__(self, max_entries: int = SHARD_CACHE_MAX_ENTRIES, backend: Optional[StateBackend] = None):
+        self.max_entries = max_entries
+        self.backend = backend
+        self._entries: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(agent_key: str, prompt: str) -> str:
+        return hashlib.sha256(f"{agent_key}\0{prompt}".encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+                return value
+        if self.backend is None:
+            return None
+        value = self.backend.get_json("shards", key)
+        if value is not None:
+            self._remember(key, value)
+        return value
+
+    def put(self, key: str, value: str):
+        self._remember(key, value)
+        if self.backend is not None:
+            self.backend.set_json("shards", key, value)
+
+    def _remember(self, key: str, value: str):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+@st.cache_resource
+def get_shard_cache() -> ShardResultCache:
+    """Cache des constats par section, partagé par le processus"""
+    return ShardResultCache(backend=get_state_backend())
+
+def should_map_reduce(agent_key: str, documents: Optional[List[Dict]]) -> bool:
+    """Vrai si le mode map-reduce est actif et que les documents joints sont assez longs"""
+    return (
+        st.session_state.get("map_reduce_mode", False)
+        and agent_key in MAP_REDUCE_AGENTS
+        and bool(documents)
+        and sum(len(document["content"]) for document in documents) >= MAP_REDUCE_MIN_CHARS
+    )
+
+async def run_map_reduce(question: str, documents: List[Dict], agent_key: str) -> PipelineResult:
+    """
+    Map : chaque section est analysée séparément (appels simultanés, sessions jetables, cache par empreinte).
+    Reduce : les constats sont fusionnés, par lots si nécessaire, en une seule réponse.
+    """
+    agent_info = AGENTS[agent_key]
+    cache = get_shard_cache()
+    semaphore = asyncio.Semaphore(MAP_REDUCE_MAX_CONCURRENCY)
+    shards = [shard for document in documents for shard in shard_document(document["name"], document["content"])]
+    mapped = 0
+    cache_hits = 0
+
+    async def analyse(prompt: str) -> str:
+        nonlocal cache_hits
+        key = cache.key(agent_key, prompt)
+        cached = cache.get(key)
+        get_metrics().record_cache("map_reduce_shards", cached is not None)
+        if cached is not None:
+            cache_hits += 1
+            response = cached
+        else:
+            async with semaphore:
+                response = await execute_agent(agent_key, agent_info, prompt, ephemeral=True, batch=True)
+            if not is_failed_response(response):
+                cache.put(key, response)
+        return response
+
+    async def map_shard(label: str, text: str) -> str:
+        nonlocal mapped
+        response = await analyse(PROMPT_REGISTRY.render(agent_key, "map_shard", query=question, part=label, text=text))
+        mapped += 1
+        st.session_state.progress_text = f"{agent_info['icon']} {agent_info['name']}: {mapped}/{len(shards)} sections analysées"
+        st.session_state.progress_value = 0.8 * mapped / len(shards)
+        return response
+
+    async def reduce_batches(batches: List[List[str]]) -> List[str]:
+        reduced = 0
+
+        async def reduce_batch(batch: List[str]) -> str:
+            nonlocal reduced
+            response = await analyse(PROMPT_REGISTRY.render(agent_key, "reduce", query=question, findings="\n\n".join(batch)))
+            reduced += 1
+            st.session_state.progress_text = f"{agent_info['icon']} {agent_info['name']}: {reduced}/{len(batches)} lots de constats fusionnés"
+            st.session_state.progress_value = 0.8 + 0.15 * reduced / len(batches)
+            return response
+
+        return [response for response in await asyncio.gather(*(reduce_batch(batch) for batch in batches))
+                if not is_failed_response(response)]
+
+    try:
+        findings = await asyncio.gather(*(map_shard(label, text) for label, text in shards))
+        # Les sections en erreur ne sont pas transmises à la fusion (messages d'erreur, pas des constats)
+        sections = [f"### {label}\n{finding}" for (label, _), finding in zip(shards, findings) if not is_failed_response(finding)]
+        failed = len(shards) - len(sections)
+        if not sections:
+            return PipelineResult.failure(f"Aucune section analysée avec succès par {agent_info['name']} : {findings[0]}")
+
+        # Reduce hiérarchique : les lots de constats tiennent chacun dans une section
+        while len(sections) > 1 and sum(len(s) for s in sections) > MAP_REDUCE_SHARD_CHARS:
+            batches, current = [], []
+            for section in sections:
+                if current and sum(len(s) for s in current) + len(section) > MAP_REDUCE_SHARD_CHARS:
+                    batches.append(current)
+                    current = []
+                current.append(section)
+            batches.append(current)
+            if len(batches) == len(sections):
+                break  # Chaque constat remplit déjà une section : fusion finale directe
+            sections = await reduce_batches(batches)
+            if not sections:
+                return PipelineResult.failure(f"Échec de la fusion des constats par {agent_info['name']}")
+
+        st.session_state.progress_text = f"{agent_info['icon']} {agent_info['name']}: Fusion des constats..."
+        st.session_state.progress_value = 0.95
+        combined = await execute_agent(
+            agent_key, agent_info, PROMPT_REGISTRY.render(agent_key, "reduce", query=question, findings="\n\n".join(sections)),
+            batch=True
+        )
+        return PipelineResult(
+            selected_agents=(agent_key,),
+            combined=combined,
+            selection_method=f"Map-reduce : {len(shards)} sections ({cache_hits} déjà analysées"
+                             f"{f', {failed} en erreur' if failed else ''}), {MAP_REDUCE_MAX_CONCURRENCY} appels simultanés au plus",
+            mode="map_reduce"
+        )
     except Exception as e:
-        return {"error": f"Erreur lors de l'exécution de l'agent {agent_key}: {str(e)}"}
+        return PipelineResult.failure(f"Erreur lors de l'analyse map-reduce avec {agent_key}: {str(e)}")
+
+# SÉLECTION ADAPTATIVE DES AGENTS (mode intelligent) - apprise des tours précédents
+try:
+    SELECTION_ENABLED = bool(st.secrets.get("selection", {}).get("ENABLED", True))
+    SELECTION_MIN_SCORE = float(st.secrets.get("selection", {}).get("MIN_SCORE", 0.35))
+    SELECTION_MIN_MARGIN = float(st.secrets.get("selection", {}).get("MIN_MARGIN", 0.15))
+    SELECTION_LOG_PATH = st.secrets.get("selection", {}).get("LOG_PATH", "")
+    SELECTION_PERSIST = bool(st.secrets.get("selection", {}).get("PERSIST", True))
+    SELECTION_RETENTION_DAYS = float(st.secrets.get("selection", {}).get("RETENTION_DAYS", 30))
+    SELECTION_MAX_LATENCY_MS = float(st.secrets.get("selection", {}).get("MAX_LATENCY_MS", 60000))
+except Exception:
+    SELECTION_ENABLED = True
+    SELECTION_MIN_SCORE = 0.35  # Similarité cosinus minimale avec le profil de l'agent
+    SELECTION_MIN_MARGIN = 0.15  # Écart minimal avec le deuxième agent le plus proche
+    SELECTION_LOG_PATH = ""
+    SELECTION_PERSIST = True  # False : journal en mémoire seulement, aucune question écrite sur disque
+    SELECTION_RETENTION_DAYS = 30  # Les tours plus anciens sont effacés du journal
+    SELECTION_MAX_LATENCY_MS = 60000  # Un tour plus lent n'est pas un bon exemple (l'agent n'était pas le bon choix)
+SELECTION_LOG_PATH = SELECTION_LOG_PATH or os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "agent_selection.sqlite3")
+SELECTION_MIN_EXAMPLES = 30  # Exemples réussis nécessaires avant de court-circuiter le routeur
+SELECTION_MIN_CLASS_EXAMPLES = 5  # Exemples nécessaires pour qu'un agent soit candidat
+SELECTION_TRAINING_WINDOW = 2000  # Derniers tours utilisés pour l'entraînement
+SELECTION_REFIT_EVERY = 10  # Nouveaux tours journalisés avant réentraînement
+SELECTION_MIN_RESPONSE_CHARS = 80  # Réponse plus courte : pas un exemple de qualité suffisante
+# Seules les décisions du routeur et les choix manuels servent d'étiquettes : les tours routés par le
+# classifieur lui-même renforceraient ses propres erreurs
+SELECTION_TRAINING_SOURCES = ("router", "manual")
+SELECTION_PURGE_EVERY = 100  # Tours journalisés entre deux purges des tours expirés
+
+class SelectionLog:
+    """
+    Journal persistant des tours : question, agents ayant répondu, source de la sélection, succès, latence
+    et taille de la réponse ; les tours de plus de retention_days jours sont effacés
+    """
+
+    def __init__(self, path: str, retention_days: float = SELECTION_RETENTION_DAYS):
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.retention_days = retention_days
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._records = 0
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS turns ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, logged_at REAL NOT NULL, query TEXT NOT NULL, "
+                "agents TEXT NOT NULL, source TEXT NOT NULL, success INTEGER NOT NULL, total_ms REAL, response_chars INTEGER)"
+            )
+            # Journal créé par une version précédente
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(turns)")}
+            if "response_chars" not in columns:
+                self._conn.execute("ALTER TABLE turns ADD COLUMN response_chars INTEGER")
+            self._purge()
+
+    def _purge(self):
+        self._conn.execute("DELETE FROM turns WHERE logged_at < ?", (time.time() - self.retention_days * 86400,))
+
+    def record(self, query: str, agents: List[str], source: str, success: bool, total_ms: Optional[float] = None,
+               response_chars: Optional[int] = None):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO turns (logged_at, query, agents, source, success, total_ms, response_chars) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (time.time(), query, ",".join(agents), source, int(success), total_ms, response_chars)
+            )
+            self._records += 1
+            if self._records % SELECTION_PURGE_EVERY == 0:
+                self._purge()
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM turns").fetchone()[0]
+
+    def training_examples(self, limit: int = SELECTION_TRAINING_WINDOW) -> List[Tuple[str, str]]:
+        """
+        Tours traités par un seul agent, choisi par le routeur ou par l'utilisateur, réussis, assez rapides
+        et avec une réponse substantielle (les plus récents)
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT query, agents FROM turns WHERE success = 1 AND agents != '' AND instr(agents, ',') = 0 "
+                f"AND source IN ({', '.join('?' * len(SELECTION_TRAINING_SOURCES))}) "
+                "AND (total_ms IS NULL OR total_ms <= ?) AND (response_chars IS NULL OR response_chars >= ?) "
+                "ORDER BY id DESC LIMIT ?",
+                (*SELECTION_TRAINING_SOURCES, SELECTION_MAX_LATENCY_MS, SELECTION_MIN_RESPONSE_CHARS, limit)
+            ).fetchall()
+        return [(query, agent_key) for query, agent_key in rows if agent_key in AGENTS and agent_key != "router"]
+
+class QueryClassifier:
+    """TF-IDF + profil (centroïde) par agent, similarité cosinus"""
+
+    def __init__(self):
+        self.idf: Dict[str, float] = {}
+        self.centroids: Dict[str, Dict[str, float]] = {}
+        self.examples = 0
+
+    @staticmethod
+    def tokenize(text: str) -> List[str]:
+        tokens = []
+        for word in re.findall(r"\w{3,}", text.lower()):
+            normalized = CollaboratorRegistry.normalize(word)
+            if normalized and normalized not in INDEX_STOPWORDS:
+                tokens.append(normalized)
+        return tokens
+
+    def _vector(self, tokens: List[str]) -> Dict[str, float]:
+        counts: Dict[str, int] = {}
+        for token in tokens:
+            if token in self.idf:
+                counts[token] = counts.get(token, 0) + 1
+        vector = {token: count * self.idf[token] for token, count in counts.items()}
+        norm = sum(v * v for v in vector.values()) ** 0.5
+        return {token: v / norm for token, v in vector.items()} if norm else {}
+
+    def fit(self, examples: List[Tuple[str, str]]) -> "QueryClassifier":
+        tokenized = [(self.tokenize(query), agent_key) for query, agent_key in examples]
+        document_frequency: Dict[str, int] = {}
+        for tokens, _ in tokenized:
+            for token in set(tokens):
+                document_frequency[token] = document_frequency.get(token, 0) + 1
+        total = len(tokenized)
+        self.idf = {token: math.log((total + 1) / (df + 1)) + 1 for token, df in document_frequency.items()}
+
+        sums: Dict[str, Dict[str, float]] = {}
+        class_counts: Dict[str, int] = {}
+        for tokens, agent_key in tokenized:
+            class_counts[agent_key] = class_counts.get(agent_key, 0) + 1
+            centroid = sums.setdefault(agent_key, {})
+            for token, weight in self._vector(tokens).items():
+                centroid[token] = centroid.get(token, 0.0) + weight
+
+        self.centroids = {}
+        for agent_key, centroid in sums.items():
+            norm = sum(v * v for v in centroid.values()) ** 0.5
+            if norm and class_counts[agent_key] >= SELECTION_MIN_CLASS_EXAMPLES:
+                self.centroids[agent_key] = {token: v / norm for token, v in centroid.items()}
+        self.examples = total
+        return self
+
+    def scores(self, query: str) -> List[Tuple[str, float]]:
+        """Similarité de la question avec chaque agent, par ordre décroissant"""
+        vector = self._vector(self.tokenize(query))
+        ranked = [
+            (agent_key, sum(weight * centroid.get(token, 0.0) for token, weight in vector.items()))
+            for agent_key, centroid in self.centroids.items()
+        ]
+        return sorted(ranked, key=lambda item: item[1], reverse=True)
+
+@dataclass(slots=True)
+class AgentSelection:
+    """Décision de sélection : agent retenu (None = routeur) et justification"""
+    agent_key: Optional[str]
+    score: float = 0.0
+    margin: float = 0.0
+    reason: str = ""
+
+class AgentSelector:
+    """Choisit l'agent le moins coûteux pour une question, ou laisse la main au routeur en cas de doute"""
+
+    def __init__(self, log: SelectionLog):
+        self.log = log
+        self._lock = threading.Lock()
+        self._classifier: Optional[QueryClassifier] = None
+        self._fitted_at_count = -1
+
+    def classifier(self) -> QueryClassifier:
+        """Classifieur courant, réentraîné quand assez de nouveaux tours ont été journalisés"""
+        with self._lock:
+            count = self.log.count()
+            if self._classifier is None or count - self._fitted_at_count >= SELECTION_REFIT_EVERY:
+                self._classifier = QueryClassifier().fit(self.log.training_examples())
+                self._fitted_at_count = count
+            return self._classifier
+
+    def select(self, query: str) -> AgentSelection:
+        classifier = self.classifier()
+        if classifier.examples < SELECTION_MIN_EXAMPLES:
+            return AgentSelection(None, reason=f"apprentissage en cours ({classifier.examples}/{SELECTION_MIN_EXAMPLES} exemples)")
+
+        ranked = classifier.scores(query)
+        if not ranked or ranked[0][1] < SELECTION_MIN_SCORE:
+            return AgentSelection(None, ranked[0][1] if ranked else 0.0, reason="question trop éloignée des tours connus")
+        top_score = ranked[0][1]
+        second_score = ranked[1][1] if len(ranked) > 1 else 0.0
+        if top_score - second_score < SELECTION_MIN_MARGIN:
+            return AgentSelection(None, top_score, top_score - second_score, reason="plusieurs agents plausibles")
+
+        # Parmi les agents quasi ex aequo, le plus rapide (latence médiane observée)
+        stats = get_latency_stats()
+        candidates = [agent_key for agent_key, score in ranked if top_score - score < SELECTION_MIN_MARGIN / 2]
+        agent_key = min(candidates, key=lambda key: stats.percentile(key, "total_ms", 50) or float("inf"))
+        agent_p50 = stats.percentile(agent_key, "total_ms", 50)
+        router_p50 = stats.percentile("router", "total_ms", 50)
+        if agent_p50 is not None and router_p50 is not None and agent_p50 >= router_p50:
+            return AgentSelection(None, top_score, top_score - second_score, reason=f"{agent_key} pas plus rapide que le routeur")
+        return AgentSelection(agent_key, top_score, top_score - second_score, reason="confiance suffisante")
+
+    def record(self, query: str, agents: List[str], source: str, success: bool, total_ms: Optional[float] = None,
+               response_chars: Optional[int] = None):
+        self.log.record(query, agents, source, success, total_ms, response_chars)
+
+    def report(self) -> List[Dict]:
+        """Exemples d'entraînement et latence médiane par agent candidat"""
+        classifier = self.classifier()
+        examples = Counter(agent_key for _, agent_key in self.log.training_examples())
+        stats = get_latency_stats()
+        return [
+            {"agent": COLLABORATOR_REGISTRY.name(agent_key), "exemples": count, "candidat": agent_key in classifier.centroids,
+             "latence_p50_ms": stats.percentile(agent_key, "total_ms", 50)}
+            for agent_key, count in examples.most_common()
+        ]
+
+@st.cache_resource
+def get_agent_selector() -> AgentSelector:
+    """Sélecteur partagé par le processus (journal SQLite persistant, ou en mémoire si PERSIST est désactivé)"""
+    return AgentSelector(SelectionLog(SELECTION_LOG_PATH if SELECTION_PERSIST else ":memory:"))
+
+def record_selection_turn(user_text: str, agents: List[str], source: str, response: "PipelineResult", started_at: float):
+    """Journalise un tour pour la sélection adaptative, sauf si l'utilisateur a refusé la conservation de ses questions"""
+    if st.session_state.get("selection_opt_out", False):
+        return
+    get_agent_selector().record(user_text, agents, source, not response.error and not is_failed_response(response.combined),
+                                (time.perf_counter() - started_at) * 1000, len(response.combined))
+
+def is_failed_response(response: str) -> bool:
+    """Réponse d'erreur ou vide renvoyée par execute_agent"""
+    return not response or response.startswith(("❌", "⚠️", "⛔", "Erreur"))
 
 # FONCTION PRINCIPALE SIMPLIFIÉE
-async def run_workflow_based_on_mode(query, mode):
+async def run_workflow_based_on_mode(query, mode, user_text=None, documents=None):
     """
     Workflow optimisé avec support multi-agent avancé
+    user_text : question saisie, sans les documents joints (sert à la sélection adaptative)
+    documents : documents extraits pour ce tour (analyse map-reduce des longs documents)
     """
     if mode == "intelligent":
+        user_text = query if user_text is None else user_text
+        selector = get_agent_selector()
+        started_at = time.perf_counter()
+
+        # Question simple et reconnue : l'agent le plus rapide répond directement, sans le routeur
+        selection = selector.select(user_text) if SELECTION_ENABLED and query == user_text else AgentSelection(None, reason="documents joints")
+        if selection.agent_key:
+            response = await run_specific_agent(query, selection.agent_key)
+            success = not response.error and not is_failed_response(response.combined)
+            record_selection_turn(user_text, [selection.agent_key], "adaptive", response, started_at)
+            if success:
+                response.selection_method = (f"Sélection adaptative : {COLLABORATOR_REGISTRY.name(selection.agent_key)} "
+                                             f"(score {selection.score:.2f}, écart {selection.margin:.2f})")
+                response.original_query = query
+                response.input_tokens = estimate_tokens(query)
+                response.mode = "adaptive"
+                return response
+            started_at = time.perf_counter()  # Échec : repli sur le routeur
+
+        # Routeur en panne (disjoncteur ouvert) : la question d'origine part directement à l'agent de repli
+        fallback_key, _ = resolve_available_agent("router")
+        if fallback_key != "router":
+            response = await run_specific_agent(query, fallback_key)
+            response.selection_method = f"Repli sur {COLLABORATOR_REGISTRY.name(fallback_key)} (disjoncteur du routeur ouvert)"
+            response.original_query = query
+            response.input_tokens = estimate_tokens(query)
+            response.mode = "fallback"
+            return response
+
         st.session_state.progress_text = f"🎯 Agent Routeur: Lancement de l'orchestration..."
         
         # Optimiser le prompt pour l'orchestration
         optimized_query = optimize_prompt_for_router(query)
         
         # Exécuter l'agent routeur avec le prompt optimisé
+        st.session_state.router_collaborators = []
         response = await run_specific_agent(optimized_query, "router")
+        record_selection_turn(user_text, st.session_state.router_collaborators, "router", response, started_at)
         
         # Enrichir la réponse avec des métadonnées
-        response["selection_method"] = "Orchestration Multi-Agent Intelligente"
-        response["original_query"] = query
-        response["optimized_query"] = optimized_query
-        response["mode"] = "intelligent_router"
+        response.selection_method = "Orchestration Multi-Agent Intelligente"
+        if selection.reason:
+            response.selection_method += f" (sélection adaptative écartée : {selection.reason})"
+        response.original_query = query
+        response.optimized_query = optimized_query
+        response.input_tokens = estimate_tokens(optimized_query)
+        response.mode = "intelligent_router"
         
         return response
         
@@ -632,9 +3119,17 @@ async def run_workflow_based_on_mode(query, mode):
         return await run_sequential_pipeline(query)
     else:
         if st.session_state.selected_agents and all(agent in AGENTS for agent in st.session_state.selected_agents):
-            return await run_specific_agent(query, st.session_state.selected_agents[0])
+            agent_key = st.session_state.selected_agents[0]
+            if should_map_reduce(agent_key, documents):
+                return await run_map_reduce(user_text or query, documents, agent_key)
+            started_at = time.perf_counter()
+            response = await run_specific_agent(query, agent_key, hedge=st.session_state.get("hedging_mode", False))
+            # Choix manuel de l'utilisateur : exemple d'entraînement pour la sélection adaptative
+            if user_text is not None and query == user_text:
+                record_selection_turn(user_text, [agent_key], "manual", response, started_at)
+            return response
         else:
-            return {"error": "Veuillez sélectionner un agent dans la barre latérale pour continuer."}
+            return PipelineResult.failure("Veuillez sélectionner un agent dans la barre latérale pour continuer.")
 
 # Fonction pour exécuter les fonctions asynchrones dans Streamlit
 def run_async_function(func, *args, **kwargs):
@@ -643,6 +3138,19 @@ def run_async_function(func, *args, **kwargs):
         loop = asyncio.new_event_loop()
         asyncio.set_event_loop(loop)
         return loop.run_until_complete(func(*args, **kwargs))
+    except (asyncio.CancelledError, ScriptControlException) as e:
+        # Tour interrompu : annuler les appels encore en cours, puis laisser Streamlit relancer le script
+        cancellation = current_turn_cancellation()
+        if cancellation is not None:
+            cancellation.cancel(e if isinstance(e, ScriptControlException) else None)
+        pending = asyncio.all_tasks(loop)
+        for task in pending:
+            task.cancel()
+        if pending:
+            loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+        if cancellation is not None and cancellation.control_exception is not None:
+            raise cancellation.control_exception
+        raise
     except Exception as e:
         st.error(f"Erreur d'exécution asynchrone: {str(e)}")
         return {"error": f"Erreur d'exécution: {str(e)}"}
@@ -652,68 +3160,361 @@ def run_async_function(func, *args, **kwargs):
         except:
             pass
 
+# NORMALISATION DU TEXTE EXTRAIT - en-têtes/pieds de page répétés, numéros de page, césures, espaces
+try:
+    NORMALIZE_EXTRACTED_TEXT = bool(st.secrets.get("extraction", {}).get("NORMALIZE", True))
+except Exception:
+    NORMALIZE_EXTRACTED_TEXT = True
+BOILERPLATE_EDGE_LINES = 3  # Lignes examinées en haut et en bas de chaque page
+BOILERPLATE_MIN_PAGE_RATIO = 0.5  # Part des pages où une ligne doit se répéter pour être du gabarit
+BOILERPLATE_MAX_CHARS = 120  # Un en-tête ou pied de page tient sur une ligne courte
+BOILERPLATE_MIN_PAGES = 3  # En dessous, aucune ligne n'est retirée (répétitions non significatives)
+# Numéro de page seul sur sa ligne ; sans préfixe « page », trois chiffres au plus (une année n'est pas un numéro de page)
+PAGE_NUMBER_PATTERN = re.compile(
+    r"^[-–—\s]*(?:(?:page|p\.)\s*\d{1,4}|\d{1,3})\s*(?:(?:/|sur|of|de)\s*\d{1,4})?[-–—\s]*$", re.IGNORECASE
+)
+# Mention de pagination à l'intérieur d'une ligne de bord (« Contrat X - Page 3/40 »)
+PAGE_REFERENCE_PATTERN = re.compile(r"(?:page|p\.)\s*\d{1,4}(?:\s*(?:/|sur|of|de)\s*\d{1,4})?|\b\d{1,4}\s*(?:/|sur|of)\s*\d{1,4}\b",
+                                    re.IGNORECASE)
+HYPHENATED_BREAK_PATTERN = re.compile(r"(\w+)-\n[ \t]*([a-zà-ÿ]\w*)")
+# Préfixes de mots composés : le trait d'union est conservé à la jonction
+COMPOUND_PREFIXES = {"sous", "contre", "non", "auto", "quasi", "avant", "après", "apres", "ex", "vice", "demi", "semi", "anti", "sur", "co"}
+
+@dataclass(slots=True)
+class NormalizationStats:
+    """Effet de la normalisation sur un document"""
+    pages: int = 0
+    raw_chars: int = 0
+    normalized_chars: int = 0
+    boilerplate_lines: int = 0
+    page_numbers: int = 0
+    hyphenations: int = 0
+
+    @property
+    def saved_chars(self) -> int:
+        return self.raw_chars - self.normalized_chars
+
+    @property
+    def saved_tokens(self) -> int:
+        return max(0, (self.raw_chars + 3) // 4 - (self.normalized_chars + 3) // 4)
+
+    @property
+    def saved_ratio(self) -> float:
+        return self.saved_chars / self.raw_chars if self.raw_chars else 0.0
+
+class PageTextNormalizer:
+    """
+    Normalisation incrémentale d'un flux de pages : feed(page) à mesure de l'extraction, puis finish().
+    Sur un document d'au moins BOILERPLATE_MIN_PAGES pages, les lignes de bord (haut/bas de page) identiques
+    sur une majorité de pages, pagination masquée, sont considérées comme en-têtes ou pieds de page et retirées,
+    de même que les numéros de page seuls. Les titres de clauses ne sont jamais retirés.
+    """
+
+    def __init__(self):
+        self.stats = NormalizationStats()
+        self._pages: List[Tuple[List[str], set]] = []
+        self._edge_counts: Counter = Counter()
+
+    @staticmethod
+    def signature(line: str) -> str:
+        """Forme comparable d'une ligne de bord (pagination masquée : « Page 3/40 » == « Page 4/40 », « Article 3 » != « Article 5 »)"""
+        return PAGE_REFERENCE_PATTERN.sub(lambda match: re.sub(r"\d+", "#", match.group()), line.lower())
+
+    @staticmethod
+    def is_boilerplate_candidate(line: str) -> bool:
+        return bool(line) and len(line) <= BOILERPLATE_MAX_CHARS and not CLAUSE_HEADING_PATTERN.match(line)
+
+    def _edge_indexes(self, lines: List[str]) -> List[int]:
+        count = len(lines)
+        return sorted(set(range(min(BOILERPLATE_EDGE_LINES, count))) | set(range(max(0, count - BOILERPLATE_EDGE_LINES), count)))
+
+    def feed(self, page_text: str):
+        self.stats.pages += 1
+        self.stats.raw_chars += len(page_text)
+        lines = []
+        for line in page_text.splitlines():
+            line = " ".join(line.split())
+            if not line:
+                if lines and lines[-1]:
+                    lines.append("")  # Une seule ligne vide conservée entre paragraphes
+                continue
+            lines.append(line)
+        while lines and not lines[-1]:
+            lines.pop()
+        # Césures internes à la page recollées avant de comparer les lignes de bord
+        lines = HYPHENATED_BREAK_PATTERN.sub(self._join_hyphenation, "\n".join(lines)).split("\n") if lines else lines
+        # Numéros de page seuls sur leur ligne, uniquement en haut ou en bas de page (retirés par finish)
+        page_numbers = {i for i in self._edge_indexes(lines) if PAGE_NUMBER_PATTERN.match(lines[i])}
+        self._pages.append((lines, page_numbers))
+        remaining = [line for i, line in enumerate(lines) if i not in page_numbers]
+        self._edge_counts.update({
+            self.signature(remaining[i]) for i in self._edge_indexes(remaining) if self.is_boilerplate_candidate(remaining[i])
+        })
+
+    def _join_hyphenation(self, match: re.Match) -> str:
+        self.stats.hyphenations += 1
+        head, tail = match.group(1), match.group(2)
+        if head.lower() in COMPOUND_PREFIXES:
+            return f"{head}-{tail}"
+        return f"{head}{tail}"
+
+    def finish(self) -> str:
+        """Texte normalisé du document"""
+        strip = len(self._pages) >= BOILERPLATE_MIN_PAGES
+        threshold = max(2, math.ceil(BOILERPLATE_MIN_PAGE_RATIO * len(self._pages)))
+        boilerplate = {signature for signature, count in self._edge_counts.items() if count >= threshold} if strip else set()
+
+        kept_pages = []
+        for lines, page_numbers in self._pages:
+            if strip and page_numbers:
+                self.stats.page_numbers += len(page_numbers)
+                lines = [line for i, line in enumerate(lines) if i not in page_numbers]
+            edges = set(self._edge_indexes(lines))
+            kept = []
+            for i, line in enumerate(lines):
+                if i in edges and self.is_boilerplate_candidate(line) and self.signature(line) in boilerplate:
+                    self.stats.boilerplate_lines += 1
+                    continue
+                kept.append(line)
+            kept_pages.append("\n".join(kept).strip("\n"))
+
+        # Césures à cheval sur deux pages
+        text = HYPHENATED_BREAK_PATTERN.sub(self._join_hyphenation, "\n".join(page for page in kept_pages if page))
+        self.stats.normalized_chars = len(text)
+        return text
+
+def normalize_pages(pages) -> Tuple[str, NormalizationStats]:
+    """Normalise un itérable de textes de pages"""
+    normalizer = PageTextNormalizer()
+    for page in pages:
+        normalizer.feed(page)
+    return normalizer.finish(), normalizer.stats
+
 # Fonctions pour extraction de texte PDF MODIFIÉES
+def iter_pdf_pages_ocr(pdf_document):
+    """Texte de chaque page via fitz"""
+    for page_num in range(pdf_document.page_count):
+        yield pdf_document.load_page(page_num).get_text()
+
 def extract_text_from_pdf_ocr(pdf_document):
     """for OCR - utilise fitz si disponible"""
     if FITZ_AVAILABLE:
-        text = ""
-        for page_num in range(pdf_document.page_count):
-            page = pdf_document.load_page(page_num)
-            text += page.get_text()
-        return text
+        return "".join(iter_pdf_pages_ocr(pdf_document))
     else:
         # Fallback vers pypdf si fitz n'est pas disponible
         return None
 
+def extract_pages_from_bytes(data: bytes, file_name: str, mime_type: str, ocr: bool) -> Tuple[List[str], Optional[str], List[str]]:
+    """Extraction page par page sans appel Streamlit (utilisable en arrière-plan) : (pages, nom, avertissements)"""
+    warnings = []
+
+    # Si OCR demandé ET fitz disponible
+    if ocr and FITZ_AVAILABLE:
+        try:
+            pdf_document = fitz.open(stream=data, filetype="pdf")
+            pages = list(iter_pdf_pages_ocr(pdf_document))
+            if any(pages):
+                return pages, file_name, warnings
+        except Exception as e:
+            warnings.append(f"Erreur OCR avec fitz: {e}. Utilisation de pypdf.")
+
+    # Utiliser pypdf (toujours disponible)
+    if mime_type == "text/plain":
+        pages = [str(data, "utf-8")]
+    elif mime_type == "application/pdf":
+        reader = PdfReader(io.BytesIO(data))
+        pages = [page.extract_text() + "\n" for page in reader.pages]
+    else:
+        pages = []
+        file_name = None
+
+    return pages, file_name, warnings
+
+def extract_text_from_bytes(data: bytes, file_name: str, mime_type: str, ocr: bool) -> Tuple[str, Optional[str], List[str]]:
+    """Extraction de texte sans appel Streamlit (utilisable en arrière-plan) : (texte, nom, avertissements)"""
+    pages, file_name, warnings = extract_pages_from_bytes(data, file_name, mime_type, ocr)
+    if NORMALIZE_EXTRACTED_TEXT:
+        return normalize_pages(pages)[0], file_name, warnings
+    return "".join(pages), file_name, warnings
+
 def extract_text_from_pdf(uploaded_file, ocr):
     """Extraction de texte avec gestion de fitz optionnel"""
     if uploaded_file is not None:
-        file_name = uploaded_file.name
-        
-        # Si OCR demandé ET fitz disponible
-        if ocr and FITZ_AVAILABLE:
-            try:
-                pdf_document = fitz.open(stream=uploaded_file.read(), filetype="pdf")
-                raw_text = extract_text_from_pdf_ocr(pdf_document)
-                if raw_text:
-                    return raw_text, file_name
-            except Exception as e:
-                st.warning(f"Erreur OCR avec fitz: {e}. Utilisation de pypdf.")
-        
-        # Réinitialiser le pointeur du fichier
-        uploaded_file.seek(0)
-        
-        # Utiliser pypdf (toujours disponible)
-        if uploaded_file.type == "text/plain":
-            raw_text = str(uploaded_file.read(), "utf-8")
-        elif uploaded_file.type == "application/pdf":
-            reader = PdfReader(uploaded_file)
-            text = ""
-            for page in reader.pages:
-                text += page.extract_text() + "\n"
-            raw_text = text
-        else:
-            raw_text = ""
-            file_name = None
-            
+        raw_text, file_name, warnings = extract_text_from_bytes(
+            uploaded_file.getvalue(), uploaded_file.name, uploaded_file.type, ocr
+        )
+        for warning in warnings:
+            st.warning(warning)
         return raw_text, file_name
     else:
         return "", None
 
+# PRÉ-EXTRACTION SPÉCULATIVE DES FICHIERS DÉPOSÉS
+EXTRACTION_CHUNK_CHARS = 4000
+
+class ExtractedDocument:
+    """Texte extrait d'un fichier déposé, avec son empreinte et son découpage"""
+
+    __slots__ = ("name", "sha256", "content", "chunks", "ocr", "elapsed_ms", "warnings", "normalization", "page_count")
+
+    def __init__(self, name: str, sha256: str, content: str, chunks: List[str], ocr: bool, elapsed_ms: float, warnings: List[str],
+                 normalization: Optional[NormalizationStats] = None, page_count: int = 0):
+        self.name = name
+        self.sha256 = sha256
+        self.content = content
+        self.chunks = chunks
+        self.ocr = ocr
+        self.elapsed_ms = elapsed_ms
+        self.warnings = warnings
+        self.normalization = normalization
+        self.page_count = page_count
+
+    def as_file_text(self) -> Dict:
+        """Format attendu par prompt_constructor"""
+        return {"content": self.content, "name": self.name, "hash": self.sha256, "chunks": self.chunks}
+
+    def to_dict(self) -> Dict:
+        """Forme sérialisable, pour le backend partagé"""
+        data = {slot: getattr(self, slot) for slot in self.__slots__}
+        data["normalization"] = asdict(self.normalization) if self.normalization is not None else None
+        return data
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "ExtractedDocument":
+        normalization = NormalizationStats(**data["normalization"]) if data.get("normalization") else None
+        return cls(**{**data, "normalization": normalization})
+
+def chunk_text(text: str, max_chars: int = EXTRACTION_CHUNK_CHARS) -> List[str]:
+    """Découpe un texte en blocs d'au plus max_chars caractères, aux frontières de paragraphes si possible"""
+    chunks, current = [], ""
+    for paragraph in re.split(r"\n\s*\n", text):
+        while len(paragraph) > max_chars:
+            if current:
+                chunks.append(current)
+                current = ""
+            chunks.append(paragraph[:max_chars])
+            paragraph = paragraph[max_chars:]
+        if current and len(current) + len(paragraph) + 2 > max_chars:
+            chunks.append(current)
+            current = ""
+        current = f"{current}\n\n{paragraph}" if current else paragraph
+    if current.strip():
+        chunks.append(current)
+    return chunks
+
+def extract_document(data: bytes, file_name: str, mime_type: str, ocr: bool) -> Optional[ExtractedDocument]:
+    """Extraction, hachage et découpage d'un fichier (exécuté en arrière-plan)"""
+    started_at = time.perf_counter()
+    sha256 = hashlib.sha256(data).hexdigest()
+    pages, name, warnings = extract_pages_from_bytes(data, file_name, mime_type, ocr)
+    if not name:
+        return None
+    if NORMALIZE_EXTRACTED_TEXT:
+        content, normalization = normalize_pages(pages)
+    else:
+        content, normalization = "".join(pages), None
+    return ExtractedDocument(name, sha256, content, chunk_text(content), ocr,
+                             (time.perf_counter() - started_at) * 1000, warnings, normalization, len(pages))
+
+class ExtractionCache:
+    """
+    Extractions en cours ou terminées, indexées par fichier déposé et option OCR (LRU borné)
+    Avec un backend partagé, les textes extraits y sont aussi conservés par empreinte du contenu et option OCR
+    """
+
+    def __init__(self, max_entries: int = 64, metrics: Optional[AgentMetrics] = None, backend: Optional[StateBackend] = None):
+        self.max_entries = max_entries
+        self.metrics = metrics
+        self.backend = backend
+        self._futures: "OrderedDict[Tuple[str, bool], Future]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _extract(self, data: bytes, file_name: str, mime_type: str, ocr: bool) -> Optional[ExtractedDocument]:
+        shared_key = f"{hashlib.sha256(data).hexdigest()}:{int(ocr)}"
+        if self.backend is not None:
+            stored = self.backend.get_json("documents", shared_key)
+            if self.metrics is not None:
+                self.metrics.record_cache("shared_documents", stored is not None)
+            if stored is not None:
+                document = ExtractedDocument.from_dict(stored)
+                document.name = file_name
+                return document
+
+        document = extract_document(data, file_name, mime_type, ocr)
+        if document is not None and self.metrics is not None:
+            # Pages/s = rate(document_pages_extracted_total) / rate(document_extraction_seconds_sum)
+            self.metrics.pdf_pages.inc(document.page_count, ocr=str(ocr).lower())
+            self.metrics.extraction_seconds.observe(document.elapsed_ms / 1000, ocr=str(ocr).lower())
+        if document is not None and self.backend is not None:
+            self.backend.set_json("documents", shared_key, document.to_dict())
+        return document
+
+    def get_or_submit(self, executor: ThreadPoolExecutor, key: Tuple[str, bool], data_loader, file_name: str, mime_type: str) -> Future:
+        """Retourne l'extraction existante ou la lance en arrière-plan"""
+        with self._lock:
+            future = self._futures.get(key)
+            if future is not None and future.done() and future.exception() is not None:
+                # Échec mis en cache : nouvel essai au prochain dépôt plutôt que la même erreur pour toute la vie du processus
+                del self._futures[key]
+                future = None
+            if self.metrics is not None:
+                self.metrics.record_cache("extraction", future is not None)
+            if future is not None:
+                self._futures.move_to_end(key)
+                return future
+            future = executor.submit(self._extract, data_loader(), file_name, mime_type, key[1])
+            self._futures[key] = future
+            while len(self._futures) > self.max_entries:
+                self._futures.popitem(last=False)
+            return future
+
+@st.cache_resource
+def get_extraction_executor() -> ThreadPoolExecutor:
+    """Pool dédié à l'extraction de texte, partagé par le processus"""
+    return ThreadPoolExecutor(max_workers=2, thread_name_prefix="extraction")
+
+@st.cache_resource
+def get_extraction_cache() -> ExtractionCache:
+    """Cache des extractions partagé par le processus"""
+    return ExtractionCache(metrics=get_metrics(), backend=get_state_backend())
+
+def start_pre_extraction(uploaded_file, ocr: bool) -> Future:
+    """Lance (une seule fois) l'extraction d'un fichier dès son dépôt"""
+    file_key = getattr(uploaded_file, "file_id", None) or f"{uploaded_file.name}-{uploaded_file.size}"
+    return get_extraction_cache().get_or_submit(
+        get_extraction_executor(), (file_key, bool(ocr)), uploaded_file.getvalue, uploaded_file.name, uploaded_file.type
+    )
+
 def extract_text_from_multiple_files(uploaded_files, ocr):
     """extract text from multiple files and return a list of file text"""
     files_text = []
     progress_bar = st.progress(0)
 
+    # Les extractions déjà lancées au dépôt sont simplement récupérées
+    futures = [start_pre_extraction(uploaded_file, ocr) for uploaded_file in uploaded_files]
+
     total_files = len(uploaded_files)
-    for i, uploaded_file in enumerate(uploaded_files):
+    for i, (uploaded_file, future) in enumerate(zip(uploaded_files, futures)):
         progress_bar.progress(i / total_files)
-        file_content, file_name = extract_text_from_pdf(uploaded_file, ocr)
-        if file_name:
-            files_text.append({
-                'content': file_content,
-                'name': file_name
-            })
+        try:
+            document = future.result()
+        except Exception as e:
+            st.warning(f"Erreur d'extraction pour {uploaded_file.name}: {e}")
+            document = None
+        if document:
+            for warning in document.warnings:
+                st.warning(warning)
+            stats = document.normalization
+            if st.session_state.get("debug_mode") and stats and stats.raw_chars:
+                st.info(f"🧹 {document.name} : {stats.saved_chars} caractères (~{stats.saved_tokens} tokens, "
+                        f"{stats.saved_ratio:.0%}) retirés sur {stats.pages} pages - {stats.boilerplate_lines} lignes "
+                        f"d'en-tête/pied de page, {stats.page_numbers} numéros de page, {stats.hyphenations} césures")
+            files_text.append(document.as_file_text())
+            # Alimente l'index local pour les recherches futures
+            try:
+                get_contract_index().add_document(document.name, document.sha256, document.chunks, index_owner())
+            except sqlite3.Error as e:
+                st.warning(f"Indexation locale impossible pour {document.name}: {e}")
             st.write(f"✅ {uploaded_file.name} content extracted successfully")
         else:
             st.error(f"❌ Failed to extract content from {uploaded_file.name}")
@@ -721,13 +3522,155 @@ def extract_text_from_multiple_files(uploaded_files, ocr):
     progress_bar.progress(1.0)
     return files_text
 
-# FONCTION D'OPTIMISATION DU PROMPT POUR ROUTEUR
-def optimize_prompt_for_router(original_prompt: str) -> str:
-    """Optimise le prompt pour forcer l'exécution multi-agent"""
-    # Prompt optimisé pour forcer l'exécution réelle
-    return f"""EXECUTE IMMEDIATELY - Do not plan or describe, but actually invoke your collaborator agents now.
+# INDEX LOCAL DES CONTRATS (SQLite FTS5) - consulté avant l'agent index_search
+try:
+    CONTRACT_INDEX_PATH = st.secrets.get("index", {}).get("PATH", "")
+    INDEX_MIN_SCORE = float(st.secrets.get("index", {}).get("MIN_SCORE", 0.5))
+except Exception:
+    CONTRACT_INDEX_PATH = ""
+    INDEX_MIN_SCORE = 0.5  # Part minimale des termes de la question présents dans le passage retenu
+CONTRACT_INDEX_PATH = CONTRACT_INDEX_PATH or os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "contract_index.sqlite3")
+
+# Mots ignorés dans une recherche (formules de demande, mots vides)
+INDEX_STOPWORDS = {
+    "les", "des", "une", "pour", "dans", "avec", "sur", "par", "que", "qui", "est", "sont", "aux", "du", "de", "la", "le",
+    "quel", "quels", "quelle", "quelles", "quoi", "comment", "pourquoi", "combien", "quand", "lequel", "laquelle",
+    "lesquels", "lesquelles", "ces", "cet", "cette", "ceux", "celle", "celles", "mes", "mon", "vos", "votre", "nos",
+    "notre", "leur", "leurs", "son", "ses", "mais", "donc", "car", "pas", "plus", "tous", "tout", "toutes", "toute",
+    "elle", "elles", "ils", "suis", "ont", "avoir", "etre", "fait", "faire", "peut", "peux", "doit",
+    "existe", "existent", "contient", "contiennent", "parle", "parlent", "concernant", "propos", "sujet",
+    "trouve", "trouver", "cherche", "chercher", "recherche", "rechercher", "donne", "montre", "moi", "nous", "vous",
+    "dis", "dire", "explique", "liste", "lister", "indique", "pourrais", "pouvez", "merci", "svp",
+    "modele", "modeles", "template", "templates", "document", "documents", "contrat", "contrats", "fichier", "fichiers",
+    "the", "and", "for", "find", "search", "what", "which", "where", "who", "how", "are", "there", "any", "about",
+    "show", "list", "with", "from", "this", "that", "these", "those", "does", "contract", "contracts"
+}
+INDEX_MAX_QUERY_TERMS = 12
+
+class ContractIndex:
+    """
+    Index plein texte persistant des documents extraits, avec métadonnées
+    L'index est commun au déploiement, mais chaque document est rattaché aux utilisateurs qui l'ont déposé :
+    une recherche ne retourne que les documents de son propriétaire
+    """
+
+    def __init__(self, path: str):
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS documents ("
+                "sha256 TEXT PRIMARY KEY, name TEXT NOT NULL, chars INTEGER NOT NULL, chunks INTEGER NOT NULL, indexed_at REAL NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS chunks USING fts5("
+                "name, content, sha256 UNINDEXED, chunk_no UNINDEXED, tokenize='unicode61 remove_diacritics 2')"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS document_owners (sha256 TEXT NOT NULL, owner TEXT NOT NULL, PRIMARY KEY (sha256, owner))"
+            )
+
+    def add_document(self, name: str, sha256: str, chunks: List[str], owner: str) -> bool:
+        """Indexe un document pour un propriétaire (texte indexé une seule fois) ; retourne True s'il a été ajouté"""
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR IGNORE INTO document_owners (sha256, owner) VALUES (?, ?)", (sha256, owner))
+            if self._conn.execute("SELECT 1 FROM documents WHERE sha256 = ?", (sha256,)).fetchone():
+                return False
+            self._conn.executemany(
+                "INSERT INTO chunks (name, content, sha256, chunk_no) VALUES (?, ?, ?, ?)",
+                [(name, chunk, sha256, i) for i, chunk in enumerate(chunks)]
+            )
+            self._conn.execute(
+                "INSERT INTO documents (sha256, name, chars, chunks, indexed_at) VALUES (?, ?, ?, ?, ?)",
+                (sha256, name, sum(len(c) for c in chunks), len(chunks), time.time())
+            )
+            return True
+
+    @staticmethod
+    def query_terms(query: str) -> List[str]:
+        """Termes significatifs de la question, normalisés comme par le tokenizer FTS5 (sans accents)"""
+        terms = []
+        for word in re.findall(r"\w{3,}", query.lower()):
+            normalized = CollaboratorRegistry.normalize(word)
+            if normalized and normalized not in INDEX_STOPWORDS and normalized not in terms:
+                terms.append(normalized)
+        return terms[:INDEX_MAX_QUERY_TERMS]
+
+    @classmethod
+    def build_match_query(cls, query: str) -> str:
+        """Requête FTS5 acceptant n'importe quel terme significatif de la question (classement bm25)"""
+        return " OR ".join(f'"{term}"' for term in cls.query_terms(query))
+
+    def search(self, query: str, owner: str, limit: int = 5, min_score: float = INDEX_MIN_SCORE) -> List[Dict]:
+        """
+        Documents du propriétaire classés par pertinence (bm25), dont le meilleur passage contient
+        au moins min_score des termes de la question. Le bm25 seul ne sert pas de seuil : sur un petit index,
+        l'IDF de FTS5 tombe à presque zéro et son score n'est pas comparable d'un index à l'autre
+        """
+        terms = self.query_terms(query)
+        if not terms:
+            return []
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT name, sha256, content, snippet(chunks, 1, '**', '**', '…', 24), bm25(chunks) AS score "
+                "FROM chunks WHERE chunks MATCH ? "
+                "AND sha256 IN (SELECT sha256 FROM document_owners WHERE owner = ?) ORDER BY score LIMIT ?",
+                (self.build_match_query(query), owner, limit * 4)
+            ).fetchall()
+
+        # Un seul résultat par document (le meilleur passage suffisamment couvrant)
+        results, seen = [], set()
+        for name, sha256, content, snippet, score in rows:
+            if sha256 in seen:
+                continue
+            content_terms = {CollaboratorRegistry.normalize(word) for word in re.findall(r"\w{3,}", content.lower())}
+            coverage = sum(term in content_terms for term in terms) / len(terms)
+            if coverage >= min_score:
+                seen.add(sha256)
+                results.append({"name": name, "sha256": sha256, "snippet": snippet, "score": score, "coverage": coverage})
+        return results[:limit]
+
+    def stats(self) -> Dict:
+        """Nombre de documents et volume indexé"""
+        with self._lock:
+            documents, chars = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(chars), 0) FROM documents").fetchone()
+        return {"documents": documents, "chars": chars}
+
+@st.cache_resource
+def get_contract_index() -> ContractIndex:
+    """Index local partagé par le processus"""
+    return ContractIndex(CONTRACT_INDEX_PATH)
+
+def index_owner() -> str:
+    """Propriétaire des documents indexés : le navigateur (toutes ses conversations), sinon la conversation"""
+    return browser_fingerprint() or get_user_id()
+
+def lookup_local_index(query: str, limit: int = 5) -> Optional[str]:
+    """Réponse locale de recherche si l'index connaît déjà des documents de l'utilisateur correspondants, sinon None"""
+    # Seule la question est utilisée, pas le texte des pièces jointes
+    question = query.split("\ncontract n°", 1)[0][:1000]
+    try:
+        results = get_contract_index().search(question, index_owner(), limit)
+    except sqlite3.Error:
+        return None
+    if not results:
+        return None
+
+    lines = [f"🔎 **Résultats de l'index local** ({len(results)} document(s), sans appel distant)"]
+    for result in results:
+        lines.append(f"\n📄 **{result['name']}**\n{result['snippet']}")
+    return "\n".join(lines)
+
+# GABARITS DE PROMPTS - compilés et validés une seule fois au démarrage
+DEFAULT_PROMPT_TEMPLATES = {
+    "router": {
+        # Prompt optimisé pour forcer l'exécution réelle (remplace l'ancien double enrobage)
+        "execute": """EXECUTE IMMEDIATELY - Do not plan or describe, but actually invoke your collaborator agents now.
 
-Task: {original_prompt}
+Task: {query}
 
 You must:
 1. Actually call your collaborator agents (not just plan to call them)
@@ -735,8 +3678,264 @@ You must:
 3. Provide a consolidated answer based on their actual outputs
 
 Do not simulate or describe what you would do - execute the collaboration now."""
+    },
+    "default": {
+        "execute": "{query}",
+        "sequence_followup": "Tenant compte de la réponse précédente: {previous}\n\nQuestion initiale: {query}",
+        "sequence_error": "L'agent précédent a rencontré une erreur. Question initiale: {query}",
+        "map_shard": "Question: {query}\n\nAnalyse uniquement l'extrait suivant ({part}). Donne de façon concise les constats "
+                     "propres à cet extrait, ou « RAS » s'il n'est pas concerné par la question.\n\n{text}",
+        "reduce": "Question: {query}\n\nVoici les constats obtenus section par section. Fusionne-les en une réponse unique "
+                  "et structurée, sans doublons, en citant les sections concernées.\n\n{findings}"
+    }
+}
+
+# Champs attendus par chaque usage de gabarit
+PROMPT_TEMPLATE_FIELDS = {
+    "execute": {"query"},
+    "sequence_followup": {"query", "previous"},
+    "sequence_error": {"query"},
+    "map_shard": {"query", "part", "text"},
+    "reduce": {"query", "findings"}
+}
+
+def estimate_tokens(text: str) -> int:
+    """Estimation du nombre de tokens (~4 caractères par token)"""
+    return (len(text) + 3) // 4 if text else 0
+
+class PromptTemplate:
+    """Gabarit de prompt validé : champs vérifiés, surcoût en tokens précalculé"""
+
+    __slots__ = ("agent_key", "purpose", "text", "fields", "prefix", "overhead_tokens", "is_passthrough")
+
+    def __init__(self, agent_key: str, purpose: str, text: str):
+        literals, fields = [], set()
+        for literal, field_name, format_spec, conversion in string.Formatter().parse(text):
+            literals.append(literal)
+            if field_name is not None:
+                if not field_name:
+                    raise ValueError(f"Gabarit {agent_key}/{purpose}: champ positionnel interdit")
+                fields.add(field_name)
 
-def prompt_constructor(user_input, ocr):
+        expected = PROMPT_TEMPLATE_FIELDS.get(purpose)
+        if expected is None:
+            raise ValueError(f"Gabarit {agent_key}/{purpose}: usage inconnu")
+        if fields != expected:
+            raise ValueError(f"Gabarit {agent_key}/{purpose}: champs {sorted(fields)} au lieu de {sorted(expected)}")
+
+        self.agent_key = agent_key
+        self.purpose = purpose
+        self.text = text
+        self.fields = fields
+        # Texte fixe avant le premier champ, sert à détecter un enrobage déjà appliqué
+        self.prefix = literals[0] if literals else ""
+        self.overhead_tokens = estimate_tokens("".join(literals))
+        self.is_passthrough = text == "{query}"
+
+    def render(self, **fields) -> str:
+        """Applique le gabarit, sans ré-enrober une requête qui l'est déjà"""
+        query = fields.get("query", "")
+        if self.is_passthrough:
+            return query
+        if self.prefix and self.purpose == "execute" and query.startswith(self.prefix):
+            return query
+        return self.text.format(**fields)
+
+class PromptTemplateRegistry:
+    """Gabarits par agent et par usage, avec repli sur les gabarits par défaut"""
+
+    def __init__(self, templates: Dict[str, Dict[str, str]]):
+        self._templates: Dict[Tuple[str, str], PromptTemplate] = {}
+        for agent_key, purposes in templates.items():
+            for purpose, text in purposes.items():
+                self._templates[(agent_key, purpose)] = PromptTemplate(agent_key, purpose, text)
+
+    def get(self, agent_key: str, purpose: str) -> PromptTemplate:
+        """Gabarit spécifique à l'agent, sinon celui par défaut"""
+        return self._templates.get((agent_key, purpose)) or self._templates[("default", purpose)]
+
+    def render(self, agent_key: str, purpose: str, **fields) -> str:
+        """Construit le prompt d'un agent pour un usage donné"""
+        return self.get(agent_key, purpose).render(**fields)
+
+    def report(self) -> List[Dict]:
+        """Surcoût en tokens de chaque gabarit"""
+        return [
+            {"agent": t.agent_key, "usage": t.purpose, "tokens_fixes": t.overhead_tokens, "champs": ", ".join(sorted(t.fields))}
+            for t in self._templates.values()
+        ]
+
+def load_prompt_templates() -> PromptTemplateRegistry:
+    """Charge les gabarits par défaut et les surcharges de st.secrets["prompts"], en validant chacun"""
+    templates = {agent_key: dict(purposes) for agent_key, purposes in DEFAULT_PROMPT_TEMPLATES.items()}
+    try:
+        overrides = dict(st.secrets.get("prompts", {}))
+    except Exception:
+        overrides = {}
+
+    for agent_key, purposes in overrides.items():
+        for purpose, text in dict(purposes).items():
+            try:
+                PromptTemplate(agent_key, purpose, text)
+                templates.setdefault(agent_key, {})[purpose] = text
+            except ValueError as e:
+                st.warning(f"Gabarit de prompt ignoré: {e}")
+
+    return PromptTemplateRegistry(templates)
+
+PROMPT_REGISTRY = load_prompt_templates()
+
+# FONCTION D'OPTIMISATION DU PROMPT POUR ROUTEUR
+def optimize_prompt_for_router(original_prompt: str) -> str:
+    """Optimise le prompt pour forcer l'exécution multi-agent"""
+    return PROMPT_REGISTRY.render("router", "execute", query=original_prompt)
+
+# COMPARAISON LOCALE DE CONTRATS (avant invocation de l'agent contracts_compare)
+CLAUSE_HEADING_PATTERN = re.compile(
+    r"^\s*(?P<label>(?:article|clause|section|chapitre|titre|annexe)\s+[0-9IVXLC]+(?:\.[0-9]+)*"
+    r"|[0-9]+(?:\.[0-9]+)+(?:[.)]|(?=\s))|[0-9]+[.)])\s*[-–:.]?\s*(?P<title>[^\n]{0,100})$",
+    re.IGNORECASE | re.MULTILINE
+)
+CLAUSE_SIMILARITY_THRESHOLD = 0.6
+COMPARISON_KEYWORDS = re.compile(r"compar|diff[ée]ren|écart|ecart", re.IGNORECASE)
+
+class Clause:
+    """Clause d'un contrat : titre, corps et clé d'alignement"""
+
+    __slots__ = ("heading", "body", "key", "normalized")
+
+    def __init__(self, heading: str, body: str, key: str):
+        self.heading = heading
+        self.body = body
+        self.key = key
+        self.normalized = " ".join(body.split())
+
+def split_into_clauses(text: str) -> List[Clause]:
+    """Découpe un contrat en clauses selon ses titres (Article, Clause, 1., 2.1 ...)"""
+    headings = []
+    for match in CLAUSE_HEADING_PATTERN.finditer(text):
+        title = match.group("title").strip()
+        # Un titre numéroté seul (« 1) les parties... ») est un élément de liste, pas une clause
+        if match.group("label")[0].isdigit() and not (title[:1].isupper()):
+            continue
+        headings.append(match)
+
+    clauses = []
+    preamble = text[:headings[0].start()] if headings else text
+    if preamble.strip():
+        clauses.append(Clause("Préambule", preamble.strip(), "preambule"))
+
+    for i, match in enumerate(headings):
+        end = headings[i + 1].start() if i + 1 < len(headings) else len(text)
+        title = match.group("title").strip()
+        # Alignement par titre (indépendant de la numérotation), sinon par numéro
+        key = CollaboratorRegistry.normalize(title) or CollaboratorRegistry.normalize(match.group("label"))
+        clauses.append(Clause(match.group(0).strip(), text[match.end():end].strip(), key))
+    return clauses
+
+def align_clauses(reference: List[Clause], other: List[Clause]) -> Tuple[List[Tuple[Clause, Clause]], List[Clause], List[Clause]]:
+    """Aligne les clauses par titre puis par similarité : (paires, seulement référence, seulement autre)"""
+    remaining = {id(c): c for c in other}
+    by_key = {}
+    for clause in other:
+        by_key.setdefault(clause.key, []).append(clause)
+
+    pairs, unmatched_reference = [], []
+    for clause in reference:
+        candidates = [c for c in by_key.get(clause.key, []) if id(c) in remaining]
+        if candidates:
+            pairs.append((clause, candidates[0]))
+            del remaining[id(candidates[0])]
+        else:
+            unmatched_reference.append(clause)
+
+    # Repli : meilleure similarité textuelle, avec filtrage rapide par quick_ratio
+    still_unmatched = []
+    for clause in unmatched_reference:
+        best, best_ratio = None, CLAUSE_SIMILARITY_THRESHOLD
+        for candidate in remaining.values():
+            matcher = difflib.SequenceMatcher(None, clause.normalized, candidate.normalized, autojunk=False)
+            if matcher.real_quick_ratio() < best_ratio or matcher.quick_ratio() < best_ratio:
+                continue
+            ratio = matcher.ratio()
+            if ratio >= best_ratio:
+                best, best_ratio = candidate, ratio
+        if best is not None:
+            pairs.append((clause, best))
+            del remaining[id(best)]
+        else:
+            still_unmatched.append(clause)
+
+    return pairs, still_unmatched, list(remaining.values())
+
+def diff_clause_words(reference: Clause, other: Clause, max_items: int = 12) -> List[str]:
+    """Différences mot à mot entre deux versions d'une clause"""
+    ref_words, other_words = reference.normalized.split(), other.normalized.split()
+    changes = []
+    for tag, i1, i2, j1, j2 in difflib.SequenceMatcher(None, ref_words, other_words, autojunk=False).get_opcodes():
+        if tag == "replace":
+            changes.append(f"« {' '.join(ref_words[i1:i2])} » → « {' '.join(other_words[j1:j2])} »")
+        elif tag == "delete":
+            changes.append(f"supprimé : « {' '.join(ref_words[i1:i2])} »")
+        elif tag == "insert":
+            changes.append(f"ajouté : « {' '.join(other_words[j1:j2])} »")
+    if len(changes) > max_items:
+        changes = changes[:max_items] + [f"... et {len(changes) - max_items} autres modifications"]
+    return changes
+
+def build_files_prompt(query: str, files_content: List[Dict]) -> str:
+    """Prompt complet : la question suivie du texte intégral de chaque contrat"""
+    return query + "".join(
+        f"\ncontract n°{i+1} called " + file["name"] + "\n" + file["content"] for i, file in enumerate(files_content)
+    )
+
+def build_comparison_prompt(query: str, files_content: List[Dict]) -> Tuple[str, Dict]:
+    """
+    Prompt compact pour contracts_compare : seules les clauses différentes sont envoyées,
+    les clauses identiques sont résumées. Retourne (prompt, statistiques) ; stats["compact"] est faux quand
+    le découpage ne réduit pas le prompt (titres non reconnus) : le prompt est alors le texte complet
+    """
+    reference_file = files_content[0]
+    reference_clauses = split_into_clauses(reference_file["content"])
+    sections = [query, f"\nAnalyse préalable locale - contrat de référence n°1 : {reference_file['name']}"]
+    stats = {"identical": 0, "different": 0, "unmatched": 0}
+
+    for i, other_file in enumerate(files_content[1:], start=2):
+        pairs, only_reference, only_other = align_clauses(reference_clauses, split_into_clauses(other_file["content"]))
+        identical = [ref for ref, oth in pairs if ref.normalized == oth.normalized]
+        different = [(ref, oth) for ref, oth in pairs if ref.normalized != oth.normalized]
+        stats["identical"] += len(identical)
+        stats["different"] += len(different)
+        stats["unmatched"] += len(only_reference) + len(only_other)
+
+        sections.append(f"\n=== Contrat n°1 vs contrat n°{i} ({other_file['name']}) ===")
+        if identical:
+            sections.append(f"Clauses identiques ({len(identical)}) : " + "; ".join(c.heading for c in identical))
+        for ref, oth in different:
+            sections.append(f"\n--- Clause différente : {ref.heading} / {oth.heading}")
+            sections.append("Modifications : " + " | ".join(diff_clause_words(ref, oth)))
+            sections.append(f"[Contrat n°1]\n{ref.body}\n[Contrat n°{i}]\n{oth.body}")
+        for clause in only_reference:
+            sections.append(f"\n--- Clause absente du contrat n°{i} : {clause.heading}\n{clause.body}")
+        for clause in only_other:
+            sections.append(f"\n--- Clause présente uniquement dans le contrat n°{i} : {clause.heading}\n{clause.body}")
+
+    prompt = "\n".join(sections)
+    full_prompt = build_files_prompt(query, files_content)
+    stats["full_chars"] = len(full_prompt)
+    stats["compact_chars"] = len(prompt)
+    stats["compact"] = len(prompt) < len(full_prompt)
+    return (prompt if stats["compact"] else full_prompt), stats
+
+def should_compare_locally(query: str, files_content: List[Dict], target_agents: Optional[List[str]]) -> bool:
+    """La comparaison locale s'applique quand seul l'agent de comparaison (ou le routeur pour une comparaison) reçoit les contrats"""
+    if len(files_content) < 2 or not target_agents:
+        return False
+    if list(target_agents) == ["contracts_compare"]:
+        return True
+    return list(target_agents) == ["router"] and bool(COMPARISON_KEYWORDS.search(query or ""))
+
+def prompt_constructor(user_input, ocr, target_agents=None):
     """Construit le prompt avec gestion des fichiers"""
     # Gestion du cas où user_input est une string simple (depuis chat_input)
     if isinstance(user_input, str):
@@ -746,13 +3945,24 @@ def prompt_constructor(user_input, ocr):
     msg = user_input.get("text", "")
     files = user_input.get("files", [])
     
+    st.session_state.turn_documents = []
     if files:
         if msg is None or msg == "":
             msg = "sharing documents"
         files_content = extract_text_from_multiple_files(files, ocr)
-        user_prompt = msg
-        for i, file in enumerate(files_content):
-            user_prompt += f"\ncontract n°{i+1} called " + file["name"] + "\n" + file["content"]
+        st.session_state.turn_documents = files_content
+        if should_compare_locally(msg, files_content, target_agents):
+            user_prompt, comparison_stats = build_comparison_prompt(msg, files_content)
+            if st.session_state.get("debug_mode") and comparison_stats["compact"]:
+                st.info(f"⚖️ Comparaison locale : {comparison_stats['identical']} clauses identiques, "
+                        f"{comparison_stats['different']} différentes - {comparison_stats['compact_chars']} caractères "
+                        f"envoyés au lieu de {comparison_stats['full_chars']}")
+            elif st.session_state.get("debug_mode"):
+                st.info(f"⚖️ Comparaison locale sans gain ({comparison_stats['compact_chars']} caractères contre "
+                        f"{comparison_stats['full_chars']}) : texte complet envoyé")
+        else:
+            user_prompt = build_files_prompt(msg, files_content)
+        for file in files_content:
             if "uploaded_file" in st.session_state and isinstance(st.session_state.uploaded_file, list):
                 st.session_state.uploaded_file.append(file)
             else:
@@ -762,7 +3972,160 @@ def prompt_constructor(user_input, ocr):
     
     return user_prompt
 
+# PROFILAGE D'UN TOUR - échantillonneur de piles (stdlib), actif seulement en mode profilage
+PROFILED_THREAD_PREFIXES = ("agent-call", "extraction", "background")
+
+class TurnProfiler:
+    """
+    Échantillonne les piles du thread du script et des pools d'appels/extraction.
+    Chaque échantillon est classé CPU ou attente selon l'avance de l'horloge CPU du thread.
+    """
+
+    def __init__(self, interval: float = 0.005, max_depth: int = 64):
+        self.interval = interval
+        self.max_depth = max_depth
+        self.running = False
+        self._script_thread = threading.get_ident()
+        self._frames: Dict[Tuple[str, str, int], int] = {}
+        self._samples: Dict[int, List[Tuple[Tuple[int, ...], float, bool]]] = {}
+        self._thread_names: Dict[int, str] = {}
+        self._cpu_clocks: Dict[int, Optional[int]] = {}
+        self._last_cpu: Dict[int, float] = {}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> "TurnProfiler":
+        self._started_at = time.perf_counter()
+        self._cpu_started_at = time.process_time()
+        self._last_sample_at = self._started_at
+        self.running = True
+        self._thread = threading.Thread(target=self._run, name="turn-profiler", daemon=True)
+        self._thread.start()
+        return self
+
+    def _profiled_threads(self) -> Dict[int, str]:
+        threads = {self._script_thread: "script"}
+        for thread in threading.enumerate():
+            if thread.name.startswith(PROFILED_THREAD_PREFIXES):
+                threads[thread.ident] = thread.name
+        return threads
+
+    def _thread_cpu(self, ident: int) -> Optional[float]:
+        """Temps CPU du thread (secondes), None si la plateforme ne l'expose pas"""
+        if ident not in self._cpu_clocks:
+            try:
+                self._cpu_clocks[ident] = time.pthread_getcpuclockid(ident)
+            except (AttributeError, OSError):
+                self._cpu_clocks[ident] = None
+        clock = self._cpu_clocks[ident]
+        if clock is None:
+            return None
+        try:
+            return time.clock_gettime(clock)
+        except OSError:
+            return None
+
+    def _frame_index(self, code) -> int:
+        key = (code.co_name, code.co_filename, code.co_firstlineno)
+        index = self._frames.get(key)
+        if index is None:
+            index = self._frames[key] = len(self._frames)
+        return index
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def _sample(self):
+        now = time.perf_counter()
+        elapsed = now - self._last_sample_at
+        self._last_sample_at = now
+        frames = sys._current_frames()
+        for ident, name in self._profiled_threads().items():
+            frame = frames.get(ident)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None and len(stack) < self.max_depth:
+                stack.append(self._frame_index(frame.f_code))
+                frame = frame.f_back
+            stack.reverse()
+
+            cpu = self._thread_cpu(ident)
+            previous_cpu = self._last_cpu.get(ident)
+            on_cpu = cpu is not None and previous_cpu is not None and (cpu - previous_cpu) >= elapsed / 2
+            if cpu is not None:
+                self._last_cpu[ident] = cpu
+            self._thread_names[ident] = name
+            self._samples.setdefault(ident, []).append((tuple(stack), elapsed * 1000, on_cpu))
+
+    def stop(self) -> Dict:
+        """Arrête l'échantillonnage et retourne le résumé et le profil speedscope"""
+        if self.running:
+            self._stop.set()
+            self._thread.join()
+            self.running = False
+            self._wall_ms = (time.perf_counter() - self._started_at) * 1000
+            self._cpu_ms = (time.process_time() - self._cpu_started_at) * 1000
+        return {"summary": self.summary(), "speedscope": self.speedscope_json()}
+
+    def summary(self) -> Dict:
+        """Temps mur vs CPU, répartition par thread et fonctions les plus coûteuses (temps propre)"""
+        frame_names = {index: f"{name} ({os.path.basename(path)}:{line})" for (name, path, line), index in self._frames.items()}
+        app_dir = os.path.dirname(os.path.abspath(__file__))
+        app_frames = {index for (_, path, _), index in self._frames.items() if path.startswith(app_dir)}
+        threads = []
+        self_time: Dict[Tuple[str, bool], float] = {}
+        for ident, samples in self._samples.items():
+            # Seuls les échantillons où le thread exécute du code de l'application (un thread de pool inactif attend sa file)
+            samples = [sample for sample in samples if ident == self._script_thread or app_frames.intersection(sample[0])]
+            if not samples:
+                continue
+            cpu_ms = sum(weight for _, weight, on_cpu in samples if on_cpu)
+            wait_ms = sum(weight for _, weight, on_cpu in samples if not on_cpu)
+            threads.append({"thread": self._thread_names[ident], "cpu_ms": round(cpu_ms), "attente_ms": round(wait_ms)})
+            for stack, weight, on_cpu in samples:
+                if stack:
+                    key = (frame_names[stack[-1]], on_cpu)
+                    self_time[key] = self_time.get(key, 0.0) + weight
+        top = sorted(self_time.items(), key=lambda item: item[1], reverse=True)[:15]
+        return {
+            "wall_ms": round(self._wall_ms),
+            "cpu_ms": round(self._cpu_ms),
+            "samples": sum(len(samples) for samples in self._samples.values()),
+            "threads": threads,
+            "top_functions": [
+                {"fonction": name, "état": "CPU" if on_cpu else "attente", "ms": round(ms)} for (name, on_cpu), ms in top
+            ]
+        }
+
+    def speedscope_json(self) -> bytes:
+        """Profil au format speedscope (un profil échantillonné par thread, feuille CPU/attente ajoutée)"""
+        frames = [{"name": name, "file": path, "line": line} for (name, path, line) in self._frames]
+        cpu_frame, wait_frame = len(frames), len(frames) + 1
+        frames += [{"name": "[CPU]"}, {"name": "[attente]"}]
+        profiles = []
+        for ident, samples in self._samples.items():
+            total = sum(weight for _, weight, _ in samples)
+            profiles.append({
+                "type": "sampled",
+                "name": self._thread_names[ident],
+                "unit": "milliseconds",
+                "startValue": 0,
+                "endValue": total,
+                "samples": [list(stack) + [cpu_frame if on_cpu else wait_frame] for stack, _, on_cpu in samples],
+                "weights": [weight for _, weight, _ in samples]
+            })
+        return json.dumps({
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "shared": {"frames": frames},
+            "profiles": profiles,
+            "name": "Tour de conversation",
+            "exporter": "TurnProfiler"
+        }).encode("utf-8")
+
 # FONCTION DE VALIDATION DE CONFIGURATION
+@st.cache_data(show_spinner=False)
 def validate_multi_agent_setup():
     """Valide la configuration multi-agent complète"""
     issues = []
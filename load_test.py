@@ -0,0 +1,500 @@
+"""
+Test de charge : N sessions de chat simultanées contre une instance Streamlit headless et un bedrock-agent-runtime factice
+
+Chaque palier démarre une instance neuve de l'application (serveur Streamlit headless dans un sous-processus,
+client Bedrock remplacé par un faux à latence configurable). Les sessions sont des clients WebSocket qui
+pilotent l'application comme un navigateur : choix du mode, cases de la séquence, dépôt de PDF, message.
+Le rapport donne débit, percentiles de latence, CPU et RSS de l'instance, et le point de saturation :
+premier palier où le débit cesse de progresser ou où le p95 dépasse l'objectif.
+
+Usage:
+    python load_test.py --levels 1 2 4 8 16 32 --turns 5
+    python load_test.py --levels 8 --distribution lognormal --first-chunk-ms 1500 --stream-ms 4000
+    python load_test.py --levels 4 8 --mix intelligent=0.2,sequence=0.5,single=0.3 --pdf-rate 0.5 --throttle-rate 0.02
+"""
+import argparse
+import asyncio
+import math
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+import uuid
+
+from benchmarks import FAKE_SECRETS
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+MODE_LABELS = {
+    "intelligent": "Orchestration Intelligente",
+    "sequence": "Séquence Multi-Agent",
+    "single": "Agent Unique"
+}
+MODE_RADIO_LABEL = "Choisissez un mode:"
+SEQUENCE_AGENTS = ("quality", "drafter")
+SINGLE_AGENT = "quality"
+FAILURE_MARKERS = ("❌", "⛔", "Erreur lors du traitement")
+QUESTIONS = [
+    "Analyse la qualité de ce contrat et signale les clauses à risque",
+    "Rédige une clause de confidentialité pour un contrat de prestation",
+    "Compare les conditions de résiliation des deux contrats",
+    "Quels sont les prix du marché pour ce type de prestation ?",
+    "Prépare une stratégie de négociation sur les pénalités de retard",
+    "Retrouve les contrats qui mentionnent une clause de non-concurrence"
+]
+
+# CLIENT BEDROCK FACTICE (côté instance)
+class FakeCompletion:
+    """Flux d'événements factice : chunks espacés dans le temps, interrompu par close() comme un flux HTTP"""
+
+    def __init__(self, chunks, delays):
+        self.chunks = chunks
+        self.delays = delays
+        self._closed = threading.Event()
+
+    def __iter__(self):
+        for chunk, delay in zip(self.chunks, self.delays):
+            if self._closed.wait(delay):
+                raise ConnectionError("flux fermé")
+            yield {"chunk": {"bytes": chunk.encode("utf-8")}}
+
+    def close(self):
+        self._closed.set()
+
+class FakeAgentRuntime:
+    """Client bedrock-agent-runtime factice : latences tirées d'une distribution, limitation de débit simulée"""
+
+    def __init__(self, distribution, first_chunk_ms, stream_ms, response_chars, throttle_rate, seed=0):
+        self.distribution = distribution
+        self.first_chunk_ms = first_chunk_ms
+        self.stream_ms = stream_ms
+        self.response_chars = response_chars
+        self.throttle_rate = throttle_rate
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _draw_ms(self, median_ms):
+        if self.distribution == "fixed" or median_ms <= 0:
+            return median_ms
+        if self.distribution == "exponential":
+            return self._rng.expovariate(1 / median_ms)
+        return self._rng.lognormvariate(math.log(median_ms), 0.5)  # p95 ≈ 2,3 × la médiane
+
+    def invoke_agent(self, **params):
+        if params.get("endSession"):
+            # Fermeture de session (« End of session. ») : ni latence simulée ni limitation de débit
+            return {"completion": FakeCompletion([], []), "sessionId": params.get("sessionId")}
+        with self._lock:
+            throttled = self._rng.random() < self.throttle_rate
+            first_chunk_s = self._draw_ms(self.first_chunk_ms) / 1000
+            stream_s = self._draw_ms(self.stream_ms) / 1000
+        if throttled:
+            from botocore.exceptions import ClientError
+            raise ClientError({"Error": {"Code": "ThrottlingException", "Message": "Rate exceeded"}}, "InvokeAgent")
+        text = f"Réponse simulée de {params.get('agentId')}. " + "Analyse détaillée de la clause. " * (self.response_chars // 32)
+        parts = 5
+        chunks = [text[i * len(text) // parts:(i + 1) * len(text) // parts] for i in range(parts)]
+        delays = [first_chunk_s] + [stream_s / (parts - 1)] * (parts - 1)
+        return {"completion": FakeCompletion(chunks, delays), "sessionId": params.get("sessionId")}
+
+def serve(args):
+    """Instance de l'application : serveur Streamlit headless dont le client Bedrock est le faux"""
+    import tempfile
+    import streamlit as st
+    from streamlit.runtime.secrets import Secrets
+
+    # Secrets factices installés avant l'import de functions (lus à l'import), comme le fait AppTest
+    secrets = Secrets([])
+    secrets._secrets = FAKE_SECRETS
+    st.secrets = secrets
+
+    import functions
+    runtime = FakeAgentRuntime(args.distribution, args.first_chunk_ms, args.stream_ms, args.response_chars,
+                               args.throttle_rate, args.seed)
+    functions.get_bedrock_client = lambda: runtime
+    # Journaux SQLite et endpoint de métriques propres à l'instance de test
+    workdir = tempfile.mkdtemp(prefix="load-test-")
+    functions.SELECTION_LOG_PATH = os.path.join(workdir, "agent_selection.sqlite3")
+    functions.CONTRACT_INDEX_PATH = os.path.join(workdir, "contract_index.sqlite3")
+    functions.METRICS_ENABLED = False
+
+    from streamlit.web import bootstrap
+    flag_options = {
+        "server.address": "127.0.0.1",
+        "server.port": args.port,
+        "server.headless": True,
+        "server.fileWatcherType": "none",
+        "server.enableXsrfProtection": False,  # Dépôts de fichiers sans cookie XSRF
+        "global.minCachedMessageSize": 2 ** 31,  # Pas de références de cache : chaque client reçoit tout
+        "browser.gatherUsageStats": False
+    }
+    bootstrap.load_config_options(flag_options=flag_options)
+    bootstrap.run(APP_PATH, False, [], flag_options)
+
+# DOCUMENTS DÉPOSÉS
+def make_contract_pdf(pages, seed=0):
+    """PDF minimal (texte Helvetica) d'un contrat de plusieurs pages, extractible par pypdf"""
+    rng = random.Random(seed)
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>", None, "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    page_ids = []
+    for page in range(pages):
+        lines = [f"Contrat de prestation n. {seed} - page {page + 1}"] + [
+            f"Article {page * 20 + i + 1} : le prestataire s'engage a livrer sous {rng.randint(5, 90)} jours "
+            f"avec une penalite de {rng.randint(1, 10)} % par semaine de retard."
+            for i in range(20)
+        ]
+        stream = "BT /F1 9 Tf 40 800 Td 12 TL " + " ".join(
+            "(" + line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)") + ") '" for line in lines
+        ) + " ET"
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+                       f"/Resources << /Font << /F1 3 0 R >> >> /Contents {len(objects)} 0 R >>")
+        page_ids.append(len(objects))
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(f'{i} 0 R' for i in page_ids)}] /Count {pages} >>"
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += f"{number} 0 obj\n{body}\nendobj\n".encode("latin-1")
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode("latin-1")
+    out += "".join(f"{offset:010d} 00000 n \n" for offset in offsets).encode("latin-1")
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode("latin-1")
+    return bytes(out)
+
+# SESSIONS SIMULÉES (côté générateur de charge)
+class ChatSession:
+    """Client WebSocket d'une session : relance le script avec les états de widgets, comme le navigateur"""
+
+    def __init__(self, port, timeout):
+        self.base_url = f"http://127.0.0.1:{port}"
+        self.timeout = timeout
+        self.session_id = ""
+        self.page_script_hash = ""
+        self.widgets = {}  # (type, libellé) -> identifiant du widget au dernier passage
+        self.persistent = {}  # Valeurs conservées d'un passage à l'autre (radio, cases)
+        self.failures = 0
+        self._ws = None
+
+    async def connect(self):
+        from tornado.websocket import websocket_connect
+        self._ws = await websocket_connect(f"ws://127.0.0.1:{self.base_url.rsplit(':', 1)[1]}/_stcore/stream",
+                                          subprotocols=["streamlit"], max_message_size=64 * 1024 * 1024)
+        await self.rerun()
+
+    def close(self):
+        if self._ws is not None:
+            self._ws.close()
+
+    async def rerun(self, *triggers):
+        """Envoie un rerun et lit les messages jusqu'à la fin du dernier passage (reruns enchaînés compris)"""
+        from streamlit.proto.BackMsg_pb2 import BackMsg
+        from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+
+        msg = BackMsg()
+        msg.rerun_script.query_string = ""
+        msg.rerun_script.page_script_hash = self.page_script_hash
+        msg.rerun_script.widget_states.widgets.extend(list(self.persistent.values()) + list(triggers))
+        await self._ws.write_message(msg.SerializeToString(), binary=True)
+
+        elements = []
+        while True:
+            raw = await asyncio.wait_for(self._ws.read_message(), self.timeout)
+            if raw is None:
+                raise ConnectionError("connexion WebSocket fermée par l'instance")
+            forward = ForwardMsg()
+            forward.ParseFromString(raw)
+            kind = forward.WhichOneof("type")
+            if kind == "new_session":
+                self.session_id = forward.new_session.initialize.session_id
+                self.page_script_hash = forward.new_session.page_script_hash
+                elements = []
+            elif kind == "delta" and forward.delta.WhichOneof("type") == "new_element":
+                elements.append(forward.delta.new_element)
+            elif kind == "script_finished" and forward.script_finished != ForwardMsg.FINISHED_EARLY_FOR_RERUN:
+                break
+
+        self.widgets = {}
+        failures = 0
+        for element in elements:
+            kind = element.WhichOneof("type")
+            proto = getattr(element, kind)
+            if hasattr(proto, "id") and proto.id:
+                self.widgets[(kind, getattr(proto, "label", "") or getattr(proto, "placeholder", ""))] = proto
+            if kind == "exception" or (kind == "markdown" and any(m in element.markdown.body for m in FAILURE_MARKERS)):
+                failures += 1
+        new_failures, self.failures = failures > self.failures, failures
+        return new_failures
+
+    def widget(self, kind, label):
+        for (widget_kind, widget_label), proto in self.widgets.items():
+            if widget_kind == kind and label in widget_label:
+                return proto
+        raise LookupError(f"widget {kind} « {label} » absent de la page")
+
+    @staticmethod
+    def state(proto, **value):
+        from streamlit.proto.WidgetStates_pb2 import WidgetState
+        return WidgetState(id=proto.id, **value)
+
+    async def set_mode(self, mode):
+        from functions import AGENTS
+
+        radio = self.widget("radio", MODE_RADIO_LABEL)
+        self.persistent[radio.id] = self.state(radio, int_value=list(MODE_LABELS).index(mode))
+        await self.rerun()
+        if mode == "sequence":
+            for agent_key in SEQUENCE_AGENTS:
+                checkbox = self.widget("checkbox", AGENTS[agent_key]["name"])
+                self.persistent[checkbox.id] = self.state(checkbox, bool_value=True)
+            await self.rerun()
+        elif mode == "single":
+            await self.rerun(self.state(self.widget("button", AGENTS[SINGLE_AGENT]["name"]), trigger_value=True))
+
+    async def upload(self, name, data):
+        """Dépôt d'un fichier : envoi HTTP puis rerun avec l'état du widget (l'extraction démarre à ce passage)"""
+        from tornado.httpclient import AsyncHTTPClient
+        from streamlit.proto.Common_pb2 import FileUploaderState, UploadedFileInfo
+
+        file_id = uuid.uuid4().hex
+        boundary = uuid.uuid4().hex
+        body = (f"--{boundary}\r\nContent-Disposition: form-data; name=\"file\"; filename=\"{name}\"\r\n"
+                f"Content-Type: application/pdf\r\n\r\n").encode("utf-8") + data + f"\r\n--{boundary}--\r\n".encode("utf-8")
+        await AsyncHTTPClient().fetch(f"{self.base_url}/_stcore/upload_file/{self.session_id}/{file_id}", method="PUT",
+                                      body=body, headers={"Content-Type": f"multipart/form-data; boundary={boundary}"},
+                                      request_timeout=self.timeout)
+        uploader = self.widget("file_uploader", "Télécharger des fichiers")
+        state = FileUploaderState(max_file_id=1, uploaded_file_info=[
+            UploadedFileInfo(id=1, name=name, size=len(data), file_id=file_id)
+        ])
+        self.persistent[uploader.id] = self.state(uploader, file_uploader_state_value=state)
+        await self.rerun()
+
+    async def send(self, text):
+        """Envoie un message ; renvoie vrai si le tour a produit une erreur"""
+        chat_input = self.widget("chat_input", "Tapez votre message")
+        failed = await self.rerun(self.state(chat_input, string_trigger_value={"data": text}))
+        # Le dépôt est vidé après l'envoi : le widget suivant a un autre identifiant
+        self.persistent = {k: v for k, v in self.persistent.items() if not v.HasField("file_uploader_state_value")}
+        return failed
+
+async def run_session(index, args, mix, pdfs):
+    """Une session : chargement de la page puis `turns` messages (mode et dépôt de PDF tirés au hasard)"""
+    rng = random.Random(args.seed * 1000 + index)
+    session = ChatSession(args.port, args.turn_timeout)
+    turns = []
+    try:
+        await session.connect()
+        mode = "intelligent"
+        for _ in range(args.turns):
+            await asyncio.sleep(rng.uniform(0, 2 * args.think_ms) / 1000)
+            next_mode = rng.choices(list(mix), weights=list(mix.values()))[0]
+            if next_mode != mode:
+                await session.set_mode(next_mode)
+                mode = next_mode
+            with_pdf = rng.random() < args.pdf_rate
+            if with_pdf:
+                await session.upload(f"contrat-{index}.pdf", rng.choice(pdfs))
+            started_at = time.perf_counter()
+            failed = await session.send(rng.choice(QUESTIONS))
+            turns.append({"mode": mode, "pdf": with_pdf, "latency_s": time.perf_counter() - started_at, "failed": failed})
+    except Exception as e:
+        print(f"session {index} interrompue : {type(e).__name__}: {e}", file=sys.stderr)
+        turns.append({"mode": None, "pdf": False, "latency_s": None, "failed": True})
+    finally:
+        session.close()
+    return turns
+
+# MESURES DE L'INSTANCE
+class ProcessSampler:
+    """Échantillonne CPU (%) et RSS (Mo) d'un processus via /proc"""
+
+    def __init__(self, pid, interval=0.5):
+        self.pid = pid
+        self.interval = interval
+        self.samples = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _read(self):
+        with open(f"/proc/{self.pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        cpu_s = (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+        with open(f"/proc/{self.pid}/statm") as f:
+            rss_mb = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+        return cpu_s, rss_mb
+
+    def _run(self):
+        last_cpu, _ = self._read()
+        last_wall = time.perf_counter()
+        while not self._stop.wait(self.interval):
+            try:
+                cpu, rss_mb = self._read()
+            except (OSError, IndexError):
+                return
+            wall = time.perf_counter()
+            self.samples.append((100 * (cpu - last_cpu) / (wall - last_wall), rss_mb))
+            last_cpu, last_wall = cpu, wall
+
+    def __enter__(self):
+        self.cpu_start, _ = self._read()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.cpu_total, _ = self._read()
+        self.cpu_total -= self.cpu_start
+        self._stop.set()
+        self._thread.join()
+
+    def peak_rss_mb(self):
+        with open(f"/proc/{self.pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+        return 0.0
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def start_instance(args, port):
+    """Lance une instance headless et attend qu'elle réponde au contrôle de santé"""
+    command = [sys.executable, os.path.abspath(__file__), "--serve", "--port", str(port)] + [
+        f"--{name.replace('_', '-')}={getattr(args, name)}"
+        for name in ("distribution", "first_chunk_ms", "stream_ms", "response_chars", "throttle_rate", "seed")
+    ]
+    server = subprocess.Popen(command, cwd=os.path.dirname(APP_PATH), stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise SystemExit(f"l'instance s'est arrêtée au démarrage :\n{server.stderr.read().decode()[-2000:]}")
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/_stcore/health", timeout=1)
+            return server
+        except OSError:
+            time.sleep(0.2)
+    server.kill()
+    raise SystemExit("l'instance n'a pas démarré en 60 s")
+
+def run_level(args, sessions, mix, pdfs):
+    """Un palier : instance neuve, `sessions` clients simultanés, mesures de l'instance"""
+    args.port = free_port()
+    server = start_instance(args, args.port)
+    try:
+        with ProcessSampler(server.pid) as sampler:
+            started_at = time.perf_counter()
+
+            async def run_all():
+                return await asyncio.gather(*(run_session(i, args, mix, pdfs) for i in range(sessions)))
+
+            turns = [turn for session_turns in asyncio.run(run_all()) for turn in session_turns]
+            wall = time.perf_counter() - started_at
+        peak_rss = sampler.peak_rss_mb()
+    finally:
+        server.terminate()
+        try:
+            server.wait(10)
+        except subprocess.TimeoutExpired:
+            server.kill()
+
+    completed = [t for t in turns if t["latency_s"] is not None]
+    latencies = [t["latency_s"] for t in completed]
+    return {
+        "sessions": sessions,
+        "turns": len(completed),
+        "failed": sum(t["failed"] for t in turns),
+        "throughput": len(completed) / wall if wall else 0.0,
+        "p50_s": percentile(latencies, 50),
+        "p95_s": percentile(latencies, 95),
+        "p99_s": percentile(latencies, 99),
+        "p95_by_mode": {mode: percentile([t["latency_s"] for t in completed if t["mode"] == mode], 95) for mode in mix},
+        "p95_pdf_s": percentile([t["latency_s"] for t in completed if t["pdf"]], 95),
+        "cpu_pct": 100 * sampler.cpu_total / wall if wall else 0.0,
+        "cpu_peak_pct": max((s[0] for s in sampler.samples), default=0.0),
+        "rss_mb": statistics.mean(s[1] for s in sampler.samples) if sampler.samples else 0.0,
+        "rss_peak_mb": peak_rss
+    }
+
+# PALIERS ET POINT DE SATURATION
+def parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        mode, _, weight = part.partition("=")
+        if mode.strip() not in MODE_LABELS:
+            raise argparse.ArgumentTypeError(f"mode inconnu : {mode}")
+        mix[mode.strip()] = float(weight or 1)
+    return mix
+
+def find_saturation(results, min_gain, slo_s):
+    """Premier palier dont le débit progresse de moins de min_gain, ou dont le p95 dépasse l'objectif"""
+    for previous, current in zip(results, results[1:]):
+        if current["p95_s"] is not None and current["p95_s"] > slo_s:
+            return current["sessions"], f"p95 {current['p95_s']:.1f} s > objectif {slo_s:.1f} s"
+        if current["throughput"] < previous["throughput"] * (1 + min_gain):
+            return current["sessions"], (f"débit {current['throughput']:.2f} tours/s, "
+                                         f"{current['throughput'] / previous['throughput'] - 1:+.0%} seulement")
+    return None, "non atteint sur les paliers testés"
+
+def format_seconds(value):
+    return "-" if value is None else f"{value:.2f}"
+
+def main():
+    parser = argparse.ArgumentParser(description="Test de charge des sessions de chat")
+    parser.add_argument("--levels", type=int, nargs="+", default=[1, 2, 4, 8, 16], help="Sessions simultanées par palier")
+    parser.add_argument("--turns", type=int, default=5, help="Messages par session")
+    parser.add_argument("--think-ms", type=float, default=500, help="Temps de réflexion moyen entre deux messages")
+    parser.add_argument("--mix", type=parse_mix, default="intelligent=0.4,sequence=0.3,single=0.3",
+                        help="Répartition des modes")
+    parser.add_argument("--pdf-rate", type=float, default=0.3, help="Part des messages avec un PDF déposé")
+    parser.add_argument("--pdf-pages", type=int, default=10)
+    parser.add_argument("--distribution", choices=["fixed", "lognormal", "exponential"], default="lognormal")
+    parser.add_argument("--first-chunk-ms", type=float, default=800, help="Médiane du délai avant le premier chunk")
+    parser.add_argument("--stream-ms", type=float, default=1500, help="Médiane de la durée du reste du flux")
+    parser.add_argument("--response-chars", type=int, default=1500)
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Probabilité de ThrottlingException par appel")
+    parser.add_argument("--turn-timeout", type=float, default=300)
+    parser.add_argument("--slo", type=float, default=15.0, help="Objectif de p95 par message (secondes)")
+    parser.add_argument("--min-gain", type=float, default=0.1, help="Gain de débit minimal entre deux paliers")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, default=0, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args)
+        return
+
+    pdfs = [make_contract_pdf(args.pdf_pages, seed) for seed in range(4)]
+    results = []
+    print(f"{'sessions':>8} {'tours':>6} {'échecs':>6} {'tours/s':>8} {'p50 s':>7} {'p95 s':>7} {'p99 s':>7} "
+          f"{'CPU %':>6} {'CPU max':>7} {'RSS Mo':>7} {'RSS max':>7}", flush=True)
+    for level in args.levels:
+        result = run_level(args, level, args.mix, pdfs)
+        results.append(result)
+        print(f"{level:>8} {result['turns']:>6} {result['failed']:>6} {result['throughput']:>8.2f} "
+              f"{format_seconds(result['p50_s']):>7} {format_seconds(result['p95_s']):>7} {format_seconds(result['p99_s']):>7} "
+              f"{result['cpu_pct']:>6.0f} {result['cpu_peak_pct']:>7.0f} {result['rss_mb']:>7.0f} {result['rss_peak_mb']:>7.0f}",
+              flush=True)
+
+    print("\np95 par mode (s) :")
+    for result in results:
+        by_mode = ", ".join(f"{mode} {format_seconds(value)}" for mode, value in result["p95_by_mode"].items())
+        print(f"  {result['sessions']:>3} sessions : {by_mode}, avec PDF {format_seconds(result['p95_pdf_s'])}")
+    saturation, reason = find_saturation(results, args.min_gain, args.slo)
+    print(f"\nPoint de saturation : {saturation if saturation else '-'} sessions ({reason})")
+
+if __name__ == "__main__":
+    main()
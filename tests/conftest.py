@@ -0,0 +1,34 @@
+import os
+import sys
+
+import pytest
+
+# Les modules de l'application sont à la racine du dépôt
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class SessionState(dict):
+    """session_state minimal (hors de « streamlit run »), qui garde l'historique des affectations par attribut"""
+
+    __getattr__ = dict.__getitem__
+
+    def __init__(self, **values):
+        super().__init__(**values)
+        object.__setattr__(self, "assignments", [])
+
+    def __setattr__(self, name, value):
+        self.assignments.append((name, value))
+        self[name] = value
+
+
+@pytest.fixture
+def session_state(monkeypatch):
+    """Installe un session_state neuf dans functions.st (un par appel, ex. un onglet par appel) et le retourne"""
+    import functions
+
+    def install(**values) -> SessionState:
+        state = SessionState(**values)
+        monkeypatch.setattr(functions.st, "session_state", state)
+        return state
+
+    return install
@@ -0,0 +1,60 @@
+import time
+
+import functions
+from functions import AgentLatencyStats, BedrockSessionManager
+
+
+class RecordingClient:
+    def __init__(self):
+        self.calls = []
+
+    def invoke_agent(self, **params):
+        self.calls.append(params)
+        return {"completion": [{"chunk": {"bytes": b"OK"}}]}
+
+
+def configure_agent(monkeypatch, client):
+    monkeypatch.setitem(functions.AGENT_IDS, "quality", "agent-id")
+    monkeypatch.setitem(functions.AGENT_ALIAS_IDS, "quality", "alias-id")
+    monkeypatch.setattr(functions, "configured_agent_keys", lambda: ["quality"])
+    monkeypatch.setattr(functions, "get_bedrock_client", lambda: client)
+    monkeypatch.setattr(functions, "get_latency_stats", lambda: AgentLatencyStats())
+
+
+def test_unavailable_client_is_not_cached(monkeypatch):
+    functions.cached_agents_health.clear()
+    monkeypatch.setattr(functions, "get_bedrock_client", lambda: None)
+    assert "error" in functions.get_agents_health()
+
+    client = RecordingClient()
+    configure_agent(monkeypatch, client)
+    health = functions.get_agents_health()
+    functions.cached_agents_health.clear()
+
+    assert "error" not in health
+    assert health["agents"]["quality"]["ok"]
+    # La session jetable de la sonde est fermée par un appel séparé, pas par l'appel qui répond
+    assert client.calls[0]["endSession"] is False
+    deadline = time.monotonic() + 5
+    while len(client.calls) < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert client.calls[1]["sessionId"] == client.calls[0]["sessionId"]
+    assert client.calls[1]["endSession"] is True
+
+
+def test_warm_up_opens_the_user_session(monkeypatch, session_state):
+    client = RecordingClient()
+    configure_agent(monkeypatch, client)
+    manager = BedrockSessionManager()
+    monkeypatch.setattr(functions, "get_session_manager", lambda: manager)
+    monkeypatch.setattr(functions, "get_user_id", lambda: "user")
+    session_state(context_mode=True)
+
+    functions.warm_up_user_sessions().join(timeout=5)
+
+    session = functions.acquire_agent_session("quality")
+    assert client.calls[0]["sessionId"] == session.session_id
+    assert client.calls[0]["endSession"] is False
+    assert session.turns == 1
+    # Une seule fois par session Streamlit
+    assert functions.warm_up_user_sessions() is None
@@ -0,0 +1,36 @@
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def run_benchmark(*args):
+    return subprocess.run([sys.executable, "benchmarks.py", *args], cwd=ROOT, capture_output=True, text=True, timeout=300)
+
+
+@pytest.mark.parametrize("args", [
+    ["rerun", "--sizes", "0", "4", "--repeats", "1"],
+    ["chunks", "--count", "200", "--repeats", "1"],
+    ["fuzz-split", "--iterations", "50"],
+    ["index", "--documents", "20", "--queries", "10"],
+    ["memory", "--turns", "10"],
+    ["scheduler", "--batch-users", "2", "--shards", "3", "--interactive", "4", "--call-ms", "5", "--slots", "4"],
+], ids=lambda args: args[0])
+def test_benchmark_subcommand_runs(args):
+    result = run_benchmark(*args)
+
+    assert result.returncode == 0, result.stderr
+    assert "Traceback" not in result.stderr
+
+
+def test_normalize_benchmark_runs(tmp_path):
+    document = tmp_path / "contrat.txt"
+    document.write_text("ARTICLE 1 - Objet\nLe présent contrat définit les prestations.\n", encoding="utf-8")
+
+    result = run_benchmark("normalize", str(document))
+
+    assert result.returncode == 0, result.stderr
+    assert "contrat.txt" in result.stdout
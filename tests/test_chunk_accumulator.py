@@ -0,0 +1,78 @@
+import random
+
+import pytest
+
+from functions import ChunkAccumulator, parse_multi_agent_response_complete
+
+STREAMS = [
+    "Synthèse : la clause de résiliation anticipée prévoit un préavis de 30 jours. ✅\n",
+    "Points d'attention 🔍 : pénalités plafonnées à 10 %, révision annuelle (indice Syntec) — 👍🏽\n",
+    "Ça coûte 45 € ; délai à l'échéance « fin de mois » 🤝🇫🇷\n" * 3,
+]
+
+
+def split_at(data, cuts):
+    bounds = [0] + sorted(cuts) + [len(data)]
+    return [data[start:end] for start, end in zip(bounds, bounds[1:])]
+
+
+def parse_chunks(chunks):
+    return parse_multi_agent_response_complete({"completion": [{"chunk": {"bytes": chunk}} for chunk in chunks]})
+
+
+@pytest.mark.parametrize("seed", range(50))
+def test_random_splits_rebuild_the_exact_text(seed):
+    rng = random.Random(seed)
+    text = STREAMS[seed % len(STREAMS)]
+    data = text.encode("utf-8")
+    chunks = split_at(data, rng.sample(range(1, len(data)), rng.randint(1, 20)))
+
+    accumulator = ChunkAccumulator(keep_raw=True)
+    decoded = "".join(accumulator.classify(chunk)[1] for chunk in chunks) + accumulator.flush()
+
+    assert decoded == text
+    assert b"".join(bytes(view) for view in accumulator.raw_chunks()) == data
+    # Le parser complet donne le même résultat que le flux en un seul chunk
+    parsed = parse_chunks(chunks)
+    assert parsed.errors == []
+    assert parsed.final_response == parse_chunks([data]).final_response
+
+
+def test_every_cut_inside_an_emoji_is_reassembled():
+    text = "avant 🇫🇷 après"
+    data = text.encode("utf-8")
+    start = data.index("🇫🇷".encode("utf-8"))
+    for cut in range(start + 1, start + len("🇫🇷".encode("utf-8"))):
+        accumulator = ChunkAccumulator()
+        decoded = "".join(accumulator.classify(chunk)[1] for chunk in split_at(data, [cut]))
+
+        assert decoded + accumulator.flush() == text
+
+
+def test_flush_returns_nothing_after_a_complete_stream():
+    accumulator = ChunkAccumulator()
+    accumulator.classify("é".encode("utf-8")[:1])
+
+    assert accumulator.classify("é".encode("utf-8")[1:]) == ("text", "é")
+    assert accumulator.flush() == ""
+
+
+def test_truncated_character_at_end_of_stream_is_reported():
+    data = "fin 🔍".encode("utf-8")[:-1]
+
+    accumulator = ChunkAccumulator()
+    assert accumulator.classify(data) == ("text", "fin ")
+    with pytest.raises(UnicodeDecodeError):
+        accumulator.flush()
+
+    parsed = parse_chunks([data])
+    assert parsed.final_response == "fin"
+    assert any(error.startswith("Erreur décodage") for error in parsed.errors)
+
+
+def test_decoder_is_reset_after_an_invalid_chunk():
+    # Début de « é » en attente, puis un octet invalide : le chunk suivant repart d'un décodeur propre
+    parsed = parse_chunks([b"d\xc3", b"\xff", "éjà vu".encode("utf-8")])
+
+    assert len(parsed.errors) == 1 and parsed.errors[0].startswith("Erreur décodage")
+    assert parsed.final_response == "déjà vu"
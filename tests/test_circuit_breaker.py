@@ -0,0 +1,115 @@
+import asyncio
+
+import pytest
+
+import functions
+from functions import CircuitBreaker, CircuitBreakerRegistry
+
+
+def half_open_breaker(agent_key="quality"):
+    breaker = CircuitBreaker(agent_key)
+    breaker.record_failure("erreur", fatal=True)
+    breaker._opened_at -= breaker._open_seconds
+    return breaker
+
+
+def test_half_open_allows_a_single_probe():
+    breaker = half_open_breaker()
+
+    assert breaker.allow()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert not breaker.allow()
+
+
+def test_released_probe_lets_the_next_call_probe():
+    breaker = half_open_breaker()
+    assert breaker.allow()
+
+    breaker.release_probe()
+
+    assert breaker.allow()
+
+
+class CancelledClient:
+    def invoke_agent(self, **params):
+        raise asyncio.CancelledError()
+
+
+def test_cancelled_probe_releases_the_breaker(monkeypatch, session_state):
+    registry = CircuitBreakerRegistry()
+    breaker = registry._breakers["quality"] = half_open_breaker()
+    monkeypatch.setattr(functions, "get_circuit_breakers", lambda: registry)
+    monkeypatch.setattr(functions, "get_bedrock_client", lambda: CancelledClient())
+    monkeypatch.setattr(functions, "end_cancelled_session", lambda session: None)
+    monkeypatch.setattr(functions, "get_user_id", lambda: "user")
+    monkeypatch.setitem(functions.AGENT_IDS, "quality", "agent-id")
+    monkeypatch.setitem(functions.AGENT_ALIAS_IDS, "quality", "alias-id")
+    session_state(debug_mode=False)
+
+    with pytest.raises(asyncio.CancelledError):
+        asyncio.run(functions.execute_agent("quality", functions.AGENTS["quality"], "question", ephemeral=True))
+
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert breaker.allow()
+
+
+def test_slow_router_orchestration_is_not_a_failure():
+    router, quality = CircuitBreaker("router"), CircuitBreaker("quality")
+
+    router.record_success(latency_ms=30 * 60 * 1000)
+    quality.record_success(latency_ms=30 * 60 * 1000)
+
+    assert router._consecutive_failures == 0
+    assert quality._consecutive_failures == 1
+
+
+class ThrottledClient:
+    def invoke_agent(self, **params):
+        raise RuntimeError("ThrottlingException: Rate exceeded")
+
+
+def test_throttled_attempts_do_not_open_the_breaker(monkeypatch, session_state):
+    async def no_sleep(delay):
+        return None
+
+    registry = CircuitBreakerRegistry()
+    monkeypatch.setattr(functions, "get_circuit_breakers", lambda: registry)
+    monkeypatch.setattr(functions, "get_bedrock_client", lambda: ThrottledClient())
+    monkeypatch.setattr(functions, "get_user_id", lambda: "user")
+    monkeypatch.setattr(functions.asyncio, "sleep", no_sleep)
+    session_state(debug_mode=False)
+    monkeypatch.setitem(functions.AGENT_IDS, "quality", "agent-id")
+    monkeypatch.setitem(functions.AGENT_ALIAS_IDS, "quality", "alias-id")
+
+    response = asyncio.run(functions.execute_agent("quality", functions.AGENTS["quality"], "question", ephemeral=True))
+
+    assert response.startswith("❌ Limite de débit")
+    assert registry.get("quality").state == CircuitBreaker.CLOSED
+
+
+def test_queued_call_does_not_hold_the_half_open_probe(monkeypatch, session_state):
+    registry = CircuitBreakerRegistry()
+    breaker = registry._breakers["quality"] = half_open_breaker()
+    scheduler = functions.FairAgentScheduler(max_concurrent=1, interactive_reserved=0)
+    busy = scheduler.submit("other", "quality")
+    monkeypatch.setattr(functions, "get_circuit_breakers", lambda: registry)
+    monkeypatch.setattr(functions, "get_agent_scheduler", lambda: scheduler)
+    monkeypatch.setattr(functions, "get_bedrock_client", lambda: CancelledClient())
+    monkeypatch.setattr(functions, "get_user_id", lambda: "user")
+    monkeypatch.setitem(functions.AGENT_IDS, "quality", "agent-id")
+    monkeypatch.setitem(functions.AGENT_ALIAS_IDS, "quality", "alias-id")
+    session_state(debug_mode=False)
+
+    async def queued_call():
+        call = asyncio.ensure_future(functions.execute_agent("quality", functions.AGENTS["quality"], "question", ephemeral=True))
+        await asyncio.sleep(0.1)
+        # L'appel attend sa place : la sonde semi-ouverte reste disponible pour un autre appel
+        assert not call.done()
+        assert breaker.allow()
+        breaker.release_probe()
+        call.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await call
+
+    asyncio.run(queued_call())
+    scheduler.release(busy)
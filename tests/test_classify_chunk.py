@@ -0,0 +1,38 @@
+import json
+
+import pytest
+
+from functions import classify_chunk
+
+
+@pytest.mark.parametrize("raw, expected", [
+    # Texte brut
+    ("La clause de résiliation prévoit un préavis.".encode("utf-8"), ("text", "La clause de résiliation prévoit un préavis.")),
+    (b"   ", ("text", "   ")),
+    # JSON avec texte ou contenu
+    (json.dumps({"text": "Article 4"}).encode("utf-8"), ("json", "Article 4")),
+    (json.dumps({"content": "Article 5"}).encode("utf-8"), ("json", "Article 5")),
+    (json.dumps({"other": 1}).encode("utf-8"), ("json", None)),
+    # Espaces avant l'accolade : toujours du JSON
+    (b'  \n\t{"text": "indent\\u00e9"}', ("json", "indenté")),
+    # JSON invalide ou incomplet : ignoré
+    (b'{"text": "coup', ("json", None)),
+    # Régression : un chunk numérique (JSON valide) reste du texte
+    (b"123", ("text", "123")),
+    (b"2024", ("text", "2024")),
+    (b"[1, 2]", ("text", "[1, 2]")),
+])
+def test_chunk_kinds(raw, expected):
+    assert classify_chunk(raw) == expected
+
+
+@pytest.mark.parametrize("marker, kind", [
+    ("RerunData", "rerun"),
+    ("InternalServerError", "system_error"),
+    ("ValidationException", "system_error"),
+])
+@pytest.mark.parametrize("as_json", [True, False], ids=["json", "text"])
+def test_system_markers_are_filtered(marker, kind, as_json):
+    raw = json.dumps({"type": marker, "text": "ignoré"}).encode("utf-8") if as_json else f"{marker}: retry later".encode("utf-8")
+
+    assert classify_chunk(raw) == (kind, None)
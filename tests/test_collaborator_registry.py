@@ -0,0 +1,32 @@
+import pytest
+
+from functions import AGENTS, COLLABORATOR_REGISTRY, DEFAULT_AGENT_ALIASES, CollaboratorRegistry
+
+
+@pytest.mark.parametrize("name, agent_key", [
+    ("QualityAgent", "quality"),
+    ("quality_agent", "quality"),
+    ("Market_Comparison-Agent", "market_comparison"),
+    ("ContractsCompareAgent", "contracts_compare"),
+    ("IndexSearchAgent", "index_search"),
+    ("Agent Qualité", "quality"),
+    ("ContractManager", "manager"),
+])
+def test_whole_names_and_exact_aliases_resolve(name, agent_key):
+    assert COLLABORATOR_REGISTRY.resolve(name) == agent_key
+
+
+@pytest.mark.parametrize("name", ["ResearchAgent", "MarketResearchAgent", "PriceCompareTool", "SearchEngineAgent"])
+def test_unrelated_names_containing_an_alias_do_not_resolve(name):
+    registry = CollaboratorRegistry(AGENTS, DEFAULT_AGENT_ALIASES)
+
+    assert registry.resolve(name) is None
+    assert registry.icon_for(name) == CollaboratorRegistry.DEFAULT_ICON
+    assert registry.display_name_for(name) == name
+
+
+def test_ui_lookups_by_agent_key():
+    assert list(COLLABORATOR_REGISTRY) == list(AGENTS)
+    assert COLLABORATOR_REGISTRY.label("quality") == f"{AGENTS['quality']['icon']} {AGENTS['quality']['name']}"
+    assert "unknown" not in COLLABORATOR_REGISTRY
+    assert COLLABORATOR_REGISTRY.name("unknown") == "unknown"
@@ -0,0 +1,38 @@
+from functions import build_comparison_prompt, build_files_prompt, split_into_clauses
+
+
+def contract(rent: str) -> str:
+    body = "Le présent article précise les obligations des parties. " * 20
+    return (f"2.1 Objet\n{body}\n2.2 Durée\nLe contrat est conclu pour trois ans. {body}\n"
+            f"2.3 Loyer\nLe loyer annuel est de {rent} euros.\n")
+
+
+def test_unpunctuated_multilevel_headings_are_detected():
+    headings = [clause.heading for clause in split_into_clauses(contract("12 000"))]
+
+    assert headings == ["2.1 Objet", "2.2 Durée", "2.3 Loyer"]
+
+
+def test_numbered_list_items_are_not_headings():
+    clauses = split_into_clauses("ARTICLE 1 - Parties\n1) les parties conviennent\n2.5 millions d'euros\n")
+
+    assert [clause.heading for clause in clauses] == ["ARTICLE 1 - Parties"]
+
+
+def test_compact_prompt_sends_only_differing_clauses():
+    files = [{"name": "a.pdf", "content": contract("12 000")}, {"name": "b.pdf", "content": contract("13 500")}]
+
+    prompt, stats = build_comparison_prompt("Compare", files)
+
+    assert stats["compact"] and stats["identical"] == 2 and stats["different"] == 1
+    assert len(prompt) < len(build_files_prompt("Compare", files))
+
+
+def test_contracts_without_headings_fall_back_to_full_text():
+    files = [{"name": "a.txt", "content": "Texte libre sans titres. " * 40},
+             {"name": "b.txt", "content": "Autre texte libre sans titres. " * 40}]
+
+    prompt, stats = build_comparison_prompt("Compare", files)
+
+    assert not stats["compact"]
+    assert prompt == build_files_prompt("Compare", files)
@@ -0,0 +1,52 @@
+import asyncio
+
+import functions
+from functions import ContractIndex
+
+
+MAINTENANCE = [
+    "ARTICLE 4 - Pénalités de retard. En cas de retard d'intervention, le prestataire verse des pénalités "
+    "de 1 % par jour ouvré, plafonnées à 10 % du montant annuel de la maintenance.",
+    "ARTICLE 9 - Résiliation. Le contrat peut être résilié avec un préavis de trois mois."
+]
+LEASE = ["ARTICLE 2 - Loyer. Le loyer annuel est révisé selon l'indice des loyers commerciaux."]
+
+
+def make_index():
+    index = ContractIndex(":memory:")
+    index.add_document("maintenance.pdf", "sha-maintenance", MAINTENANCE, owner="alice")
+    index.add_document("bail.pdf", "sha-bail", LEASE, owner="bob")
+    return index
+
+
+def test_natural_question_finds_the_matching_clause():
+    results = make_index().search("Quels sont les plafonds des pénalités de retard ?", owner="alice")
+
+    assert [result["name"] for result in results] == ["maintenance.pdf"]
+    assert "**" in results[0]["snippet"]
+
+
+def test_weak_matches_are_rejected():
+    # Un seul terme sur quatre en commun avec le document
+    assert make_index().search("résiliation anticipée indemnité forfaitaire", owner="alice", min_score=0.5) == []
+
+
+def test_results_are_scoped_to_the_owner():
+    index = make_index()
+
+    assert index.search("pénalités de retard", owner="bob") == []
+    index.add_document("maintenance.pdf", "sha-maintenance", MAINTENANCE, owner="bob")
+    assert [result["name"] for result in index.search("pénalités de retard", owner="bob")] == ["maintenance.pdf"]
+
+
+def test_sequence_step_searches_the_user_question(monkeypatch):
+    queries = []
+    monkeypatch.setattr(functions, "lookup_local_index", lambda query: queries.append(query) or "résultat local")
+
+    response = asyncio.run(functions.execute_agent(
+        "index_search", functions.AGENTS["index_search"], "Réponse complète de l'agent précédent…",
+        index_query="pénalités de retard"
+    ))
+
+    assert response == "résultat local"
+    assert queries == ["pénalités de retard"]
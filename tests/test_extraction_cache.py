@@ -0,0 +1,27 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import functions
+from functions import ExtractionCache
+
+
+def test_failed_extraction_is_submitted_again(monkeypatch):
+    attempts = []
+
+    def flaky_extract(data, file_name, mime_type, ocr):
+        attempts.append(file_name)
+        if len(attempts) == 1:
+            raise RuntimeError("OCR indisponible")
+        return "document"
+
+    monkeypatch.setattr(functions, "extract_document", flaky_extract)
+    cache = ExtractionCache()
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        first = cache.get_or_submit(executor, ("file", True), lambda: b"%PDF", "contrat.pdf", "application/pdf")
+        assert isinstance(first.exception(timeout=5), RuntimeError)
+
+        retry = cache.get_or_submit(executor, ("file", True), lambda: b"%PDF", "contrat.pdf", "application/pdf")
+        assert retry.result(timeout=5) == "document"
+        # Une extraction réussie reste en cache
+        assert cache.get_or_submit(executor, ("file", True), lambda: b"%PDF", "contrat.pdf", "application/pdf") is retry
+
+    assert len(attempts) == 2
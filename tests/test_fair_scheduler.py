@@ -0,0 +1,79 @@
+from functions import FairAgentScheduler
+
+
+def granted(tickets):
+    return [ticket for ticket in tickets if ticket.granted_at is not None]
+
+
+def make_scheduler(**kwargs):
+    return FairAgentScheduler(weights={"interactive": 4.0, "batch": 1.0}, **kwargs)
+
+
+def drain(scheduler, holder, queued):
+    """Libère les appels un par un et retourne l'ordre de service des tickets en file"""
+    order = []
+    current = holder
+    while current is not None:
+        scheduler.release(current)
+        current = next((ticket for ticket in granted(queued) if ticket not in order), None)
+        if current is not None:
+            order.append(current)
+    return order
+
+
+def test_users_are_served_fairly_rather_than_first_come():
+    scheduler = make_scheduler(max_concurrent=1, interactive_reserved=0)
+    holder = scheduler.submit("holder", "quality")
+    queued = [scheduler.submit("alice", "quality") for _ in range(3)] + [scheduler.submit("bob", "quality")]
+    assert granted(queued) == []
+
+    order = drain(scheduler, holder, queued)
+
+    # Bob, arrivé en dernier, passe avant les deuxième et troisième appels d'Alice
+    assert [ticket.tenant for ticket in order] == ["alice", "bob", "alice", "alice"]
+
+
+def test_interactive_calls_overtake_queued_batch_calls():
+    scheduler = make_scheduler(max_concurrent=1, interactive_reserved=0)
+    holder = scheduler.submit("lot", "quality", "batch")
+    batch = [scheduler.submit("lot", "quality", "batch") for _ in range(3)]
+    interactive = scheduler.submit("alice", "quality", "interactive")
+
+    order = drain(scheduler, holder, batch + [interactive])
+
+    assert order[0] is interactive
+    assert order[1:] == batch
+
+
+def test_reserved_slots_are_only_for_interactive_calls():
+    scheduler = make_scheduler(max_concurrent=3, interactive_reserved=1)
+    batch = [scheduler.submit(f"lot-{i}", "quality", "batch") for i in range(3)]
+
+    assert granted(batch) == batch[:2]
+    interactive = scheduler.submit("alice", "quality", "interactive")
+    assert interactive.granted_at is not None
+    # Tout est occupé : un second appel interactif attend aussi
+    assert scheduler.submit("bob", "quality", "interactive").granted_at is None
+
+    scheduler.release(interactive)
+    # La place réservée libérée va à l'appel interactif en file, pas au lot
+    assert batch[2].granted_at is None
+
+
+def test_cancelled_queued_ticket_is_never_granted():
+    scheduler = make_scheduler(max_concurrent=1, interactive_reserved=0)
+    holder = scheduler.submit("holder", "quality")
+    cancelled = scheduler.submit("alice", "quality")
+    waiting = scheduler.submit("bob", "quality")
+
+    scheduler.release(cancelled)
+    assert cancelled.future.cancelled()
+    scheduler.release(holder)
+
+    assert cancelled.granted_at is None
+    assert waiting.granted_at is not None
+    assert waiting.future.result(timeout=0) is waiting
+    interactive = {row["classe"]: row for row in scheduler.report()}["interactive"]
+    assert interactive["en_cours"] == 1 and interactive["en_file"] == 0
+    scheduler.release(cancelled)  # Double libération sans effet
+    assert {row["classe"]: row for row in scheduler.report()}["interactive"]["en_cours"] == 1
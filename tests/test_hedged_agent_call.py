@@ -0,0 +1,114 @@
+import asyncio
+import threading
+
+import functions
+
+
+class StalledCompletion:
+    """Flux qui ne produit rien tant qu'il n'est pas fermé"""
+
+    def __init__(self):
+        self.closed = threading.Event()
+
+    def __iter__(self):
+        # Comme un flux d'événements botocore : la lecture (et non iter()) bloque jusqu'au premier événement
+        self.closed.wait(5)
+        yield from ()
+
+    def close(self):
+        self.closed.set()
+
+
+class StubClient:
+    """Client Bedrock factice : l'appel principal répond ou reste bloqué, le doublon répond aussitôt"""
+
+    def __init__(self, primary_stalls: bool):
+        self.primary_stalls = primary_stalls
+        self.calls = []
+        self.stalled = StalledCompletion()
+
+    def invoke_agent(self, **params):
+        self.calls.append(params)
+        if len(self.calls) == 1 and self.primary_stalls:
+            return {"completion": self.stalled, "sessionId": params["sessionId"]}
+        text = "réponse principale" if len(self.calls) == 1 else "réponse du doublon"
+        return {"completion": [{"chunk": {"bytes": text.encode()}}], "sessionId": params["sessionId"]}
+
+
+def invoke_params():
+    return {"agentId": "id", "agentAliasId": "alias", "sessionId": "primary", "inputText": "question", "endSession": False}
+
+
+def test_primary_answers_before_hedge_delay(monkeypatch):
+    monkeypatch.setattr(functions, "HEDGE_DEFAULT_DELAY", 5.0)
+    client = StubClient(primary_stalls=False)
+
+    parsed, timings, hedge_won = asyncio.run(functions.hedged_agent_call(client, "quality", invoke_params()))
+
+    assert parsed.final_response == "réponse principale"
+    assert not hedge_won
+    assert len(client.calls) == 1
+    assert timings["first_chunk_ms"] is not None
+
+
+def test_hedge_wins_when_primary_stalls(monkeypatch):
+    monkeypatch.setattr(functions, "HEDGE_DEFAULT_DELAY", 0.05)
+    monkeypatch.setattr(functions, "get_user_id", lambda: "user")
+    ended = []
+    monkeypatch.setattr(functions, "end_ephemeral_session", ended.append)
+    client = StubClient(primary_stalls=True)
+
+    parsed, _, hedge_won = asyncio.run(functions.hedged_agent_call(client, "drafter", invoke_params()))
+
+    assert parsed.final_response == "réponse du doublon"
+    assert hedge_won
+    assert len(client.calls) == 2
+    assert client.calls[1]["sessionId"] != "primary"
+    # Le doublon répond sur une session ouverte, fermée ensuite par un appel séparé
+    assert client.calls[1]["endSession"] is False
+    assert [session.session_id for session in ended] == [client.calls[1]["sessionId"]]
+    # Le perdant, bloqué avant son premier chunk, est fermé sans attendre le read_timeout
+    assert client.stalled.closed.wait(1)
+
+
+def test_hedge_is_not_sent_without_a_free_scheduler_slot(monkeypatch):
+    monkeypatch.setattr(functions, "HEDGE_DEFAULT_DELAY", 0.05)
+    monkeypatch.setattr(functions, "get_user_id", lambda: "user")
+    scheduler = functions.FairAgentScheduler(max_concurrent=2, interactive_reserved=0)
+    monkeypatch.setattr(functions, "get_agent_scheduler", lambda: scheduler)
+    # L'appel principal occupe une place, un autre utilisateur la seconde
+    primary_ticket = scheduler.submit("user", "writer")
+    other_ticket = scheduler.submit("other", "writer")
+    client = StubClient(primary_stalls=True)
+    threading.Timer(0.3, client.stalled.close).start()
+
+    _, _, hedge_won = asyncio.run(functions.hedged_agent_call(client, "writer", invoke_params()))
+
+    assert not hedge_won
+    assert len(client.calls) == 1
+    scheduler.release(primary_ticket)
+    scheduler.release(other_ticket)
+    assert scheduler.report()[0]["en_cours"] == 0
+
+
+def test_context_session_is_ended_when_the_hedge_wins(monkeypatch, session_state):
+    monkeypatch.setattr(functions, "HEDGE_DEFAULT_DELAY", 0.05)
+    monkeypatch.setattr(functions, "get_user_id", lambda: "user")
+    session_state(debug_mode=False, context_mode=True)
+    monkeypatch.setitem(functions.AGENT_IDS, "drafter", "agent-id")
+    monkeypatch.setitem(functions.AGENT_ALIAS_IDS, "drafter", "alias-id")
+    manager = functions.BedrockSessionManager()
+    monkeypatch.setattr(functions, "get_session_manager", lambda: manager)
+    monkeypatch.setattr(functions, "get_circuit_breakers", lambda: functions.CircuitBreakerRegistry())
+    ended = []
+    monkeypatch.setattr(functions, "end_sessions_in_background", ended.extend)
+    client = StubClient(primary_stalls=True)
+    monkeypatch.setattr(functions, "get_bedrock_client", lambda: client)
+
+    response = asyncio.run(functions.execute_agent("drafter", functions.AGENTS["drafter"], "question", hedge=True))
+
+    assert response == "réponse du doublon"
+    primary_session_id = client.calls[0]["sessionId"]
+    # Session de contexte fermée et oubliée : le prochain appel repart d'une session neuve
+    assert primary_session_id in [session.session_id for session in ended]
+    assert manager.user_sessions("user") == []
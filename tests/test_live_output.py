@@ -0,0 +1,74 @@
+import asyncio
+
+import pytest
+
+import functions
+from functions import LiveAgentOutput, ScriptControlException, TurnCancellation
+
+
+class Placeholder:
+    def __init__(self):
+        self.text = None
+
+    def markdown(self, text):
+        self.text = text
+
+    def caption(self, text):
+        self.text = text
+
+
+def test_repeated_agent_keeps_one_column_per_step():
+    placeholders = {0: Placeholder(), 1: Placeholder(), 2: Placeholder()}
+    live_output = LiveAgentOutput(placeholders)
+    # Séquence quality -> drafter -> quality
+    live_output.sink(0)("premier passage")
+    live_output.finalize(0, "premier passage")
+    live_output.sink(2)("second passage")
+    live_output.flush()
+
+    assert placeholders[0].text == "premier passage"
+    assert placeholders[1].text is None
+    assert placeholders[2].text == "second passage ▌"
+
+
+class RerunningOutput:
+    """Affichage interrompu par un rerun de Streamlit"""
+
+    def flush(self):
+        raise ScriptControlException()
+
+
+def test_rerun_during_last_flush_cancels_the_turn(monkeypatch):
+    cancellation = TurnCancellation()
+    monkeypatch.setattr(functions, "current_turn_cancellation", lambda: cancellation)
+    monkeypatch.setattr(functions, "current_live_output", lambda: RerunningOutput())
+
+    async def finished_call():
+        future = asyncio.get_running_loop().create_future()
+        future.set_result("réponse")
+        return await functions.await_cancellable(future)
+
+    with pytest.raises(asyncio.CancelledError):
+        asyncio.run(finished_call())
+    assert cancellation.cancelled
+
+
+def test_repeated_agent_keeps_every_step_result(monkeypatch, session_state):
+    answers = iter(["premier avis", "ébauche", "second avis"])
+    cancellation = TurnCancellation()
+
+    async def fake_execute_agent(agent_key, agent_info, message_content, **kwargs):
+        return next(answers)
+
+    monkeypatch.setattr(functions, "execute_agent", fake_execute_agent)
+    monkeypatch.setattr(functions, "current_turn_cancellation", lambda: cancellation)
+    monkeypatch.setattr(functions, "current_live_output", lambda: None)
+    session_state(agent_sequence=["quality", "drafter", "quality"])
+
+    result = asyncio.run(functions.run_sequential_pipeline("question"))
+
+    assert list(result.agent_results.values()) == ["premier avis", "ébauche", "second avis"]
+    assert result.combined.index("premier avis") < result.combined.index("ébauche") < result.combined.index("second avis")
+    interrupted = functions.PipelineResult.interrupted(cancellation.partial_results)
+    assert interrupted.selected_agents == ("quality", "drafter", "quality")
+    assert "premier avis" in interrupted.combined and "second avis" in interrupted.combined
@@ -0,0 +1,43 @@
+import asyncio
+
+import functions
+from functions import shard_document
+
+
+def contract(lengths):
+    return "\n\n".join(f"ARTICLE {i + 1} - Clause {i + 1}\n" + "x" * length for i, length in enumerate(lengths))
+
+
+def test_editing_one_clause_keeps_later_shards():
+    lengths = [300 + (i * 37) % 500 for i in range(80)]
+    original = shard_document("contrat", contract(lengths), max_chars=3000)
+    lengths[5] += 700
+    edited = shard_document("contrat", contract(lengths), max_chars=3000)
+
+    assert len(original) > 5
+    assert all(len(text) <= 3000 for _, text in edited)
+    unchanged = set(original) & set(edited)
+    assert len(unchanged) >= len(original) - 2
+
+
+def test_failed_shards_are_not_reduced_and_progress_stays_in_range(monkeypatch, session_state):
+    prompts = []
+
+    async def fake_execute_agent(agent_key, agent_info, prompt, **kwargs):
+        prompts.append(prompt)
+        if "ARTICLE 2 " in prompt and len(prompts) < 20:
+            return "❌ Erreur Agent Qualité: panne"
+        return "constat " + "y" * 2000
+
+    monkeypatch.setattr(functions, "execute_agent", fake_execute_agent)
+    monkeypatch.setattr(functions, "get_shard_cache", lambda: functions.ShardResultCache())
+    state = session_state()
+    documents = [{"name": "contrat", "content": contract([3000] * 20)}]
+
+    result = asyncio.run(functions.run_map_reduce("Risques ?", documents, "quality"))
+
+    assert not result.error
+    assert "1 en erreur" in result.selection_method
+    assert all("❌" not in prompt for prompt in prompts)
+    progress = [value for name, value in state.assignments if name == "progress_value"]
+    assert progress and all(0 <= value <= 1 for value in progress)
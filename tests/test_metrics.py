@@ -0,0 +1,59 @@
+from functions import AgentMetrics, MetricCounter, MetricHistogram, format_metric_labels
+
+
+def test_label_values_are_escaped():
+    labels = format_metric_labels(("agent", "outcome"), ('qu"al\\ity', "ligne\nsuivante"))
+
+    assert labels == '{agent="qu\\"al\\\\ity",outcome="ligne\\nsuivante"}'
+    assert format_metric_labels((), ()) == ""
+    assert format_metric_labels((), (), 'le="1"') == '{le="1"}'
+
+
+def test_counter_accumulates_per_label_set():
+    counter = MetricCounter("agent_invocations_total", "Appels", ("agent", "outcome"))
+    counter.inc(agent="quality", outcome="ok")
+    counter.inc(agent="quality", outcome="ok")
+    counter.inc(2, agent="legal", outcome="error")
+
+    assert counter.samples() == [
+        'agent_invocations_total{agent="quality",outcome="ok"} 2',
+        'agent_invocations_total{agent="legal",outcome="error"} 2',
+    ]
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = MetricHistogram("agent_latency_seconds", "Durée", ("agent",), buckets=(1, 0.5, 5))
+    for value in (0.2, 0.5, 3, 60, None):
+        histogram.observe(value, agent="quality")
+
+    assert histogram.samples() == [
+        'agent_latency_seconds_bucket{agent="quality",le="0.5"} 2',
+        'agent_latency_seconds_bucket{agent="quality",le="1"} 2',
+        'agent_latency_seconds_bucket{agent="quality",le="5"} 3',
+        'agent_latency_seconds_bucket{agent="quality",le="+Inf"} 4',
+        'agent_latency_seconds_sum{agent="quality"} 63.7',
+        'agent_latency_seconds_count{agent="quality"} 4',
+    ]
+
+
+def test_render_exposes_help_type_and_gauges():
+    metrics = AgentMetrics()
+    metrics.agent_invocations.inc(agent="quality", outcome="ok")
+    metrics.register_gauge("scheduler_queue_depth", "Appels en attente", lambda: {("interactive",): 3}, ("class",))
+    metrics.register_gauge("streamlit_sessions_active", "Sessions", lambda: None)
+    metrics.register_gauge("bedrock_sessions_active", "Sessions Bedrock", lambda: 1 / 0)
+
+    lines = metrics.render().splitlines()
+
+    assert "# HELP agent_invocations_total Appels d'agents Bedrock par résultat" in lines
+    assert "# TYPE agent_invocations_total counter" in lines
+    assert "# TYPE agent_latency_seconds histogram" in lines
+    assert 'agent_invocations_total{agent="quality",outcome="ok"} 1' in lines
+    assert "# TYPE scheduler_queue_depth gauge" in lines
+    assert 'scheduler_queue_depth{class="interactive"} 3' in lines
+    # Jauge sans valeur ou en erreur : en-têtes seuls, aucun échantillon
+    assert not any(line.startswith(("streamlit_sessions_active", "bedrock_sessions_active")) for line in lines)
+    # Chaque échantillon suit les en-têtes de sa métrique
+    help_index = lines.index("# HELP scheduler_queue_depth Appels en attente")
+    assert lines[help_index + 1] == "# TYPE scheduler_queue_depth gauge"
+    assert lines[help_index + 2] == 'scheduler_queue_depth{class="interactive"} 3'
@@ -0,0 +1,32 @@
+from functions import normalize_pages
+
+
+def contract_pages():
+    return [
+        "ACME SA - Contrat de services - Page 1/3\nARTICLE 1 - Objet\nLe prestataire fournit les services.\n2024\n1",
+        "ACME SA - Contrat de services - Page 2/3\nARTICLE 3 - Prix\nLe prix est fixe.\nARTICLE 4 - Durée\n2",
+        "ACME SA - Contrat de services - Page 3/3\nARTICLE 5 - Fin\nTexte final du contrat.\nARTICLE 6 - Loi\n3",
+    ]
+
+
+def test_repeated_header_and_page_numbers_are_removed():
+    text, stats = normalize_pages(contract_pages())
+
+    assert "ACME SA" not in text
+    assert stats.boilerplate_lines == 3
+    assert stats.page_numbers == 3
+
+
+def test_clause_headings_and_years_are_kept():
+    text, _ = normalize_pages(contract_pages())
+
+    for heading in ("ARTICLE 1 - Objet", "ARTICLE 3 - Prix", "ARTICLE 4 - Durée", "ARTICLE 5 - Fin", "ARTICLE 6 - Loi"):
+        assert heading in text
+    assert "2024" in text.splitlines()
+
+
+def test_short_documents_are_left_untouched():
+    text, stats = normalize_pages(["En-tête\nCorps\n1", "En-tête\nSuite\n2"])
+
+    assert text.splitlines() == ["En-tête", "Corps", "1", "En-tête", "Suite", "2"]
+    assert stats.boilerplate_lines == 0 and stats.page_numbers == 0
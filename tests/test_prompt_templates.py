@@ -0,0 +1,63 @@
+import pytest
+
+import functions
+from functions import PromptTemplate, PromptTemplateRegistry, DEFAULT_PROMPT_TEMPLATES
+
+
+@pytest.mark.parametrize("purpose, text", [
+    ("execute", "Question sans champ"),
+    ("execute", "{query} {text}"),
+    ("sequence_followup", "Réponse précédente: {previous}"),
+    ("reduce", "{query} {}"),
+    ("summary", "{query}"),
+])
+def test_invalid_templates_are_rejected(purpose, text):
+    with pytest.raises(ValueError):
+        PromptTemplate("quality", purpose, text)
+
+
+def test_valid_template_precomputes_fields_and_prefix():
+    template = PromptTemplate("quality", "sequence_followup", "Contexte: {previous}\n\nQuestion: {query}")
+
+    assert template.fields == {"previous", "query"}
+    assert template.prefix == "Contexte: "
+    assert template.overhead_tokens > 0
+    assert template.render(previous="A", query="B") == "Contexte: A\n\nQuestion: B"
+
+
+def test_invalid_overrides_are_ignored_with_a_warning(monkeypatch):
+    warnings = []
+    monkeypatch.setattr(functions.st, "secrets", {"prompts": {
+        "quality": {"execute": "Vérifie la qualité : {query}", "reduce": "{query} sans constats"},
+        "legal": {"unknown_purpose": "{query}"},
+    }})
+    monkeypatch.setattr(functions.st, "warning", warnings.append)
+
+    registry = functions.load_prompt_templates()
+
+    assert registry.render("quality", "execute", query="Q") == "Vérifie la qualité : Q"
+    # La surcharge invalide laisse le gabarit par défaut en place
+    assert registry.get("quality", "reduce") is registry.get("default", "reduce")
+    assert len(warnings) == 2
+    assert all("Gabarit de prompt ignoré" in warning for warning in warnings)
+
+
+def test_unreadable_secrets_fall_back_to_defaults(monkeypatch):
+    class BrokenSecrets:
+        def get(self, *args):
+            raise FileNotFoundError("secrets.toml")
+
+    monkeypatch.setattr(functions.st, "secrets", BrokenSecrets())
+    registry = functions.load_prompt_templates()
+
+    assert registry.render("legal", "execute", query="Q") == "Q"
+
+
+def test_router_prompt_is_not_wrapped_twice():
+    registry = PromptTemplateRegistry(DEFAULT_PROMPT_TEMPLATES)
+
+    wrapped = registry.render("router", "execute", query="Analyse ce contrat")
+    assert wrapped != "Analyse ce contrat"
+    assert "Task: Analyse ce contrat" in wrapped
+    assert registry.render("router", "execute", query=wrapped) == wrapped
+    assert functions.optimize_prompt_for_router(wrapped) == wrapped
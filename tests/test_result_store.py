@@ -0,0 +1,64 @@
+import zlib
+
+import functions
+from functions import ResultStore
+
+
+def test_identical_texts_are_stored_once():
+    store = ResultStore(threshold=16)
+    text = "Clause de résiliation conforme. " * 50
+
+    first = store.put(text)
+    second = store.put(text)
+
+    assert first == second
+    assert store.dedup_hits == 1
+    assert store.report()["entries"] == 1
+    assert store.get(first) == text
+
+
+def test_blob_is_dropped_after_its_last_reference():
+    store = ResultStore()
+    digest = store.put("Réponse partagée par deux tours")
+    store.put("Réponse partagée par deux tours")
+
+    store.release(digest)
+    assert store.get(digest) == "Réponse partagée par deux tours"
+
+    store.release(digest)
+    assert store.get(digest) is None
+    assert store.report()["stored_bytes"] == 0
+    store.release(digest)  # Libération d'un bloc absent sans effet
+
+
+def test_oldest_blobs_are_evicted_first():
+    # Seuil de compression hors d'atteinte : chaque bloc occupe exactement sa taille brute
+    store = ResultStore(max_bytes=250, threshold=10_000)
+    first = store.put("a" * 100)
+    second = store.put("b" * 100)
+    store.put("a" * 100)  # Réutilisé : redevient le plus récent
+    third = store.put("c" * 100)
+
+    assert store.get(second) is None
+    assert store.get(first) == "a" * 100
+    assert store.get(third) == "c" * 100
+    assert store.evictions == 1
+    assert store.report()["stored_bytes"] == 200
+
+
+def test_zlib_is_used_without_zstandard(monkeypatch):
+    monkeypatch.setattr(functions, "ZSTD_AVAILABLE", False)
+    store = ResultStore(threshold=16)
+    text = "Analyse détaillée du contrat. " * 100
+
+    digest = store.put(text)
+    blob = store._blobs[digest]
+
+    assert blob.codec == "zlib"
+    assert zlib.decompress(blob.data).decode("utf-8") == text
+    assert len(blob.data) < blob.raw_size
+    assert store.get(digest) == text
+    assert store.report()["codec"] == "zlib"
+    # Les textes courts restent tels quels
+    short = store.put("OK")
+    assert store._blobs[short].codec == "raw"
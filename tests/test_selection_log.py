@@ -0,0 +1,39 @@
+import sqlite3
+import time
+
+from functions import SelectionLog
+
+
+def test_only_router_and_manual_turns_train_the_classifier():
+    log = SelectionLog(":memory:")
+    answer = "r" * 200
+    log.record("quelles pénalités ?", ["quality"], "router", True, 2000, len(answer))
+    log.record("rédige une clause", ["drafter"], "manual", True, 2000, len(answer))
+    log.record("compare les prix", ["market_comparison"], "adaptive", True, 2000, len(answer))
+
+    assert sorted(agent for _, agent in log.training_examples()) == ["drafter", "quality"]
+
+
+def test_slow_or_thin_turns_are_not_training_examples():
+    log = SelectionLog(":memory:")
+    log.record("lente", ["quality"], "router", True, 10 * 60 * 1000, 500)
+    log.record("vide", ["quality"], "router", True, 2000, 5)
+    log.record("bonne", ["quality"], "router", True, 2000, 500)
+
+    assert log.training_examples() == [("bonne", "quality")]
+
+
+def test_expired_turns_are_purged_and_old_journals_migrated(tmp_path):
+    path = str(tmp_path / "selection.sqlite3")
+    with sqlite3.connect(path) as conn:
+        conn.execute("CREATE TABLE turns (id INTEGER PRIMARY KEY AUTOINCREMENT, logged_at REAL NOT NULL, query TEXT NOT NULL, "
+                     "agents TEXT NOT NULL, source TEXT NOT NULL, success INTEGER NOT NULL, total_ms REAL)")
+        conn.execute("INSERT INTO turns (logged_at, query, agents, source, success) VALUES (?, 'ancienne', 'quality', 'router', 1)",
+                     (time.time() - 90 * 86400,))
+        conn.execute("INSERT INTO turns (logged_at, query, agents, source, success) VALUES (?, 'récente', 'quality', 'router', 1)",
+                     (time.time(),))
+
+    log = SelectionLog(path, retention_days=30)
+
+    assert log.count() == 1
+    assert log.training_examples() == [("récente", "quality")]
@@ -0,0 +1,89 @@
+import functions
+from functions import BedrockSessionManager
+
+
+class Clock:
+    """Horloge injectée à la place de time.time"""
+
+    def __init__(self, now: float = 1_000_000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class RecordingClient:
+    def __init__(self):
+        self.calls = []
+
+    def invoke_agent(self, **params):
+        self.calls.append(params)
+        return {"completion": []}
+
+
+class InlineExecutor:
+    """Exécute les tâches de fond immédiatement"""
+
+    def submit(self, fn, *args):
+        fn(*args)
+
+
+def test_idle_sessions_are_collected(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(functions.time, "time", clock)
+    manager = BedrockSessionManager(idle_timeout=60)
+    idle, _ = manager.acquire("alice", "quality")
+    clock.now += 30
+    active, _ = manager.acquire("alice", "legal")
+
+    clock.now += 40
+    assert manager.collect_idle() == [idle]
+    assert manager.user_sessions("alice") == [active]
+
+    clock.now += 30
+    assert manager.collect_idle() == [active]
+    assert manager.active_count() == 0
+
+
+def test_session_is_renewed_past_the_context_limit(monkeypatch):
+    monkeypatch.setattr(functions.time, "time", Clock())
+    manager = BedrockSessionManager(max_context_chars=1000)
+    first, to_end = manager.acquire("alice", "quality")
+    assert to_end == []
+
+    manager.record_turn(first, 400, 500)
+    assert manager.acquire("alice", "quality") == (first, [])
+
+    manager.record_turn(first, 50, 50)
+    renewed, to_end = manager.acquire("alice", "quality")
+    assert to_end == [first]
+    assert renewed.session_id != first.session_id
+    assert renewed.context_chars == 0
+
+
+def test_reset_ends_every_session_of_the_user(monkeypatch):
+    client = RecordingClient()
+    manager = BedrockSessionManager()
+    for agent_key in ("quality", "legal"):
+        monkeypatch.setitem(functions.AGENT_IDS, agent_key, f"{agent_key}-id")
+        monkeypatch.setitem(functions.AGENT_ALIAS_IDS, agent_key, f"{agent_key}-alias")
+    monkeypatch.setattr(functions, "get_session_manager", lambda: manager)
+    monkeypatch.setattr(functions, "get_user_id", lambda: "alice")
+    monkeypatch.setattr(functions, "get_bedrock_client", lambda: client)
+    monkeypatch.setattr(functions, "get_background_executor", lambda: InlineExecutor())
+
+    sessions = [manager.acquire("alice", agent_key)[0] for agent_key in ("quality", "legal")]
+    for session in sessions:
+        manager.record_turn(session, 10, 10)
+    unused, _ = manager.acquire("alice", "risk")
+    other, _ = manager.acquire("bob", "quality")
+    manager.record_turn(other, 10, 10)
+
+    functions.reset_user_sessions()
+
+    assert [call["sessionId"] for call in client.calls] == [s.session_id for s in sessions]
+    assert all(call["endSession"] is True for call in client.calls)
+    # Session jamais utilisée : rien à fermer côté serveur
+    assert unused.session_id not in {call["sessionId"] for call in client.calls}
+    assert manager.user_sessions("alice") == []
+    assert manager.user_sessions("bob") == [other]
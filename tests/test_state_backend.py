@@ -0,0 +1,97 @@
+import time
+
+import pytest
+
+import functions
+from functions import LocalRedisStandIn, PipelineResult, RedisStateBackend, SQLiteStateBackend, StateBackend
+
+
+@pytest.fixture(params=["sqlite", "redis"])
+def backend(request, tmp_path):
+    if request.param == "sqlite":
+        return SQLiteStateBackend(str(tmp_path / "state.sqlite3"))
+    return RedisStateBackend(LocalRedisStandIn())
+
+
+def test_state_backend_is_abstract():
+    with pytest.raises(TypeError):
+        StateBackend()
+
+
+def test_values_roundtrip_and_expire(backend):
+    backend.set("ns", "clé", b"valeur", ttl=0.2)
+    backend.set_json("ns", "json", {"texte": "é"})
+
+    assert backend.get("ns", "clé") == b"valeur"
+    assert backend.get_json("ns", "json") == {"texte": "é"}
+    time.sleep(0.3)
+    assert backend.get("ns", "clé") is None
+    backend.delete("ns", "json")
+    assert backend.get_json("ns", "json") is None
+
+
+@pytest.fixture
+def replica(monkeypatch, session_state):
+    """Session Streamlit simulée d'une réplique partageant le même backend"""
+    shared = RedisStateBackend(LocalRedisStandIn())
+    monkeypatch.setattr(functions, "get_state_backend", lambda: shared)
+
+    def open_tab(query_params, fingerprint="navigateur-a"):
+        state = session_state()
+        monkeypatch.setattr(functions.st, "query_params", query_params)
+        monkeypatch.setattr(functions, "browser_fingerprint", lambda: fingerprint)
+        return state
+
+    return open_tab
+
+
+def conversation(*texts):
+    return [{"role": "assistant", "content": text, "result": PipelineResult(selected_agents=("quality",), combined=text)}
+            for text in texts]
+
+
+def test_conversation_is_restored_by_the_same_browser(replica):
+    url = {}
+    replica(url)
+    functions.save_conversation(conversation("bonjour"))
+
+    replica(dict(url))
+    messages = functions.load_conversation()
+
+    assert [m["content"] for m in messages] == ["bonjour"]
+    assert messages[0]["result"].selected_agents == ("quality",)
+
+
+def test_link_opened_in_another_browser_starts_a_new_conversation(replica):
+    url = {}
+    replica(url)
+    functions.save_conversation(conversation("confidentiel"))
+
+    other_url = dict(url)
+    replica(other_url, fingerprint="navigateur-b")
+
+    assert functions.load_conversation() == []
+    assert other_url["conversation"] != url["conversation"]
+
+
+def test_concurrent_tabs_do_not_overwrite_each_other(replica):
+    url = {}
+    replica(url)
+    functions.save_conversation(conversation("premier"))
+
+    first_tab = replica(dict(url))
+    functions.load_conversation()
+    second_url = dict(url)
+    second_tab = replica(second_url)
+    functions.load_conversation()
+    functions.save_conversation(conversation("premier", "onglet 2"))
+
+    functions.st.session_state = first_tab
+    functions.st.query_params = first_url = dict(url)
+    functions.save_conversation(conversation("premier", "onglet 1"))
+
+    assert first_tab["conversation_forked"]
+    assert first_url["conversation"] != url["conversation"]
+    assert second_tab.get("conversation_forked") is None
+    replica(dict(url))
+    assert [m["content"] for m in functions.load_conversation()] == ["premier", "onglet 2"]